@@ -0,0 +1,106 @@
+"""
+Benchmarks of the bot's hot paths, run from the repository root, e.g.:
+
+    python -m benchmarks.units_of_work
+
+Importing this package points the bot at a throwaway SQLite database in a temporary
+directory, which also becomes the working directory (for the Telegram session and the log
+file), before `models` is imported. Missing Telegram and SSH settings get dummy values;
+nothing connects to Telegram or Redis.
+"""
+
+import os
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="bot-benchmark-")
+os.environ["DB_STRING"] = f"sqlite:///{os.path.join(WORK_DIR, 'benchmark.sqlite')}"
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "benchmark",
+    "BOT_TOKEN": "benchmark",
+    "ADMIN_ID": "1",
+    "SSH_PORT": "22",
+    "SSH_HOSTNAME": "localhost",
+    "GROUP_ID": "0",
+}.items():
+    os.environ.setdefault(key, value)
+os.chdir(WORK_DIR)
+
+
+class FakeEvent:
+    """
+    Stands in for a Telethon message event, recording the responses instead of sending them.
+    """
+
+    def __init__(self, text="", sender_id=None):
+        from resources.constants import ADMIN_ID
+
+        self.message = type("Message", (), {"text": text})()
+        self.raw_text = text
+        self.sender_id = ADMIN_ID if sender_id is None else sender_id
+        self.chat_id = self.sender_id
+        self.responses = []
+
+    async def respond(self, message, *args, **kwargs):
+        self.responses.append(message)
+
+
+def seed_tenants(count, balance_minor=100000, payments=0):
+    """
+    Create users with an active rental each, committed in a single transaction.
+
+    Args:
+        count (int): The number of users.
+        balance_minor (int): The balance of every user, in minor units.
+        payments (int): The number of payments of every user.
+
+    Returns:
+        list[str]: The usernames, "tenant0" to "tenant{count - 1}".
+    """
+    from models import storage
+    from models.payments import Payment
+    from models.rentals import Rental
+    from models.telegram_users import TelegramUser
+    from models.users import User
+
+    now = int(time.time())
+    usernames = []
+    for i in range(count):
+        user = User(
+            linux_username=f"tenant{i}",
+            linux_password="benchmark",
+            balance_minor=balance_minor,
+            last_deduction_time=now - 2 * 86400,
+        )
+        tg_user = TelegramUser(
+            tg_user_id=1000 + i, user_id=user.id, tg_first_name=f"Tenant {i}"
+        )
+        storage.new(user)
+        storage.new(tg_user)
+        storage.new(
+            Rental(
+                user_id=user.id,
+                telegram_user=tg_user.id,
+                start_time=now,
+                end_time=now + 30 * 86400,
+                plan_duration=30 * 86400,
+                amount_minor=300000,
+                currency="INR",
+                price_rate_minor=1000,
+            )
+        )
+        for _ in range(payments):
+            storage.new(Payment(user.id, 3000, "INR"))
+        usernames.append(user.linux_username)
+    storage.save()
+    storage.close()
+    return usernames
+
+
+def percentile(samples, fraction):
+    """
+    Returns:
+        float: The sample below which `fraction` of the (sorted) samples fall.
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
@@ -0,0 +1,124 @@
+"""
+Archive throughput and responsiveness of the bot while /delete_user archives a large home
+directory: the scheduling delay of the event loop and the latency of /status, before and
+during `archive_and_delete_user`.
+
+The home directory is generated under the benchmark's directory, half of it random (as
+media and build artifacts are) and half of it text. The system user is never touched:
+deleting it only removes the generated home directory, as `userdel -r` would. Runs as
+root, as the bot does; without sudo installed, a pass-through `sudo` is put on the PATH.
+
+    python -m benchmarks.archive [--size-mb 2048] [--file-mb 8] [--tenants 100]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import stat
+import time
+
+from benchmarks import WORK_DIR, seed_tenants
+from benchmarks.report_render import measure, report
+
+HOME_ROOT = os.path.join(WORK_DIR, "home")
+ARCHIVE_DIR = os.path.join(WORK_DIR, "archives")
+os.environ["HOME_ROOT"] = HOME_ROOT
+os.environ["ARCHIVE_DIR"] = ARCHIVE_DIR
+
+TEXT = b"".join(
+    f"{i:08d} INFO worker-{i % 16} processed batch {i} in {i % 997}ms\n".encode()
+    for i in range(20000)
+)
+
+
+def generate_home(username, size, file_size):
+    """
+    Fill a home directory with `size` bytes of files of `file_size` bytes, spread over
+    a few subdirectories.
+    """
+    home = os.path.join(HOME_ROOT, username)
+    for index in range(max(1, size // file_size)):
+        directory = os.path.join(home, f"project{index % 8}", f"data{index % 4}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{index}.bin"), "wb") as f:
+            if index % 2:
+                f.write(os.urandom(file_size))
+            else:
+                f.write((TEXT * (file_size // len(TEXT) + 1))[:file_size])
+
+
+def ensure_sudo():
+    if shutil.which("sudo"):
+        return
+    if os.geteuid() != 0:
+        raise SystemExit(
+            "Run as root or install sudo: the archiver runs tar with sudo."
+        )
+    bin_dir = os.path.join(WORK_DIR, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "sudo")
+    with open(path, "w") as f:
+        f.write('#!/bin/sh\nexec "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+
+async def run(tenants, username, size):
+    from models import user_routes
+    from models.archive import HomeArchiver
+    from models.misc import SystemUserManager
+
+    async def delete_system_user(name):
+        await asyncio.to_thread(shutil.rmtree, os.path.join(HOME_ROOT, name))
+        return True
+
+    SystemUserManager.delete_system_user = staticmethod(delete_system_user)
+    print(f"Compressor: {HomeArchiver.get_compressor()}")
+
+    idle = asyncio.get_running_loop().create_future()
+    asyncio.get_running_loop().call_later(2, idle.set_result, None)
+    report("idle", *await measure(tenants, idle))
+
+    started = time.perf_counter()
+    deleting = asyncio.ensure_future(user_routes.archive_and_delete_user(username, 1))
+    delays, latencies = await measure(tenants, deleting)
+    deleting.result()
+    elapsed = time.perf_counter() - started
+    report("archiving", delays, latencies)
+
+    path = HomeArchiver.find_archive(username)
+    if not path or os.path.exists(os.path.join(HOME_ROOT, username)):
+        raise SystemExit("Archiving failed, see the log.")
+    archived = os.path.getsize(path)
+    print(
+        f"Archived and deleted {size / 2**20:.0f} MiB in {elapsed:.2f}s: "
+        f"{size / 2**20 / elapsed:.0f} MiB/s read, "
+        f"{archived / 2**20:.0f} MiB archive ({archived / size:.0%})"
+    )
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--file-mb", type=int, default=8)
+    parser.add_argument("--tenants", type=int, default=100)
+    args = parser.parse_args()
+
+    ensure_sudo()
+    usernames = seed_tenants(args.tenants)
+    size = args.size_mb * 2**20
+    started = time.perf_counter()
+    generate_home(usernames[0], size, args.file_mb * 2**20)
+    print(
+        f"Generated a {args.size_mb} MiB home directory in "
+        f"{time.perf_counter() - started:.1f}s"
+    )
+    random.seed(0)
+    asyncio.run(run(args.tenants, usernames[0], size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Hit rate and Telegram API calls of the entity cache, against a fake client charging a fixed
+latency per call:
+
+- rendering the profiles of every linked tenant (as /list_users and the expiry messages do)
+  several times, with the background refresh running in between;
+- resolving the profiles of a skewed stream of per-message lookups (as notify_rental and
+  /extend_plan do), compared with resolving each one through the API.
+
+    python -m benchmarks.entity_cache [--tenants 500] [--renders 5] [--lookups 20000]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks import seed_tenants
+
+
+class FakeClient:
+    """
+    Resolves any Telegram ID, counting the API calls and the time they would take.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def get_entity(self, user_id):
+        self.calls += 1
+        if isinstance(user_id, list):
+            return [self.entity(i) for i in user_id]
+        return self.entity(user_id)
+
+    @staticmethod
+    def entity(user_id):
+        return SimpleNamespace(
+            id=user_id, username=f"user{user_id}", first_name="Tenant", last_name=None
+        )
+
+    def api_time(self):
+        return self.calls * self.latency
+
+
+async def run(tenants, renders, lookups, latency):
+    from models import storage
+    from models.entity_cache import EntityCache
+
+    telegram_users = list(storage.all("TelegramUser").values())
+    storage.close()
+
+    client = FakeClient(latency)
+    cache = EntityCache(client)
+    started = time.perf_counter()
+    for _ in range(renders):
+        for telegram_user in telegram_users:
+            cache.get_cached(telegram_user)
+        await cache.refresh()
+    elapsed = time.perf_counter() - started
+    hits, misses = cache.stats["hits"], cache.stats["misses"]
+    print(
+        f"{renders} renders of {tenants} profiles: hit rate {hits / (hits + misses):.1%}, "
+        f"{client.calls} API call(s) (~{client.api_time():.1f}s) in the background refresh, "
+        f"0 while rendering, {elapsed * 1000 / renders:.1f}ms per render; "
+        f"{tenants * renders} calls (~{tenants * renders * latency:.1f}s) uncached"
+    )
+
+    # Per-message lookups, most of them for a few active tenants
+    ids = [telegram_user.tg_user_id for telegram_user in telegram_users]
+    weights = [1 / rank for rank in range(1, len(ids) + 1)]
+    stream = random.choices(ids, weights, k=lookups)
+    client = FakeClient(latency)
+    cache = EntityCache(client)
+    for user_id in stream:
+        await cache.get(user_id)
+    hits, misses = cache.stats["hits"], cache.stats["misses"]
+    print(
+        f"{lookups} per-message lookups: hit rate {hits / (hits + misses):.1%}, "
+        f"{client.calls} API call(s) (~{client.api_time():.1f}s); "
+        f"{lookups} calls (~{lookups * latency:.1f}s) uncached"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=500)
+    parser.add_argument("--renders", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    seed_tenants(args.tenants)
+    random.seed(0)
+    asyncio.run(run(args.tenants, args.renders, args.lookups, args.latency))
+
+
+if __name__ == "__main__":
+    main()
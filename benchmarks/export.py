@@ -0,0 +1,82 @@
+"""
+Time and memory of /export for a large payments table:
+
+    python -m benchmarks.export [--payments 1000000] [--format csv]
+"""
+
+import argparse
+import os
+import resource
+import time
+import uuid
+from datetime import datetime
+
+from benchmarks import WORK_DIR, seed_tenants
+
+SEED_BATCH_SIZE = 10000
+
+
+def seed_payments(count, user_ids):
+    """
+    Insert payments spread over the given users, bypassing the ORM to seed quickly.
+    """
+    from sqlalchemy import insert
+
+    from models import storage
+    from models.payments import Payment
+
+    now = datetime.utcnow()
+    timestamp = int(time.time())
+    for start in range(0, count, SEED_BATCH_SIZE):
+        storage.execute(
+            insert(Payment.__table__),
+            [
+                {
+                    "id": str(uuid.uuid4()),
+                    "created_at": now,
+                    "updated_at": now,
+                    "user_id": user_ids[i % len(user_ids)],
+                    "amount": 50000 + i % 1000,
+                    "currency": "INR",
+                    "payment_date": timestamp - i,
+                    "exchange_rate": 1.0,
+                }
+                for i in range(start, min(start + SEED_BATCH_SIZE, count))
+            ],
+        )
+        storage.save()
+    storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payments", type=int, default=1000000)
+    parser.add_argument("--format", default="csv")
+    args = parser.parse_args()
+
+    from models import storage
+    from models.exports import Exporter
+
+    seed_tenants(100)
+    user_ids = [user.id for user in storage.all("User").values()]
+    storage.close()
+    started = time.perf_counter()
+    seed_payments(args.payments, user_ids)
+    print(f"Seeded {args.payments} payments in {time.perf_counter() - started:.1f}s")
+
+    exporter = Exporter("payments", args.format)
+    path = os.path.join(WORK_DIR, exporter.file_name)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    exporter.write(path)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Exported {exporter.rows} payments to {args.format} in {elapsed:.2f}s "
+        f"({exporter.rows / elapsed:,.0f} rows/s), {os.path.getsize(path) / 2**20:.1f} MiB, "
+        f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB "
+        f"({rss / 1024:.0f} MiB before)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Latency of /status, the most frequent tenant request, with and without the lookup cache:
+
+- uncached: a change to the rentals is committed before every request, so every lookup
+  misses and reads the database, as every request did before the cache;
+- cached: the lookups of all tenants are cached first.
+
+Requests come from random tenants, a few at a time, each in a unit of work as the
+dispatcher runs them. The lookups are only cached in memory unless a Redis URL is given.
+
+    python -m benchmarks.lookup_cache [--tenants 1000] [--requests 5000] [--concurrency 50] [--redis redis://localhost]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import FakeEvent, percentile, seed_tenants
+
+
+async def run(tenants, requests, concurrency, invalidate):
+    from models import lookup_cache, storage, system_routes
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def status(tg_user_id):
+        async with semaphore:
+            if invalidate:
+                # What a commit touching the rentals does
+                lookup_cache.invalidate([("Rental", None, "insert", [], None)])
+            event = FakeEvent("/status", sender_id=tg_user_id)
+            started = time.perf_counter()
+            async with storage.unit_of_work():
+                await system_routes.user_status(event)
+            latencies.append(time.perf_counter() - started)
+            assert "Plan Details" in event.responses[-1], event.responses
+
+    senders = [1000 + random.randrange(tenants) for _ in range(requests)]
+    started = time.perf_counter()
+    await asyncio.gather(*(status(tg_user_id) for tg_user_id in senders))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return latencies, elapsed
+
+
+async def main_async(args):
+    from models import lookup_cache
+
+    if args.redis:
+        import redis.asyncio as redis
+
+        await lookup_cache.start(redis.from_url(args.redis))
+
+    for name, invalidate in (("uncached", True), ("cached", False)):
+        if not invalidate:
+            # Warm up the cache with every tenant's lookup
+            await run(args.tenants, args.tenants * 5, args.concurrency, False)
+        stats = dict(lookup_cache.stats)
+        latencies, elapsed = await run(
+            args.tenants, args.requests, args.concurrency, invalidate
+        )
+        misses = lookup_cache.stats["misses"] - stats["misses"]
+        print(
+            f"{name}: {args.requests} requests in {elapsed:.2f}s "
+            f"({args.requests / elapsed:,.0f} req/s), "
+            f"p50 {percentile(latencies, 0.5) * 1000:.3f}ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.3f}ms, "
+            f"max {latencies[-1] * 1000:.3f}ms, {misses} database lookup(s)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--redis", help="Also cache the lookups in this Redis")
+    args = parser.parse_args()
+
+    seed_tenants(args.tenants)
+    random.seed(0)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
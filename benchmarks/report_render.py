@@ -0,0 +1,79 @@
+"""
+Responsiveness of the bot while /gen_report renders the PDF of thousands of users:
+the scheduling delay of the event loop and the latency of /status, before and during
+the rendering.
+
+    python -m benchmarks.report_render [--tenants 5000]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import FakeEvent, percentile, seed_tenants
+
+TICK = 0.01
+
+
+async def measure(tenants, until):
+    """
+    Sample the event loop's scheduling delay and the latency of /status until a future is done.
+
+    Returns:
+        tuple[list, list]: The delays and the latencies, in seconds, sorted.
+    """
+    from models import system_routes
+
+    delays, latencies = [], []
+    while not until.done():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        delays.append(time.perf_counter() - started - TICK)
+
+        started = time.perf_counter()
+        await system_routes.user_status(
+            FakeEvent(sender_id=1000 + random.randrange(tenants))
+        )
+        latencies.append(time.perf_counter() - started)
+    return sorted(delays), sorted(latencies)
+
+
+def report(label, delays, latencies):
+    print(
+        f"{label:>14}: loop delay p50 {percentile(delays, 0.5) * 1000:.2f}ms "
+        f"p99 {percentile(delays, 0.99) * 1000:.2f}ms max {delays[-1] * 1000:.2f}ms, "
+        f"/status p50 {percentile(latencies, 0.5) * 1000:.2f}ms "
+        f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms max {latencies[-1] * 1000:.2f}ms "
+        f"({len(latencies)} requests)"
+    )
+
+
+async def run(tenants):
+    from models.reports import ReportRenderer
+
+    idle = asyncio.get_running_loop().create_future()
+    asyncio.get_running_loop().call_later(2, idle.set_result, None)
+    report("idle", *await measure(tenants, idle))
+
+    started = time.perf_counter()
+    rendering = asyncio.ensure_future(ReportRenderer().render())
+    delays, latencies = await measure(tenants, rendering)
+    pdf = rendering.result()
+    elapsed = time.perf_counter() - started
+    report("rendering", delays, latencies)
+    print(f"Rendered {tenants} users ({len(pdf) / 1024:.0f} KiB) in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=5000)
+    args = parser.parse_args()
+
+    seed_tenants(args.tenants, payments=2)
+    random.seed(0)
+    asyncio.run(run(args.tenants))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Commits per command and memory held over a long run, with every command and job in a
+unit of work of its own (as the dispatcher and the scheduler run them) and with the
+commands sharing the thread's session, committing on every save:
+
+    python -m benchmarks.units_of_work [--tenants 200] [--commands 5000]
+"""
+
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from benchmarks import FakeEvent, seed_tenants
+
+
+def live_objects():
+    """
+    Returns:
+        int: The number of model instances alive.
+    """
+    from models.baseModel import Base
+
+    gc.collect()
+    return sum(isinstance(obj, Base) for obj in gc.get_objects())
+
+
+async def run(units, usernames, commands):
+    from sqlalchemy import event
+
+    from models import job_manager, payment_routes, storage
+
+    commits = []
+    engine = storage._DBStorage__engine
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+
+    async def command(handler, *args):
+        if units:
+            async with storage.unit_of_work():
+                await handler(*args)
+        else:
+            await handler(*args)
+
+    try:
+        start = len(commits)
+        await command(job_manager.deduct_daily_rental)
+        deduction_commits = len(commits) - start
+
+        random.seed(0)
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start, started_at = len(commits), time.perf_counter()
+        for _ in range(commands):
+            username = random.choice(usernames)
+            await command(
+                payment_routes.credit_payment,
+                FakeEvent(f"/credit {username} 10 INR"),
+            )
+        elapsed = time.perf_counter() - started_at
+        credit_commits = (len(commits) - start) / commands
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        objects = live_objects()
+    finally:
+        event.remove(engine, "commit", listener)
+        storage.close()
+
+    label = "unit of work" if units else "shared session"
+    print(
+        f"{label:>14}: deduction {deduction_commits} commit(s), "
+        f"/credit {credit_commits:.1f} commit(s) and {elapsed / commands * 1000:.2f}ms each, "
+        f"{retained / 1024:.0f} KiB and {objects} model instances retained "
+        f"after {commands} commands"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--commands", type=int, default=5000)
+    args = parser.parse_args()
+
+    usernames = seed_tenants(args.tenants)
+    for units in (False, True):
+        asyncio.run(run(units, usernames, args.commands))
+        # Due again for the next run
+        from models import storage
+        from models.users import User
+
+        storage.query(User).update(
+            {"last_deduction_time": int(time.time()) - 2 * 86400}
+        )
+        storage.save()
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
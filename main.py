@@ -1,11 +1,26 @@
 import asyncio
 
-from models import bot, job_manager
+from models import (
+    bot,
+    change_feed,
+    exchange_rates,
+    job_manager,
+    lookup_cache,
+    metrics,
+    outbox,
+)
 from models.misc import Utilities
+from resources.constants import METRICS_HOST, METRICS_PORT
 
 
 async def main():
     await job_manager.init_redis()
+    await outbox.start(job_manager.redis_conn)
+    await exchange_rates.start(job_manager.redis_conn)
+    await change_feed.start(job_manager.redis_conn)
+    await lookup_cache.start(job_manager.redis_conn)
+    if METRICS_PORT:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)
     await bot.start()
 
 # Check if redis is running
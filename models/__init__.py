@@ -69,11 +69,92 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 
+# Latency and throughput metrics of commands and the backends they call
+from models.metrics import Metrics
+
+metrics = Metrics()
+metrics.instrument_client(client)
+
+# Committed changes of users, rentals, payments and Telegram accounts are published to a Redis Stream,
+# started once Redis is connected
+from models.change_feed import ChangeFeed
+from resources.constants import (
+    CHANGE_FEED_BATCH_SIZE,
+    CHANGE_FEED_BLOCK,
+    CHANGE_FEED_MAXLEN,
+    CHANGE_FEED_RETRY_INTERVAL,
+)
+
+change_feed = ChangeFeed(
+    CHANGE_FEED_MAXLEN,
+    CHANGE_FEED_BATCH_SIZE,
+    CHANGE_FEED_BLOCK,
+    CHANGE_FEED_RETRY_INTERVAL,
+)
+metrics.expose(
+    "bot_change_feed_total", "Change feed activity.", "result", change_feed.stats
+)
+
 from models.engine.db_engine import DBStorage
 
 # Initialization of DBStorage and the bot client
-storage = DBStorage()
+storage = DBStorage(change_feed)
 storage.reload()
+metrics.expose(
+    "bot_db_units_total",
+    "Units of work run, and how they ended.",
+    "result",
+    storage.stats,
+)
+
+# All outbound messages go through the outbox, started once Redis is connected
+from models.messaging import Outbox
+
+outbox = Outbox(client)
+
+# Telegram profiles rendered in messages are served from this cache
+from models.entity_cache import EntityCache
+
+entity_cache = EntityCache(client)
+
+# Results of expensive commands, shared by concurrent callers and reused until the data changes
+from models.result_cache import ResultCache
+
+result_cache = ResultCache()
+metrics.expose(
+    "bot_result_cache_total", "Result cache lookups.", "result", result_cache.stats
+)
+
+# Lookups run on every tenant request, cached in memory and in Redis once it's connected,
+# and dropped as soon as a commit changes what they read
+from models.lookup_cache import LookupCache
+
+lookup_cache = LookupCache()
+change_feed.listen(lookup_cache.invalidate)
+metrics.expose(
+    "bot_lookup_cache_total", "Lookup cache lookups.", "result", lookup_cache.stats
+)
+
+# Exchange rates, cached in Redis once it's connected
+from models.exchange_rates import ExchangeRateService
+
+exchange_rates = ExchangeRateService()
+metrics.expose(
+    "bot_exchange_rate_lookups_total",
+    "Exchange rate lookups.",
+    "result",
+    exchange_rates.stats,
+)
+
+# Balance changes are recorded in the ledger, which the balances are reconciled against
+from models.ledger import Ledger
+
+metrics.expose(
+    "bot_ledger_reconciled_ranges_total",
+    "Ranges of users reconciled with the ledger.",
+    "result",
+    Ledger.stats,
+)
 
 
 # Importing command handlers
@@ -98,19 +179,27 @@ routes = {
     "/extend_plan": plan_routes.extend_plan,
     "/create_user": user_routes.create_user,
     "/delete_user": user_routes.delete_user_command,
+    "/restore_user": user_routes.restore_user,
     "/list_users": user_routes.list_users,
     "/payment_history": payment_routes.payment_history,
     "/gen_report": system_routes.generate_report,
+    "/export": system_routes.export_data,
+    "/simulate": system_routes.simulate,
     "/broadcast": system_routes.broadcast,
+    "/broadcast_resume": system_routes.resume_broadcasts,
     "/unlink_user": user_routes.clear_user,
     "/link_user": user_routes.link_user,
     "/who": system_routes.list_connected_users,
     "/earnings": payment_routes.show_earnings,
+    "/runway": payment_routes.runway_report,
     "/credit": payment_routes.credit_payment,
     "/debit": payment_routes.debit_payment,
+    "/import_payments": payment_routes.import_payments,
     "/run": system_routes.run_command,
     "/check_disk": system_routes.check_disk_usage,
     "/status": system_routes.user_status,
+    "/idle": system_routes.idle_report,
+    "/metrics": system_routes.metrics_report,
 }
 
 # Define callback mappings for inline keyboard actions
@@ -118,7 +207,10 @@ callbacks = {
     "cancel": plan_routes.handle_cancel,
     "clean_db": system_routes.handle_clean_db,
     "refresh_connected_users": system_routes.refresh_connected_users,
-    "delete_user": user_routes.delete_user_command, # Callback for deleting a user
+    "delete_user": user_routes.delete_user_command,  # Callback for deleting a user
+    "abuse": system_routes.handle_abuse_action,  # Abusive process alert actions
+    "cancel_run": system_routes.cancel_run,  # Cancel a running /run command
+    "list_users": user_routes.list_users_page,  # /list_users page navigation
 }
 
 # Initialize the BotManager with client, routes, and callbacks
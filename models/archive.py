@@ -0,0 +1,331 @@
+import asyncio
+import fcntl
+import os
+import re
+import shutil
+import time
+
+from models import logger, metrics
+from resources.constants import (
+    ARCHIVE_COMPRESSOR,
+    ARCHIVE_DIR,
+    ARCHIVE_PIPE_SIZE,
+    HOME_ROOT,
+)
+
+
+class HomeArchiver:
+    """
+    Archives home directories into compressed tarballs before accounts are deleted, and restores them.
+
+    `tar` and the compressor run as two separate processes connected by a kernel pipe,
+    which acts as a bounded buffer between them. The event loop never touches the data,
+    so the bot stays responsive while large trees are archived. zstd and pigz compress
+    on all cores; plain gzip is only used as a last resort.
+    """
+
+    # name: (compress, decompress, file extension)
+    COMPRESSORS = {
+        "zstd": (
+            ["zstd", "-T0", "-3", "-q", "-c"],
+            ["zstd", "-d", "-q", "-c"],
+            ".tar.zst",
+        ),
+        "pigz": (["pigz", "-c"], ["pigz", "-d", "-c"], ".tar.gz"),
+        "gzip": (["gzip", "-c"], ["gzip", "-d", "-c"], ".tar.gz"),
+    }
+    F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+    @classmethod
+    def get_compressor(cls):
+        """
+        Get the compressor to use, either the configured one or the fastest one installed.
+
+        Returns:
+            str: The name of the compressor.
+
+        Raises:
+            RuntimeError: If no supported compressor is installed.
+        """
+        candidates = [ARCHIVE_COMPRESSOR] if ARCHIVE_COMPRESSOR else cls.COMPRESSORS
+        for name in candidates:
+            if name in cls.COMPRESSORS and shutil.which(name):
+                return name
+        raise RuntimeError("No supported compressor (zstd, pigz, gzip) found.")
+
+    @classmethod
+    def get_compressor_for(cls, path):
+        """
+        Get the compressor able to decompress an archive, based on its extension.
+
+        Args:
+            path (str): The path of the archive.
+
+        Returns:
+            str: The name of the compressor.
+        """
+        if path.endswith(".tar.zst"):
+            return "zstd"
+        return "pigz" if shutil.which("pigz") else "gzip"
+
+    @classmethod
+    def _pipe(cls):
+        """
+        Create the pipe connecting both processes of a pipeline, enlarged to `ARCHIVE_PIPE_SIZE`.
+
+        Returns:
+            tuple: (read_fd, write_fd)
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            fcntl.fcntl(write_fd, cls.F_SETPIPE_SZ, ARCHIVE_PIPE_SIZE)
+        except OSError:
+            # Larger than /proc/sys/fs/pipe-max-size, keep the default size
+            pass
+        return read_fd, write_fd
+
+    @classmethod
+    async def _run_pipeline(cls, producer, consumer, stdin=None, stdout=None):
+        """
+        Run two commands connected by a pipe, like `producer | consumer`.
+
+        Args:
+            producer (list[str]): The command writing to the pipe.
+            consumer (list[str]): The command reading from the pipe.
+            stdin: Optional file the producer reads from.
+            stdout: Optional file the consumer writes to.
+
+        Returns:
+            tuple: The exit codes and stderr outputs of both commands.
+        """
+        read_fd, write_fd = cls._pipe()
+        try:
+            first = await asyncio.create_subprocess_exec(
+                *producer, stdin=stdin, stdout=write_fd, stderr=asyncio.subprocess.PIPE
+            )
+            second = await asyncio.create_subprocess_exec(
+                *consumer, stdin=read_fd, stdout=stdout, stderr=asyncio.subprocess.PIPE
+            )
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+        async with metrics.timed("subprocess"):
+            (_, first_err), (_, second_err) = await asyncio.gather(
+                first.communicate(), second.communicate()
+            )
+        return (first.returncode, second.returncode), (first_err, second_err)
+
+    @classmethod
+    async def verify(cls, path, username=None):
+        """
+        Verify an archive by decompressing it and listing every entry.
+
+        Args:
+            path (str): The path of the archive.
+            username (str): If given, every entry must be within the user's home directory.
+
+        Returns:
+            int: The number of entries in the archive, or None if it's corrupt
+                (or has entries outside the user's home directory).
+        """
+        decompress = cls.COMPRESSORS[cls.get_compressor_for(path)][1]
+        read_fd, write_fd = cls._pipe()
+        with open(path, "rb") as archive:
+            try:
+                decompressor = await asyncio.create_subprocess_exec(
+                    *decompress,
+                    stdin=archive,
+                    stdout=write_fd,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                lister = await asyncio.create_subprocess_exec(
+                    "tar",
+                    "--list",
+                    "--file=-",
+                    stdin=read_fd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            finally:
+                os.close(read_fd)
+                os.close(write_fd)
+            entries = 0
+            foreign = 0
+            top = username.encode() if username else None
+            async with metrics.timed("subprocess"):
+                while line := await lister.stdout.readline():
+                    entries += 1
+                    # tar strips leading slashes when extracting
+                    name = line.rstrip(b"\n").lstrip(b"/")
+                    if name.startswith(b"./"):
+                        name = name[2:]
+                    if top and name.split(b"/", 1)[0] != top:
+                        foreign += 1
+                await asyncio.gather(decompressor.wait(), lister.wait())
+        if decompressor.returncode != 0 or lister.returncode != 0:
+            return None
+        if foreign:
+            logger.error(
+                f"Archive {path} has {foreign} entries outside the home of {username}."
+            )
+            return None
+        return entries
+
+    @classmethod
+    async def archive(cls, username):
+        """
+        Stream a user's home directory into a compressed archive in `ARCHIVE_DIR` and verify it.
+        The archive is removed again if anything fails, so a returned archive is always complete.
+
+        Args:
+            username (str): The username of the user.
+
+        Returns:
+            dict: The archive's `path`, `size` in bytes, number of `entries` and `seconds` taken,
+                or None if archiving failed.
+        """
+        home = os.path.join(HOME_ROOT, username)
+        if not os.path.isdir(home):
+            logger.warning(f"Home directory {home} not found, nothing to archive.")
+            return None
+
+        try:
+            compressor = cls.get_compressor()
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        except (RuntimeError, OSError) as e:
+            logger.error(f"Error archiving home of {username}: {e}")
+            return None
+
+        compress, _, extension = cls.COMPRESSORS[compressor]
+        path = os.path.join(ARCHIVE_DIR, f"{username}-{int(time.time())}{extension}")
+        started = time.monotonic()
+
+        tar = ["sudo", "tar", "--create", "--file=-", "--directory", HOME_ROOT]
+        try:
+            with open(path, "wb") as out:
+                codes, errors = await cls._run_pipeline(
+                    tar + [username], compress, stdout=out
+                )
+        except OSError as e:
+            logger.error(f"Error archiving home of {username}: {e}")
+            os.remove(path)
+            return None
+
+        # tar exits with 1 when files changed while being read, which is fine here
+        if codes[0] not in (0, 1) or codes[1] != 0:
+            logger.error(
+                f"Error archiving home of {username}: "
+                f"{b''.join(errors).decode(errors='replace')}"
+            )
+            os.remove(path)
+            return None
+
+        entries = await cls.verify(path, username)
+        if not entries:
+            logger.error(f"Archive {path} failed verification, removing it.")
+            os.remove(path)
+            return None
+
+        result = {
+            "path": path,
+            "size": os.path.getsize(path),
+            "entries": entries,
+            "seconds": time.monotonic() - started,
+        }
+        logger.info(
+            f"Archived home of {username} to {path}: {result['size']} bytes, "
+            f"{entries} entries in {result['seconds']:.1f}s."
+        )
+        return result
+
+    @classmethod
+    def __archive_pattern(cls, username):
+        """
+        Returns:
+            re.Pattern: Matches the file names of the user's archives, capturing their timestamp.
+        """
+        extensions = "|".join(
+            re.escape(extension) for *_, extension in cls.COMPRESSORS.values()
+        )
+        return re.compile(rf"{re.escape(username)}-(\d+)(?:{extensions})")
+
+    @classmethod
+    def find_archive(cls, username, name=None):
+        """
+        Find an archive of a user's home directory. Archives of other users are never
+        returned, even those whose username starts with this one (e.g. `dev-2` for `dev`).
+
+        Args:
+            username (str): The username of the user.
+            name (str): Optional file name of a specific archive. Defaults to the latest one.
+
+        Returns:
+            str: The path of the archive, or None if not found.
+        """
+        pattern = cls.__archive_pattern(username)
+        if name:
+            path = os.path.join(ARCHIVE_DIR, os.path.basename(name))
+            if pattern.fullmatch(os.path.basename(name)) and os.path.isfile(path):
+                return path
+            return None
+        try:
+            names = os.listdir(ARCHIVE_DIR)
+        except FileNotFoundError:
+            return None
+        archives = [
+            (int(match.group(1)), name)
+            for name in names
+            if (match := pattern.fullmatch(name))
+        ]
+        if not archives:
+            return None
+        return os.path.join(ARCHIVE_DIR, max(archives)[1])
+
+    @classmethod
+    async def restore(cls, username, path):
+        """
+        Rehydrate a user's home directory from an archive.
+        The user must already exist, ownership is reassigned to the user afterwards
+        since the UID may have changed since the archive was taken. Archives with entries
+        outside the user's home directory are refused.
+
+        Args:
+            username (str): The username of the user.
+            path (str): The path of the archive.
+
+        Returns:
+            bool: True if the home directory was restored, False otherwise.
+        """
+        # Extracted as root: an archive must not write anywhere but the user's home
+        if not await cls.verify(path, username):
+            logger.error(
+                f"Not restoring home of {username} from {path}, it failed verification."
+            )
+            return False
+
+        decompress = cls.COMPRESSORS[cls.get_compressor_for(path)][1]
+        tar = ["sudo", "tar", "--extract", "--file=-", "--directory", HOME_ROOT]
+        try:
+            with open(path, "rb") as archive:
+                codes, errors = await cls._run_pipeline(decompress, tar, stdin=archive)
+        except OSError as e:
+            logger.error(f"Error restoring home of {username} from {path}: {e}")
+            return False
+        if any(codes):
+            logger.error(
+                f"Error restoring home of {username} from {path}: "
+                f"{b''.join(errors).decode(errors='replace')}"
+            )
+            return False
+
+        async with metrics.timed("subprocess"):
+            chown = await asyncio.create_subprocess_exec(
+                "sudo",
+                "chown",
+                "-R",
+                f"{username}:{username}",
+                os.path.join(HOME_ROOT, username),
+            )
+            await chown.wait()
+        logger.info(f"Restored home of {username} from {path}.")
+        return chown.returncode == 0
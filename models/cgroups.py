@@ -0,0 +1,337 @@
+import asyncio
+import errno
+import os
+import shutil
+
+import sh
+
+from models import logger
+from models.processes import ProcessInspector
+from resources.constants import CGROUP_IO_DEVICE, CGROUP_PARENT, CGROUP_ROOT
+
+
+class CgroupManager:
+    """
+    Handles per-rental cgroup v2 slices.
+    Every rental gets its own cgroup below `CGROUP_ROOT/CGROUP_PARENT` whose
+    `cpu.weight`, `cpu.max`, `memory.max` and `io.max` are driven by the rental's plan tier.
+    The cgroup root is configurable so everything can be exercised against a plain directory tree.
+    """
+
+    CONTROLLERS = ("cpu", "memory", "io")
+    CPU_PERIOD = 100000
+
+    @classmethod
+    def is_available(cls):
+        """
+        Check if a cgroup v2 hierarchy is mounted at the configured root.
+
+        Returns:
+            bool: True if the hierarchy is available, False otherwise.
+        """
+        return os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers"))
+
+    @classmethod
+    def get_parent_path(cls):
+        """
+        Get the path of the cgroup that holds all rental slices.
+
+        Returns:
+            str: The path of the parent cgroup.
+        """
+        return os.path.join(CGROUP_ROOT, CGROUP_PARENT)
+
+    @classmethod
+    def get_slice_path(cls, username):
+        """
+        Get the path of the cgroup of a rental.
+
+        Args:
+            username (str): The username of the rental's system user.
+
+        Returns:
+            str: The path of the rental's cgroup.
+        """
+        return os.path.join(cls.get_parent_path(), username)
+
+    @staticmethod
+    def _write(path, value):
+        """
+        Write a value to a cgroup interface file, using sudo if the bot lacks the permissions.
+
+        Args:
+            path (str): The path of the interface file.
+            value (str): The value to write.
+        """
+        try:
+            with open(path, "w") as f:
+                f.write(value)
+        except PermissionError:
+            sh.sudo.tee(path, _in=value, _out=os.devnull)
+
+    @staticmethod
+    def _read(path):
+        """
+        Read a cgroup interface file.
+
+        Args:
+            path (str): The path of the interface file.
+
+        Returns:
+            str: The content of the file, or an empty string if it doesn't exist.
+        """
+        try:
+            with open(path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    @staticmethod
+    def _mkdir(path):
+        """
+        Create a cgroup directory, using sudo if the bot lacks the permissions.
+
+        Args:
+            path (str): The path of the cgroup.
+        """
+        try:
+            os.makedirs(path, exist_ok=True)
+        except PermissionError:
+            sh.sudo.mkdir("-p", path)
+
+    @classmethod
+    def _enable_controllers(cls, path):
+        """
+        Enable the cpu, memory and io controllers for the children of a cgroup.
+
+        Args:
+            path (str): The path of the cgroup.
+        """
+        available = cls._read(os.path.join(path, "cgroup.controllers")).split()
+        controllers = [c for c in cls.CONTROLLERS if not available or c in available]
+        cls._write(
+            os.path.join(path, "cgroup.subtree_control"),
+            " ".join(f"+{c}" for c in controllers),
+        )
+
+    @classmethod
+    def format_limits(cls, limits):
+        """
+        Translate resource limits into cgroup v2 interface file values.
+
+        Args:
+            limits (dict): The resource limits (`cpu_weight`, `cpu_max`, `memory_max`, `io_max`).
+
+        Returns:
+            dict: A mapping of interface file names to the values to write.
+        """
+        files = {}
+        if limits.get("cpu_weight"):
+            files["cpu.weight"] = str(int(limits["cpu_weight"]))
+
+        cpu_max = limits.get("cpu_max")
+        quota = int(cpu_max * cls.CPU_PERIOD // 100) if cpu_max else "max"
+        files["cpu.max"] = f"{quota} {cls.CPU_PERIOD}"
+
+        memory_max = limits.get("memory_max")
+        files["memory.max"] = str(int(memory_max)) if memory_max else "max"
+
+        if CGROUP_IO_DEVICE:
+            io_max = limits.get("io_max")
+            bps = str(int(io_max)) if io_max else "max"
+            files["io.max"] = f"{CGROUP_IO_DEVICE} rbps={bps} wbps={bps}"
+        return files
+
+    @classmethod
+    def _apply_limits(cls, username, limits):
+        """Blocking part of `apply_limits`."""
+        path = cls.get_slice_path(username)
+        cls._enable_controllers(CGROUP_ROOT)
+        cls._mkdir(cls.get_parent_path())
+        cls._enable_controllers(cls.get_parent_path())
+        cls._mkdir(path)
+        for name, value in cls.format_limits(limits).items():
+            cls._write(os.path.join(path, name), value)
+
+    @classmethod
+    async def apply_limits(cls, username, limits):
+        """
+        Create the cgroup of a rental if needed and (re)apply its resource limits.
+        Limits are applied live, so this is used both on creation and on plan changes.
+
+        Args:
+            username (str): The username of the rental's system user.
+            limits (dict): The resource limits (`cpu_weight`, `cpu_max`, `memory_max`, `io_max`).
+
+        Returns:
+            bool: True if the limits were applied, False otherwise.
+        """
+        if not cls.is_available():
+            logger.warning("cgroup v2 is not available, skipping resource limits.")
+            return False
+        try:
+            await asyncio.to_thread(cls._apply_limits, username, limits)
+            logger.info(f"Applied resource limits for user {username}: {limits}")
+            return True
+        except (OSError, sh.ErrorReturnCode) as e:
+            logger.error(f"Error applying resource limits for user {username}: {e}")
+            return False
+
+    @classmethod
+    def _attach_user_processes(cls, username, uid):
+        """Blocking part of `attach_user_processes`."""
+        path = cls.get_slice_path(username)
+        if not os.path.isdir(path):
+            return 0
+        attached = set(map(int, cls._read(os.path.join(path, "cgroup.procs")).split()))
+        moved = 0
+        for pid in ProcessInspector.get_user_pids(uid):
+            if pid in attached:
+                continue
+            try:
+                cls._write(os.path.join(path, "cgroup.procs"), str(pid))
+                moved += 1
+            except (OSError, sh.ErrorReturnCode):
+                # The process exited before it could be moved
+                continue
+        return moved
+
+    @classmethod
+    async def attach_user_processes(cls, username, uid):
+        """
+        Move all processes of a user into the user's rental cgroup.
+
+        Args:
+            username (str): The username of the rental's system user.
+            uid (int): The UID of the system user.
+
+        Returns:
+            int: The number of processes moved.
+        """
+        if not cls.is_available():
+            return 0
+        return await asyncio.to_thread(cls._attach_user_processes, username, uid)
+
+    @classmethod
+    async def throttle_cpu(cls, username, cpu_max):
+        """
+        Lower the CPU quota of a rental's cgroup without touching its other limits.
+        The plan tier's quota is restored the next time `apply_limits` runs.
+
+        Args:
+            username (str): The username of the rental's system user.
+            cpu_max (int): The CPU quota as a percentage of a single CPU.
+
+        Returns:
+            bool: True if the quota was applied, False otherwise.
+        """
+        path = cls.get_slice_path(username)
+        if not os.path.isdir(path):
+            return False
+        value = cls.format_limits({"cpu_max": cpu_max})["cpu.max"]
+        try:
+            await asyncio.to_thread(cls._write, os.path.join(path, "cpu.max"), value)
+            logger.info(f"Throttled user {username} to {cpu_max}% CPU.")
+            return True
+        except (OSError, sh.ErrorReturnCode) as e:
+            logger.error(f"Error throttling user {username}: {e}")
+            return False
+
+    @classmethod
+    async def set_frozen(cls, username, frozen):
+        """
+        Freeze or thaw all processes in a rental's cgroup through `cgroup.freeze`.
+
+        Args:
+            username (str): The username of the rental's system user.
+            frozen (bool): True to freeze the processes, False to thaw them.
+
+        Returns:
+            bool: True if the state was changed, False if the cgroup is unavailable.
+        """
+        path = os.path.join(cls.get_slice_path(username), "cgroup.freeze")
+        if not os.path.exists(path):
+            return False
+        try:
+            await asyncio.to_thread(cls._write, path, "1" if frozen else "0")
+            return True
+        except (OSError, sh.ErrorReturnCode) as e:
+            logger.error(f"Error changing freeze state of user {username}: {e}")
+            return False
+
+    @classmethod
+    def _reclaim_memory(cls, username):
+        """Blocking part of `reclaim_memory`."""
+        path = cls.get_slice_path(username)
+        reclaim_path = os.path.join(path, "memory.reclaim")
+        if not os.path.exists(reclaim_path):
+            return 0
+        before = int(cls._read(os.path.join(path, "memory.current")) or 0)
+        try:
+            cls._write(reclaim_path, str(before))
+        except (OSError, sh.ErrorReturnCode):
+            # The kernel reports EAGAIN when it couldn't reclaim the full amount
+            pass
+        after = int(cls._read(os.path.join(path, "memory.current")) or 0)
+        return max(0, before - after)
+
+    @classmethod
+    async def reclaim_memory(cls, username):
+        """
+        Ask the kernel to reclaim as much memory of a rental's cgroup as possible through `memory.reclaim`.
+        Meant for frozen cgroups, whose pages won't be touched again until they're thawed.
+
+        Args:
+            username (str): The username of the rental's system user.
+
+        Returns:
+            int: The number of bytes reclaimed, 0 if `memory.reclaim` isn't supported.
+        """
+        try:
+            return await asyncio.to_thread(cls._reclaim_memory, username)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reclaiming memory of user {username}: {e}")
+            return 0
+
+    @classmethod
+    def _release_slice(cls, username):
+        """Blocking part of `release_slice`."""
+        path = cls.get_slice_path(username)
+        if not os.path.isdir(path):
+            return
+        # Processes left in the slice are handed back to the root cgroup,
+        # since a cgroup can only be removed once it's empty.
+        for pid in cls._read(os.path.join(path, "cgroup.procs")).split():
+            try:
+                cls._write(os.path.join(CGROUP_ROOT, "cgroup.procs"), pid)
+            except (OSError, sh.ErrorReturnCode):
+                continue
+        try:
+            os.rmdir(path)
+        except PermissionError:
+            sh.sudo.rmdir(path)
+        except OSError as e:
+            # Only a plain directory tree has regular files left in it,
+            # cgroupfs removes its interface files together with the directory.
+            if e.errno != errno.ENOTEMPTY:
+                raise
+            shutil.rmtree(path)
+
+    @classmethod
+    async def release_slice(cls, username):
+        """
+        Remove the cgroup of a rental, releasing its resource limits.
+
+        Args:
+            username (str): The username of the rental's system user.
+
+        Returns:
+            bool: True if the cgroup was released (or didn't exist), False otherwise.
+        """
+        try:
+            await asyncio.to_thread(cls._release_slice, username)
+            logger.info(f"Released resource limits for user {username}.")
+            return True
+        except (OSError, sh.ErrorReturnCode) as e:
+            logger.error(f"Error releasing resource limits for user {username}: {e}")
+            return False
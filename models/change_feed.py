@@ -0,0 +1,353 @@
+"""
+Feed of the committed changes of users, rentals, payments and Telegram accounts, on a Redis Stream.
+
+Usable from the command line too, e.g. by an analytics job following the feed in a
+consumer group of its own, one JSON change per line. Run by path, it only needs Redis,
+neither the bot's environment nor its database:
+
+    python models/change_feed.py --group analytics [--host localhost] [--port 6379]
+
+This module only depends on redis and the standard library, its settings are handed to
+`ChangeFeed` by the bot (from `resources.constants`) or read from the environment by the
+command line.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+from redis.exceptions import ResponseError
+
+# A child of the bot's logger, when run by the bot
+logger = logging.getLogger("models.change_feed")
+
+
+class ChangeFeed:
+    """
+    Publishes the changes of every commit to a Redis Stream, so caches, rollups, the job
+    engine and external consumers learn of them without polling the database.
+
+    `DBStorage` collects the changes after each flush and hands them over once the commit
+    succeeds. Each commit becomes one stream entry, with the storage version it produced
+    and its events: the model, the ID, the operation ("insert", "update" or "delete"), the
+    changed fields of updates and the ID of the user the row belongs to. Entries are added
+    by a background task, all the commits made since its last write in one round trip, so
+    committing never waits on Redis.
+
+    Consumers read the stream in consumer groups, each group getting every entry at least
+    once. The stream is trimmed to about `maxlen` entries whatever the groups'
+    progress; a group that fell further behind than that is told to resync instead.
+    """
+
+    STREAM_KEY = "changes"
+    # The models whose changes are published
+    MODELS = ("User", "Rental", "Payment", "TelegramUser")
+
+    def __init__(self, maxlen=100000, batch_size=100, block=5, retry_interval=5):
+        """
+        Args:
+            maxlen (int): The entries the stream is trimmed to, about (`CHANGE_FEED_MAXLEN`).
+            batch_size (int): The entries a consumer reads at a time (`CHANGE_FEED_BATCH_SIZE`).
+            block (int): The seconds a consumer blocks waiting for new entries (`CHANGE_FEED_BLOCK`).
+            retry_interval (int): The seconds between two attempts to publish or consume
+                while Redis fails (`CHANGE_FEED_RETRY_INTERVAL`).
+        """
+        self.maxlen = maxlen
+        self.batch_size = batch_size
+        self.block = block
+        self.retry_interval = retry_interval
+        self.redis_conn = None
+        self.__loop = None
+        self.__wakeup = None
+        # Entries not added to the stream yet. Bounded, in case Redis is never started
+        # (e.g. in command line tools)
+        self.__pending = collections.deque(maxlen=maxlen)
+        self.__subscriptions = []
+        self.__listeners = []
+        self.__tasks = []
+        self.stats = dict.fromkeys(
+            ("commits", "events", "delivered", "resyncs", "errors"), 0
+        )
+
+    async def start(self, redis_conn):
+        """
+        Start publishing, and consuming for the groups subscribed so far.
+        Changes committed before the feed was started are published now.
+
+        Args:
+            redis_conn: The Redis connection.
+        """
+        self.redis_conn = redis_conn
+        self.__loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        self.__wakeup.set()
+        self.__tasks.append(asyncio.create_task(self.__writer()))
+        for subscription in self.__subscriptions:
+            self.__tasks.append(asyncio.create_task(self.__consume(*subscription)))
+
+    async def stop(self):
+        """
+        Stop publishing and consuming. Changes not published yet are dropped.
+        """
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+
+    def publish(self, version, events):
+        """
+        Queue the events of a commit. Called by `DBStorage` from whichever thread
+        committed, returns right away.
+
+        Args:
+            version (int): The storage version the commit produced.
+            events (list): The events, each a list of the model, the ID, the operation,
+                the changed fields and the user ID.
+        """
+        self.__pending.append(
+            {
+                "version": str(version),
+                "time": str(int(time.time())),
+                "events": json.dumps(events, separators=(",", ":")),
+            }
+        )
+        self.stats["events"] += len(events)
+        for listener in self.__listeners:
+            listener(events)
+        if self.__loop and not self.__loop.is_closed():
+            self.__loop.call_soon_threadsafe(self.__wakeup.set)
+
+    def listen(self, listener):
+        """
+        Call a function with the events of every commit of this process, right as it's
+        committed and in the committing thread, e.g. to invalidate in-process caches
+        before anything reads them again.
+
+        Args:
+            listener (callable): The function, called with the events as given to `publish`.
+        """
+        self.__listeners.append(listener)
+
+    async def __writer(self):
+        """
+        Add the queued entries to the stream, trimming it as they're added.
+        """
+        while True:
+            await self.__wakeup.wait()
+            self.__wakeup.clear()
+            entries = []
+            while self.__pending:
+                entries.append(self.__pending.popleft())
+            if not entries:
+                continue
+
+            try:
+                async with self.redis_conn.pipeline(transaction=False) as pipe:
+                    for entry in entries:
+                        pipe.xadd(
+                            self.STREAM_KEY,
+                            entry,
+                            maxlen=self.maxlen,
+                            approximate=True,
+                        )
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Failed to publish {len(entries)} change(s): {e}")
+                self.stats["errors"] += 1
+                # Entries added before the failure are added again, consumers get
+                # entries at least once anyway
+                self.__pending.extendleft(reversed(entries))
+                await asyncio.sleep(self.retry_interval)
+                self.__wakeup.set()
+                continue
+            self.stats["commits"] += len(entries)
+
+    def subscribe(self, group, handler, resync=None, consumer="bot"):
+        """
+        Consume the feed in a consumer group, from the changes committed after the group
+        was first created. Entries are acknowledged once the handler returns, and handed
+        to it again if it raised.
+
+        Args:
+            group (str): The name of the consumer group.
+            handler (callable): The coroutine function called with the changes of a batch
+                of entries, each a dict of the `version`, `model`, `id`, `op`, `fields`
+                and `user_id`.
+            resync (callable): The coroutine function called without arguments when the
+                group fell behind and changes were trimmed before it read them, to rebuild
+                whatever it derives from the changes.
+            consumer (str): The name of the consumer within the group.
+        """
+        subscription = (group, consumer, handler, resync)
+        self.__subscriptions.append(subscription)
+        if self.redis_conn:
+            self.__tasks.append(asyncio.create_task(self.__consume(*subscription)))
+
+    async def __consume(self, group, consumer, handler, resync):
+        """
+        Read the feed in a consumer group, forever.
+        """
+        # Entries delivered before a restart but never acknowledged come first
+        cursor = "0"
+        check = True
+        resynced = False
+        while True:
+            try:
+                if check:
+                    await self.__create_group(group)
+                    if await self.__missed(group):
+                        await self.__resync(group, resync)
+                        resynced = True
+                    check = False
+
+                response = await self.redis_conn.xreadgroup(
+                    group,
+                    consumer,
+                    {self.STREAM_KEY: cursor},
+                    count=self.batch_size,
+                    block=None if cursor == "0" else self.block * 1000,
+                )
+                entries = response[0][1] if response else []
+                if not entries:
+                    cursor = ">"
+                    resynced = False
+                    continue
+
+                changes = []
+                trimmed = False
+                for _, fields in entries:
+                    # Entries trimmed while pending come back without their fields
+                    if not fields:
+                        trimmed = True
+                        continue
+                    version = int(fields["version"])
+                    for model, id, op, changed, user_id in json.loads(fields["events"]):
+                        changes.append(
+                            {
+                                "version": version,
+                                "model": model,
+                                "id": id,
+                                "op": op,
+                                "fields": changed,
+                                "user_id": user_id,
+                            }
+                        )
+                if trimmed and not resynced:
+                    await self.__resync(group, resync)
+                    resynced = True
+                if changes:
+                    await handler(changes)
+                await self.redis_conn.xack(
+                    self.STREAM_KEY, group, *(entry_id for entry_id, _ in entries)
+                )
+                self.stats["delivered"] += len(entries)
+                # A full batch means the group is behind, possibly further than the stream goes
+                check = len(entries) == self.batch_size
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Failed to consume changes in group {group}: {e}")
+                self.stats["errors"] += 1
+                # Hand the unacknowledged entries over again
+                cursor, check = "0", True
+                await asyncio.sleep(self.retry_interval)
+
+    async def __create_group(self, group):
+        """
+        Create a consumer group reading from the end of the stream, unless it exists.
+        """
+        try:
+            await self.redis_conn.xgroup_create(
+                self.STREAM_KEY, group, id="$", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def __missed(self, group):
+        """
+        Returns:
+            bool: Whether entries the group hadn't read yet were trimmed from the stream.
+        """
+        stream = await self.redis_conn.xinfo_stream(self.STREAM_KEY)
+        if not stream.get("first-entry"):
+            return False
+        info = next(
+            info
+            for info in await self.redis_conn.xinfo_groups(self.STREAM_KEY)
+            if info["name"] == group
+        )
+        added, read = stream.get("entries-added"), info.get("entries-read")
+        if added is not None and read is not None:
+            return added - read > stream["length"]
+        # Without the counters (Redis < 7), assume so if the stream starts after the last
+        # entry the group read, which errs on resyncing
+        return self.__parse_id(info["last-delivered-id"]) < self.__parse_id(
+            stream["first-entry"][0]
+        )
+
+    async def __resync(self, group, resync):
+        """
+        Move a group to the end of the stream and have it rebuild what it derives from
+        the changes, which then covers the changes it skipped.
+        """
+        stream = await self.redis_conn.xinfo_stream(self.STREAM_KEY)
+        await self.redis_conn.xgroup_setid(
+            self.STREAM_KEY, group, stream["last-generated-id"]
+        )
+        self.stats["resyncs"] += 1
+        logger.warning(f"Consumer group {group} fell behind the change feed, resyncing")
+        if resync:
+            await resync()
+
+    @staticmethod
+    def __parse_id(entry_id):
+        """
+        Returns:
+            tuple: The timestamp and sequence number of a stream entry ID, e.g. "1700000000000-0".
+        """
+        timestamp, _, seq = entry_id.partition("-")
+        return int(timestamp), int(seq or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Follow the change feed, printing a JSON change per line."
+    )
+    parser.add_argument("--group", default="analytics")
+    parser.add_argument("--consumer", default="cli")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    import redis.asyncio as redis
+
+    async def handle(changes):
+        for change in changes:
+            print(json.dumps(change), flush=True)
+
+    async def resync():
+        print(json.dumps({"resync": True}), flush=True)
+
+    async def follow():
+        feed = ChangeFeed(
+            batch_size=int(os.getenv("CHANGE_FEED_BATCH_SIZE", 100)),
+            block=int(os.getenv("CHANGE_FEED_BLOCK", 5)),
+            retry_interval=int(os.getenv("CHANGE_FEED_RETRY_INTERVAL", 5)),
+        )
+        feed.subscribe(args.group, handle, resync, args.consumer)
+        await feed.start(
+            redis.Redis(host=args.host, port=args.port, decode_responses=True)
+        )
+        await asyncio.Event().wait()
+
+    asyncio.run(follow())
+
+
+if __name__ == "__main__":
+    main()
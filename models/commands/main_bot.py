@@ -5,7 +5,8 @@ from typing import Dict
 from telethon import TelegramClient, events
 
 from resources.constants import API_HASH, API_ID, BOT_TOKEN
-from models import logger
+from models import logger, metrics, storage
+from models.dispatcher import CommandDispatcher
 
 
 class BotManager:
@@ -24,6 +25,7 @@ class BotManager:
         )
         self.ROUTES: Dict = routes
         self.CALLBACKS: Dict = callbacks
+        self.dispatcher = CommandDispatcher()
 
     async def start(self):
         """
@@ -34,6 +36,7 @@ class BotManager:
         """
 
         await self.__client.start(bot_token=BOT_TOKEN)
+        self.dispatcher.start()
         self.__client.add_event_handler(
             self.command_handler, events.NewMessage(pattern="/")
         )
@@ -63,7 +66,8 @@ class BotManager:
     async def command_handler(self, event):
         """
         Handle commands sent to the bot.
-            This method will parse the command and call the appropriate handler.
+            This method will parse the command and queue it for the appropriate handler,
+            so a slow command never holds up the others.
         :param event: the event containing the command
         :return: None
         """
@@ -71,7 +75,7 @@ class BotManager:
         command = event.message.text.split()[0]
         handler = self.ROUTES.get(command)
         if handler:
-            await handler(event)
+            await self.dispatcher.dispatch(event, command, handler)
         else:
             await event.respond("Unknown command. Type /help for available commands.")
 
@@ -86,4 +90,5 @@ class BotManager:
         command = event.data.split()[0].decode("utf-8")
         handler = self.CALLBACKS.get(command)
         if handler:
-            await handler(event)
+            async with metrics.track(f"callback:{command}"), storage.unit_of_work():
+                await handler(event)
@@ -1,7 +1,21 @@
-from models import storage
+import os
+import tempfile
+
+from sqlalchemy import func
+
+from models import client, logger, metrics, result_cache, storage
 from models.misc import Auth, Utilities
+from models.money import Money
+from models.payment_import import PaymentImporter
 from models.payments import Payment
+from models.rentals import Rental
+from models.runway import Runway
 from models.users import User
+from resources.constants import (
+    EARNINGS_CACHE_TTL,
+    IMPORT_MAX_FILE_SIZE,
+    RUNWAY_LIST_SIZE,
+)
 
 
 class PaymentRoutes:
@@ -16,32 +30,171 @@ class PaymentRoutes:
         """
         Show total earnings from all payments.
         Includes payments and refunds from all users in INR.
+        The message is reused until the database changes.
         :param event: Event object.
         :return: None
         """
 
-        all_payments = storage.all("Payment")
-        total_earnings = sum(payment.amount for payment in all_payments.values())
+        message = await result_cache.get(
+            "earnings", self.__compute_earnings, EARNINGS_CACHE_TTL, storage.version
+        )
+        await event.respond(message)
+
+    @staticmethod
+    async def __compute_earnings():
+        """
+        Compute the earnings statistics of all payments, aggregated by the database.
+        Amounts are integers of minor units, so the sum is exact.
+        :return: The formatted earnings message.
+        """
+
+        total, count, first_payment = storage.query(
+            func.sum(Payment.amount_minor),
+            func.count(Payment.id),
+            func.min(Payment.payment_date),
+        ).one()
+        total_earnings = Money(total, "INR")
 
         # Calculate statistics
-        if all_payments:
-            first_payment = min(
-                payment.payment_date for payment in all_payments.values()
-            )
+        if first_payment is not None:
             first_payment_date = Utilities.get_date_str(first_payment)
         else:
             first_payment_date = "N/A"
 
         # Format response message
-        message = (
-            f"💰 **Total Earnings:** `{total_earnings:,.2f} INR`\n"
+        return (
+            f"💰 **Total Earnings:** `{total_earnings}`\n"
             f"📅 **First Payment Date:** `{first_payment_date}`"
             f"\n\n📊 **Payment Statistics:**\n"
-            f"📈 **Total Payments:** `{len(all_payments)}`\n"
+            f"📈 **Total Payments:** `{count}`\n"
             # TODO: More to go here
         )
 
-        await event.respond(message)
+    # /import_payments command
+    @Auth.authorized_user
+    async def import_payments(self, event):
+        """
+        Credit the payments of a bank or UPI statement exported as CSV.
+        Rows are matched to users by a username column, or a username in their reference,
+        and skipped if their transaction ID was already imported. All the payments are
+        committed together, the rejected rows are sent back as a CSV with the reasons.
+        Usage: send a CSV with `/import_payments` as its caption, or reply to one with it.
+        :param event: Event object.
+        :return: None
+        """
+
+        message = (
+            event.message if event.message.file else await event.get_reply_message()
+        )
+        if not message or not message.file:
+            await event.respond(
+                "❓ Usage: send a CSV file with `/import_payments` as its caption, "
+                "or reply to one with `/import_payments`.\n"
+                "Columns: `transaction_id`, `amount`, `username` or `reference`, "
+                "and optionally `currency` and `date`."
+            )
+            return
+        if message.file.size > IMPORT_MAX_FILE_SIZE:
+            await event.respond(
+                f"❌ The file is larger than {Utilities.format_bytes(IMPORT_MAX_FILE_SIZE)}."
+            )
+            return
+
+        await event.respond("🔄 Importing payments...")
+        with tempfile.TemporaryDirectory(prefix="import-") as directory:
+            path = os.path.join(directory, "payments.csv")
+            await client.download_media(message, file=path)
+            importer = PaymentImporter(path)
+            try:
+                await metrics.to_thread("db", importer.parse)
+                await importer.apply()
+            except (ValueError, UnicodeDecodeError) as e:
+                await event.respond(f"❌ {e}")
+                return
+            except Exception as e:
+                await event.respond(
+                    f"❌ Error importing payments, nothing was imported: {e}"
+                )
+                logger.exception(e)
+                return
+
+            response = (
+                f"✅ Imported `{importer.imported}` payment(s) of `{importer.total}` "
+                f"for `{len(importer.users)}` user(s)."
+            )
+            if not importer.errors:
+                await event.respond(response)
+                return
+
+            errors_path = os.path.join(directory, "import-errors.csv")
+            with open(errors_path, "w", newline="") as file:
+                importer.write_errors(file)
+            await client.send_file(
+                event.chat_id,
+                errors_path,
+                caption=f"{response}\n⚠️ `{len(importer.errors)}` row(s) skipped, see the file.",
+            )
+
+    # /runway command
+    @Auth.authorized_user
+    async def runway_report(self, event):
+        """
+        List the users whose balance runs out the soonest, with the days of daily charges
+        their balance covers. Users come from the runway forecasts kept by the job manager,
+        their runway is computed from their current balance and plans.
+        Usage: /runway [count]
+        :param event: Event object.
+        :return: None
+        """
+
+        args = event.message.text.split()
+        try:
+            count = int(args[1]) if len(args) > 1 else RUNWAY_LIST_SIZE
+        except ValueError:
+            await event.respond("❓ Usage: /runway [count]")
+            return
+
+        from models import job_manager
+
+        user_ids = await job_manager.redis_conn.zrange(
+            job_manager.RUNWAY_KEY, 0, max(count, 1) - 1
+        )
+        users = storage.query(User).filter(User.id.in_(user_ids)).all()
+        rentals = {}
+        for rental in (
+            storage.query(Rental)
+            .filter(
+                Rental.user_id.in_(user_ids),
+                Rental.is_active == 1,
+                Rental.is_expired == 0,
+            )
+            .all()
+        ):
+            rentals.setdefault(rental.user_id, []).append(rental)
+
+        forecasts = []
+        for user in users:
+            forecast = Runway.forecast(user, rentals.get(user.id, []))
+            if forecast:
+                forecasts.append((user, forecast))
+        if not forecasts:
+            await event.respond("🔍 No users with an active paid plan.")
+            return
+
+        response = "⏳ **Runway** (soonest first):\n\n"
+        for user, forecast in sorted(forecasts, key=lambda f: f[1]["runs_out_at"]):
+            response += (
+                f"👤 `{user.linux_username}`: `{user.balance}` at "
+                f"`{forecast['daily_rate']}` per day\n"
+            )
+            if forecast["runs_out_at"] >= forecast["ends_at"]:
+                response += f"   ✅ Covered until the plan ends on `{Utilities.get_date_str(forecast['ends_at'])}`\n\n"
+            else:
+                response += (
+                    f"   ⏳ `{forecast['days']}` day(s), runs out on "
+                    f"`{Utilities.get_date_str(forecast['runs_out_at'])}`\n\n"
+                )
+        await event.respond(response)
 
     @Auth.authorized_user
     async def payment_history(self, event):
@@ -114,7 +267,7 @@ class PaymentRoutes:
         amount = payment.amount
 
         # Update the user's balance with the new amount
-        await user.update_balance(amount, "credit")
+        await user.update_balance(amount, "credit", payment_id=payment.id)
         payment.save()
 
         await event.respond(
@@ -150,7 +303,9 @@ class PaymentRoutes:
             user_id=user.id, amount=-amount, currency=currency
         )
         try:
-            await user.update_balance(payment.amount, "debit")
+            await user.update_balance(
+                payment.amount, "debit", kind="refund", payment_id=payment.id
+            )
             payment.save()
         except ValueError as e:
             await event.respond(
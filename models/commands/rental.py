@@ -1,6 +1,7 @@
 import time
 
-from models import client, storage
+from models import entity_cache, outbox, storage
+from models.cgroups import CgroupManager
 from models.misc import Auth, Utilities
 from models.payments import Payment
 
@@ -95,8 +96,8 @@ class PlanRoutes:
         args = event.message.text.split()
         if len(args) < 3:
             await event.respond(
-                "❓ Usage: /extend_plan <username> <additional_duration> [amount] [currency]\n"
-                "For example: `/extend_plan john 5d 500 INR`"
+                "❓ Usage: /extend_plan <username> <additional_duration> [amount] [currency] [plan_tier]\n"
+                "For example: `/extend_plan john 5d 500 INR pro`"
             )
             return
 
@@ -111,6 +112,9 @@ class PlanRoutes:
             active_rentals = storage.join("Rental", ["User"], {"is_active": 1})
             for rental in active_rentals:
                 await rental.extend_plan(additional_seconds)
+                await CgroupManager.apply_limits(
+                    rental.user.linux_username, rental.resource_limits
+                )
 
             response = "🔄 All users' plans extended!\n\n" + "\n".join(
                 [
@@ -146,6 +150,14 @@ class PlanRoutes:
             await event.respond(f"❌ User `{username}` has no active rentals.")
             return
 
+        plan_tier = args[5] if len(args) > 5 else None
+        if plan_tier:
+            try:
+                rental.apply_plan_tier(plan_tier)
+            except ValueError as e:
+                await event.respond(f"❌ {e}")
+                return
+
         # Is the user's rental status active?
         # We fetch the status before extending the plan.
         # So that we can provide the updated linux_password to the user.
@@ -154,12 +166,16 @@ class PlanRoutes:
         await rental.extend_plan(additional_seconds)
         # TO DO: Update price per day of the plan based on current rate.
 
+        # Limits are (re)applied even without a tier change, since an
+        # expired rental's cgroup has been released and needs to be recreated.
+        await CgroupManager.apply_limits(username, rental.resource_limits)
+
         try:
             amount_str = args[3]
             currency = args[4].upper()
             payment = await Payment.create(user.id, amount_str, currency)
             amount_inr = payment.amount
-            await user.update_balance(payment.amount, "credit")
+            await user.update_balance(payment.amount, "credit", payment_id=payment.id)
             payment.save()
             from models import job_manager
 
@@ -173,12 +189,13 @@ class PlanRoutes:
             f"🔄 User `{username}`'s plan extended!\n\n"
             f"👤 User `{username}`\n"
             f"📅 New expiry date: `{Utilities.get_date_str(rental.end_time)}`\n"
-            f"⏳ Duration extended by: {Utilities.parse_duration_to_human_readable(additional_seconds)}\n\n"
+            f"⏳ Duration extended by: {Utilities.parse_duration_to_human_readable(additional_seconds)}\n"
+            f"📦 Plan tier: `{rental.plan_tier}`\n\n"
             f"💰 Balance: `{user.balance:.2f} INR`"
         )
 
         if rental.telegram_user:
-            tg_user = await client.get_entity(rental.tguser.tg_user_id)
+            tg_user = await entity_cache.get(rental.tguser.tg_user_id)
             message = (
                 f"Hey {tg_user.first_name}!\n\n"
                 f"🔥 Your plan has been extended by `{Utilities.parse_duration_to_human_readable(additional_seconds)}`.\n"
@@ -193,7 +210,7 @@ class PlanRoutes:
                 )
 
             message += "\n\n Enjoy your server! 🚀"
-            await client.send_message(rental.tguser.tg_user_id, message)
+            await outbox.send(rental.tguser.tg_user_id, message)
 
         if amount_inr is not None:
             await event.respond(
@@ -1,7 +1,11 @@
 import asyncio
+import codecs
+import gzip
 import html
+import io
 import json
 import os
+import signal
 import tempfile
 import time
 import traceback
@@ -13,15 +17,57 @@ from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
-from jinja2 import Environment, FileSystemLoader
+from apscheduler.triggers.interval import IntervalTrigger
 from telethon import Button, client
-from telethon.tl.types import PeerUser
-from weasyprint import HTML
-
-from models import client, storage, logger
+from telethon.errors import MessageNotModifiedError, RPCError
+
+from models import (
+    change_feed,
+    client,
+    entity_cache,
+    logger,
+    lookup_cache,
+    metrics,
+    outbox,
+    result_cache,
+    storage,
+)
+from models.cgroups import CgroupManager
+from models.exports import Exporter
+from models.ledger import Ledger
+from models.messaging import Broadcast
+from models.metrics import DURATION_BUCKETS
 from models.misc import Auth, SystemUserManager, Utilities
+from models.money import Money
+from models.monitoring import AbuseDetector, IdleDetector
+from models.processes import ProcessInspector
+from models.reports import ReportRenderer
+from models.runway import Runway
 from models.telegram_users import TelegramUser
-from resources.constants import ADMIN_ID
+from resources.constants import (
+    ABUSE_AUTO_ACTION,
+    ABUSE_IGNORE_PERIOD,
+    ABUSE_PERCENTILE,
+    ABUSE_SAMPLE_INTERVAL,
+    ABUSE_THROTTLE_CPU,
+    ADMIN_ID,
+    CGROUP_SWEEP_INTERVAL,
+    DISK_USAGE_CACHE_TTL,
+    ENTITY_REFRESH_INTERVAL,
+    IDLE_AUTO_SUSPEND,
+    IDLE_CHECK_INTERVAL,
+    IDLE_CPU_THRESHOLD,
+    IDLE_PERIOD,
+    LEDGER_RECONCILE_INTERVAL,
+    MESSAGE_LIMIT,
+    REPORT_CACHE_TTL,
+    RUN_EDIT_INTERVAL,
+    RUN_TIMEOUT,
+    SIMULATION_DAYS,
+    SIMULATION_MAX_DAYS,
+    SIMULATION_RENEWAL_PROBABILITY,
+    WHO_CACHE_TTL,
+)
 
 
 class SystemRoutes:
@@ -29,6 +75,18 @@ class SystemRoutes:
     Routes for managing system-related tasks.
     """
 
+    # Renders /gen_report PDFs in worker processes
+    _report_renderer = ReportRenderer()
+    # Commands started by /run that are still running, by PID
+    _running_commands = {}
+    _cancelled_commands = set()
+    # Fields /status reads, by model, its cached answer is dropped when they change
+    STATUS_FIELDS = {
+        "TelegramUser": {"id", "tg_user_id", "tg_first_name"},
+        "Rental": {"telegram_user", "is_zombie", "end_time", "user_id"},
+        "User": {"linux_username"},
+    }
+
     # /help command
     @Auth.authorized_user
     async def help_command(self, event):
@@ -41,86 +99,194 @@ class SystemRoutes:
 
         🔐 **Admin Commands:**
 
-        - `/create_user <username> <plan_duration> <amount> <currency>`: Create a user with a plan duration and amount.
+        - `/create_user <username> <plan_duration> <amount> <currency> [plan_tier]`: Create a user with a plan duration and amount.
         - `/reduce_plan <username> <reduced_duration>`: Reduce the plan duration for a user.
         - `/sync_db`: Sync the database with the system.
         - `/debit <username> <amount> <currency>`: Debit the amount from the user.
         - `/credit <username> <amount> <currency>`: Credit the amount to the user.
         - `/earnings`: Show the total earnings.
-        - `/delete_user <username>`: Delete a user.
-        - `/extend_plan <username> <additional_duration> [amount] [currency]`: Extend a user's plan.
+        - `/import_payments`: Credit the payments of a bank or UPI statement, sent as a CSV file with the command as its caption.
+        - `/runway [count]`: List the users whose balance runs out the soonest.
+        - `/delete_user <username>`: Delete a user, archiving its home directory first.
+        - `/restore_user <username> [archive]`: Restore a user's home directory from its latest (or the given) archive.
+        - `/extend_plan <username> <additional_duration> [amount] [currency] [plan_tier]`: Extend a user's plan, optionally changing its tier.
         - `/payment_history <username>`: Show the payment history for a user.
         - `/unlink_user <username>`: Clear the Telegram username and user id for a user.
-        - `/list_users`: List all users along with their expiry dates and remaining time.
+        - `/list_users [all|expired|expiring <hours>|low_balance] [expiry|name|balance]`: List users along with their expiry dates and remaining time, filtered and sorted.
         - `/who`: List the currently connected users.
         - `/broadcast <message>`: Broadcast a message to all users.
+        - `/broadcast_resume`: Resume interrupted broadcasts.
         - `/link_user <username>`: Link a Telegram user to a system user.
+        - `/idle`: List idle rentals and the capacity reclaimed by suspending them.
+        - `/metrics`: Show per-command latency, error and backend timing metrics.
+        - `/simulate [days] [renewal_probability] [tier=probability ...]`: Project revenue and occupancy over the next days.
+        - `/export <users|rentals|payments|ledger> [csv|jsonl|xlsx] [YYYY-MM-DD[..YYYY-MM-DD]] [secrets]`: Export a table, optionally only the rows dated in a range.
         """
 
         await event.respond(help_text)
 
-    def generate_html(self):
-        """
-        Generate the HTML content for the report. The report includes user details, payment history, and expiry status.
-        The HTML template is rendered using Jinja2.
-        :return: HTML content as a string.
-        """
-
-        # Load the template
-        env = Environment(
-            loader=FileSystemLoader("./resources")
-        )  # Point to resources directory
-        template = env.get_template("report_template.html")
-
-        user_info = storage.join("User", ["Rental", "Payment"])
-        processed_rows = [
-            {
-                "user_id": user.id,
-                "username": user.linux_username,
-                "creation_ist": Utilities.get_date_str(
-                    int(user.created_at.timestamp())
-                ),
-                "expiry_ist": Utilities.get_date_str(user.rentals[0].end_time),
-                "is_active": user.rentals[0].is_active,
-                "total_payment": f"{sum([payment.amount for payment in user.payments]):.2f}",
-                "currency": user.payments[0].currency,
-                "payment_count": len(user.payments),
-            }
-            for user in user_info
-        ]
-        # Render the template with data
-        return template.render(rows=processed_rows)
-
     @Auth.authorized_user
     async def generate_report(self, event):
         """
         A command handler for /gen_report command.
         Generate a report in PDF format containing user details, payment history, and expiry status.
-        The PDF will be generated using HTML content generated from the Jinja2 template.
+        The PDF is rendered from the Jinja2 template in a worker process, so the bot stays
+        responsive meanwhile. It's reused until the database changes, and concurrent requests
+        share one rendering.
         :param event: Event object.
         :return: None
         """
 
         await event.respond("🔄 Generating report...")
         try:
-            storage.reload()
-            html_content = self.generate_html()
-
-            # Generate PDF
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_pdf:
-                HTML(string=html_content).write_pdf(temp_pdf.name)
-                pdf_file_path = temp_pdf.name
+            pdf = await result_cache.get(
+                "report",
+                self._report_renderer.render,
+                REPORT_CACHE_TTL,
+                version=storage.version,
+            )
+            pdf_file = io.BytesIO(pdf)
+            pdf_file.name = "report.pdf"
 
             # Send PDF
             await client.send_file(
                 event.chat_id,
-                pdf_file_path,
+                pdf_file,
                 caption=f"📄 Report {Utilities.get_date_str(int(datetime.now().timestamp()))}",
             )
 
         except Exception as e:
             await event.respond(f"❌ Error generating report: {e}")
-            logger.exception(e.message)
+            logger.exception(e)
+
+    # /export command
+    @Auth.authorized_user
+    async def export_data(self, event):
+        """
+        A command handler for /export command.
+        Export a table to a compressed CSV or JSONL file, or to an XLSX workbook, and upload it.
+        Users' Linux passwords are only exported if `secrets` is given.
+        Usage: /export <users|rentals|payments|ledger> [csv|jsonl|xlsx] [YYYY-MM-DD[..YYYY-MM-DD]] [secrets]
+        :param event: Event object.
+        :return: None
+        """
+
+        args = event.message.text.split()[1:]
+        if not args:
+            await event.respond(
+                "❓ Usage: /export <users|rentals|payments|ledger> [csv|jsonl|xlsx] "
+                "[YYYY-MM-DD[..YYYY-MM-DD]] [secrets]"
+            )
+            return
+
+        table, *options = args
+        file_format, start, end = "csv", None, None
+        secrets = "secrets" in options
+        try:
+            for option in options:
+                if option in Exporter.FORMATS:
+                    file_format = option
+                elif option != "secrets":
+                    first, _, last = option.partition("..")
+                    start = Utilities.parse_date(first) if first else None
+                    # The end date is included
+                    end = Utilities.parse_date(last) + 86400 if last else None
+            exporter = Exporter(table, file_format, start, end, secrets)
+        except ValueError as e:
+            await event.respond(f"❌ {e}")
+            return
+
+        await event.respond(f"🔄 Exporting `{table}`...")
+        with tempfile.TemporaryDirectory(prefix="export-") as directory:
+            path = os.path.join(directory, exporter.file_name)
+            try:
+                await metrics.to_thread("db", exporter.write, path)
+                await client.send_file(
+                    event.chat_id,
+                    path,
+                    caption=f"📦 `{exporter.rows}` {table} exported "
+                    f"({Utilities.format_bytes(os.path.getsize(path))})",
+                )
+            except Exception as e:
+                await event.respond(f"❌ Error exporting `{table}`: {e}")
+                logger.exception(e)
+
+    # /simulate command
+    @Auth.authorized_user
+    async def simulate(self, event):
+        """
+        A command handler for /simulate command.
+        Project the expiries, deductions, renewals and occupancy of the active rentals over
+        the next days, and upload the hourly cash-flow and concurrent-tenant curves as CSV.
+        Plans are renewed with the given probability, or the one given for their tier.
+        Usage: /simulate [days] [renewal_probability] [tier=probability ...]
+        :param event: Event object.
+        :return: None
+        """
+
+        try:
+            from models.simulation import Simulation, parse_tier_probabilities
+        except ImportError:
+            await event.respond("❌ Simulations need `numpy`.")
+            return
+
+        args = event.message.text.split()[1:]
+        try:
+            days = int(args[0]) if args else SIMULATION_DAYS
+            probability = (
+                float(args[1])
+                if len(args) > 1 and "=" not in args[1]
+                else SIMULATION_RENEWAL_PROBABILITY
+            )
+            tier_probabilities = parse_tier_probabilities(
+                arg for arg in args[1:] if "=" in arg
+            )
+            if not 0 < days <= SIMULATION_MAX_DAYS or not 0 <= probability <= 1:
+                raise ValueError
+        except ValueError:
+            await event.respond(
+                "❓ Usage: /simulate [days] [renewal_probability] [tier=probability ...]\n"
+                f"Up to {SIMULATION_MAX_DAYS} days, probabilities between 0 and 1. "
+                "For example: `/simulate 365 0.7 pro=0.9`"
+            )
+            return
+
+        await event.respond(f"🔄 Simulating the next {days} days...")
+        try:
+            simulation = await metrics.to_thread("db", Simulation.load)
+            projection = await asyncio.to_thread(
+                simulation.run,
+                days,
+                probability,
+                tier_probabilities,
+                JobManager.DEDUCTION_HOUR,
+            )
+            with tempfile.TemporaryDirectory(prefix="simulation-") as directory:
+                path = os.path.join(directory, f"projection-{days}d.csv")
+                with open(path, "w", newline="") as file:
+                    await asyncio.to_thread(Simulation.write_csv, projection, file)
+
+                tenants = projection["tenants"]
+                daily_cash = projection["payments"].reshape(days, 24).sum(axis=1)
+                await client.send_file(
+                    event.chat_id,
+                    path,
+                    caption=(
+                        f"📈 **Projection of {simulation.end_time.size} rentals over {days} days**\n\n"
+                        f"💰 **Renewals:** `{Money(round(projection['payments'].sum()))}`\n"
+                        f"💸 **Charges:** `{Money(round(projection['charges'].sum()))}` "
+                        f"(`{int(projection['failed_charges'].sum())}` failed)\n"
+                        f"👥 **Tenants:** `{int(tenants[0])}` → `{int(tenants[-1])}`, "
+                        f"peak `{int(tenants.max())}`\n"
+                        f"⚙️ **Peak CPU:** `{projection['cpu'].max():.1f}` cores, "
+                        f"**memory:** `{Utilities.format_bytes(projection['memory'].max())}`\n\n"
+                        f"👥 `{Simulation.sparkline(tenants)}`\n"
+                        f"💰 `{Simulation.sparkline(daily_cash)}`"
+                    ),
+                )
+        except Exception as e:
+            await event.respond(f"❌ Error simulating: {e}")
+            logger.exception(e)
 
     @Auth.authorized_user
     async def broadcast(self, event):
@@ -148,30 +314,84 @@ class SystemRoutes:
         rentals = storage.join("Rental", ["TelegramUser"], {"is_active": 1})
         telegram_ids = {rental.tguser.tg_user_id for rental in rentals if rental.tguser}
 
-        for telegram_id in telegram_ids:
-            try:
-                await client.send_message(telegram_id, message)
-            except Exception:
-                pass
+        from models import job_manager
+
+        broadcast = await Broadcast.create(
+            job_manager.redis_conn, message, telegram_ids
+        )
+        await self.run_broadcast(event, broadcast)
 
         # Broadcast to /dev/pts kernel nodes
         # This will broadcast the message to all connected users
-        process = await asyncio.create_subprocess_shell(
+        process = await asyncio.create_subprocess_exec(
             "wall",
             message,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
-        stdout, stderr = await process.communicate()
+        async with metrics.timed("subprocess"):
+            stdout, stderr = await process.communicate()
         if process.returncode != 0:
-            await event.respond(
-                f"✅ Broadcasted message to {len(telegram_ids)} user(s).\n❌ Error broadcasting to pts: {stderr.decode()}"
-            )
+            await event.respond(f"❌ Error broadcasting to pts: {stderr.decode()}")
         else:
-            await event.respond(
-                f"✅ Broadcasted message to {len(telegram_ids)} user(s).\n✅ Broadcast to pts successful: {stdout.decode()}"
+            await event.respond(f"✅ Broadcast to pts successful: {stdout.decode()}")
+
+    @Auth.authorized_user
+    async def resume_broadcasts(self, event):
+        """
+        A command handler for /broadcast_resume command.
+        Resume the broadcasts that were interrupted (e.g. by a restart) before reaching every recipient.
+        :param event: Event object.
+        :return: None
+        """
+
+        from models import job_manager
+
+        broadcasts = await Broadcast.get_unfinished(job_manager.redis_conn)
+        if not broadcasts:
+            await event.respond("✅ No interrupted broadcasts.")
+            return
+        for broadcast in broadcasts:
+            await self.run_broadcast(event, broadcast)
+
+    @staticmethod
+    async def run_broadcast(event, broadcast):
+        """
+        Run a broadcast while keeping a single progress message up to date.
+        :param event: Event object.
+        :param broadcast: The broadcast to run.
+        :return: None
+        """
+
+        def format_progress(counts, done=False):
+            header = "✅ Broadcast finished" if done else "📢 Broadcasting"
+            return (
+                f"{header} `{broadcast.id}`\n\n"
+                f"📨 **Sent:** `{counts['sent']}`\n"
+                f"❌ **Failed:** `{counts['failed']}`\n"
+                f"⏳ **Pending:** `{counts['pending']}`"
             )
 
+        progress_message = await event.respond(
+            format_progress(await broadcast.get_counts())
+        )
+
+        async def on_progress(counts):
+            try:
+                await progress_message.edit(format_progress(counts))
+            except MessageNotModifiedError:
+                pass
+            except RPCError as e:
+                logger.warning(f"Error updating broadcast progress: {e}")
+
+        counts = await broadcast.run(outbox, on_progress)
+        try:
+            await progress_message.edit(
+                format_progress(counts, done=not counts["pending"])
+            )
+        except MessageNotModifiedError:
+            pass
+
     # /who command
     @Auth.authorized_user
     async def list_connected_users(self, event):
@@ -181,7 +401,9 @@ class SystemRoutes:
         :return:
         """
 
-        connected_users = await SystemUserManager.get_running_users()
+        connected_users = await result_cache.get(
+            "who", SystemUserManager.get_running_users, WHO_CACHE_TTL
+        )
         try:
             await event.edit(
                 f"```\n{connected_users}\n```",
@@ -199,6 +421,7 @@ class SystemRoutes:
         :param event: Event object.
         :return: None
         """
+        result_cache.invalidate("who")
         await self.list_connected_users(event)
 
     # /start command
@@ -214,7 +437,7 @@ class SystemRoutes:
             return
 
         user_uuid = args[1]
-        user = storage.query_object("User", uuid=user_uuid, deleted=0)
+        user = await lookup_cache.find("User", uuid=user_uuid, deleted=0)
         if not user:
             await event.respond("❌ Invalid or expired link.")
             return
@@ -224,8 +447,8 @@ class SystemRoutes:
         first_name = event.sender.first_name
         last_name = event.sender.last_name
         username = user.linux_username
-        rental = storage.query_object("Rental", user_id=user.id, is_zombie=0)
-        tg_user = storage.query_object("TelegramUser", user_id=user.id)
+        rental = await lookup_cache.find("Rental", user_id=user.id, is_zombie=0)
+        tg_user = await lookup_cache.find("TelegramUser", user_id=user.id)
 
         if tg_user and tg_user.tg_user_id != tg_user_id:
             await event.respond(
@@ -270,8 +493,8 @@ class SystemRoutes:
         await event.respond(response_msg, parse_mode="html", link_preview=False)
 
         admin_msg = f"🔑 Password sent to user {user_tag} bearing linux username: <code>{username}</code>"
-        await client.send_message(
-            ADMIN_ID, admin_msg, parse_mode="html", link_preview=False
+        await outbox.send(
+            ADMIN_ID, admin_msg, parse_mode="html", link_preview=False, coalesce=True
         )
 
     @Auth.authorized_user
@@ -301,6 +524,9 @@ class SystemRoutes:
     async def run_command(self, event, command=None):
         """
         A handler for the /run command. This command is used to run commands on the server.
+        The output is streamed into a message that is edited every `RUN_EDIT_INTERVAL` seconds.
+        Commands are killed after `RUN_TIMEOUT` seconds or when the cancel button is pressed,
+        and output longer than a message is sent as a compressed file once the command exits.
         :param event: Event object.
         :return:
         """
@@ -309,8 +535,142 @@ class SystemRoutes:
             return
 
         command = event.message.text.split(" ", 1)[1]
-        output = await SystemUserManager.run_command(command)
-        await event.respond(f"```\n{output}\n```")
+        process = await asyncio.create_subprocess_exec(
+            "bash",
+            "-c",
+            command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+        self._running_commands[process.pid] = process
+        cancel_button = [Button.inline("🛑 Cancel", data=f"cancel_run {process.pid}")]
+        message = await event.respond(
+            f"⏳ Running `{command[:200]}`...", buttons=cancel_button
+        )
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # The full output is compressed into a file as it arrives, only its tail is kept in memory
+        log_file = tempfile.NamedTemporaryFile(prefix="run-", suffix=".log.gz")
+        log = gzip.GzipFile(fileobj=log_file, mode="wb")
+        state = {"tail": "", "size": 0, "dirty": False}
+        tail_limit = MESSAGE_LIMIT - 200
+
+        async def read_output():
+            while chunk := await process.stdout.read(65536):
+                log.write(chunk)
+                state["size"] += len(chunk)
+                state["tail"] = (state["tail"] + decoder.decode(chunk))[-tail_limit:]
+                state["dirty"] = True
+            await process.wait()
+
+        async def edit_output():
+            while True:
+                await asyncio.sleep(RUN_EDIT_INTERVAL)
+                if state["dirty"]:
+                    state["dirty"] = False
+                    await self.__edit_run_message(
+                        message,
+                        f"⏳ Running... `{Utilities.format_bytes(state['size'])}`",
+                        state["tail"],
+                        cancel_button,
+                    )
+
+        editor = asyncio.create_task(edit_output())
+        try:
+            async with metrics.timed("subprocess"):
+                await asyncio.wait_for(read_output(), RUN_TIMEOUT)
+            if process.pid in self._cancelled_commands:
+                status = "🛑 Cancelled."
+            else:
+                status = f"✅ Exited with code `{process.returncode}`."
+        except asyncio.TimeoutError:
+            self.__kill_command(process)
+            await process.wait()
+            status = f"⏱️ Killed after `{RUN_TIMEOUT}` seconds."
+        finally:
+            editor.cancel()
+            self._running_commands.pop(process.pid, None)
+            self._cancelled_commands.discard(process.pid)
+            log.close()
+            log_file.flush()
+
+        state["tail"] += decoder.decode(b"", final=True)
+        try:
+            if state["size"] <= tail_limit:
+                await self.__edit_run_message(message, status, state["tail"])
+                return
+            await self.__edit_run_message(
+                message,
+                f"{status} Output was `{Utilities.format_bytes(state['size'])}`, "
+                f"sending it as a file. Last lines:",
+                state["tail"],
+            )
+            await client.send_file(
+                event.chat_id,
+                log_file.name,
+                caption=f"📄 Output of `{command[:200]}`",
+                reply_to=message.id,
+            )
+        finally:
+            log_file.close()
+
+    @Auth.authorized_user
+    async def cancel_run(self, event):
+        """
+        Callback query handler for the cancel button of a running /run command.
+        :param event: Event object.
+        :return: None
+        """
+
+        pid = int(event.data.decode().split()[1])
+        process = self._running_commands.get(pid)
+        if not process:
+            await event.answer("The command already finished.")
+            return
+        self._cancelled_commands.add(pid)
+        self.__kill_command(process)
+        await event.answer("🛑 Cancelling...")
+
+    @staticmethod
+    def __kill_command(process):
+        """
+        Kill a command started by /run along with every process it spawned.
+        :param process: The asyncio subprocess of the command.
+        :return: None
+        """
+
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except PermissionError:
+            # A child runs as another user (sudo), at least stop the shell
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    async def __edit_run_message(message, status, output, buttons=None):
+        """
+        Show the current status and output of a /run command.
+        :param message: The message to edit.
+        :param status: The status line.
+        :param output: The output to show, already trimmed to fit the message.
+        :param buttons: Optional buttons to keep on the message.
+        :return: None
+        """
+
+        text = (
+            f"{status}\n```\n{output.rstrip().replace('```', '` ` `')}\n```"
+            if output
+            else status
+        )
+        try:
+            await message.edit(text, buttons=buttons)
+        except MessageNotModifiedError:
+            pass
+        except RPCError as e:
+            logger.warning(f"Error updating /run output: {e}")
 
     @classmethod
     async def check_disk_usage(cls, event):
@@ -322,7 +682,12 @@ class SystemRoutes:
         """
         command = "sudo du -s /home/* 2>/dev/null | awk -F'/' '{user = $NF; size[$NF] = $1} END {for (user in size) printf \"%s %.2f\\n\", user, size[user] / 1024 / 1024}'"
         await event.respond("🔄 Checking disk usage...")
-        output = await SystemUserManager.run_command(command)
+        # Walking every home directory is slow, so the result is reused for a while
+        output = await result_cache.get(
+            "disk_usage",
+            lambda: SystemUserManager.run_command(command),
+            DISK_USAGE_CACHE_TTL,
+        )
 
         # Parse into the dictionary
         disk_usage = {}
@@ -335,27 +700,183 @@ class SystemRoutes:
             f"```\n{output}\n```",
         )
 
+    @Auth.authorized_user
+    async def handle_abuse_action(self, event):
+        """
+        Callback query handler for the buttons of an abusive process alert.
+        Throttles, kills or ignores the flagged user's processes.
+        :param event: Event object.
+        :return: None
+        """
+
+        _, action, username = event.data.decode().split()
+        from models import job_manager
+
+        if action == "throttle":
+            if await CgroupManager.throttle_cpu(username, ABUSE_THROTTLE_CPU):
+                result = (
+                    f"🐢 User `{username}` throttled to `{ABUSE_THROTTLE_CPU}%` CPU."
+                )
+            elif await SystemUserManager.renice_user(username):
+                result = f"🐢 Processes of `{username}` reniced (no cgroup available)."
+            else:
+                result = f"❌ Error throttling user `{username}`."
+        elif action == "kill":
+            reaped = await SystemUserManager.terminate_user_processes(username)
+            result = (
+                f"💀 Terminated `{reaped['processes']}` process(es) of `{username}`, "
+                f"reclaimed `{Utilities.format_bytes(reaped['memory_bytes'])}`."
+            )
+        else:
+            job_manager.abuse_detector.ignore(username, ABUSE_IGNORE_PERIOD)
+            result = (
+                f"🙈 Ignoring `{username}` for "
+                f"{Utilities.parse_duration_to_human_readable(ABUSE_IGNORE_PERIOD)}."
+            )
+
+        message = await event.get_message()
+        await event.edit(f"{message.text}\n\n{result}")
+
+    # /metrics command
+    @Auth.authorized_user
+    async def metrics_report(self, event):
+        """
+        A handler for the /metrics command.
+        Shows the latency, error count and backend time of every command handled since startup,
+        slowest first. The same metrics are served in the Prometheus format on `METRICS_PORT`.
+        :param event: Event object.
+        :return: None
+        """
+
+        rows = metrics.summary()
+        if not rows:
+            await event.respond("📊 No commands handled yet.")
+            return
+
+        def format_seconds(seconds):
+            if seconds is None:
+                return "-"
+            if seconds == float("inf"):
+                return f">{DURATION_BUCKETS[-1]}s"
+            return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:g}s"
+
+        uptime = int(time.time() - metrics.started_at)
+        cache_stats = result_cache.stats
+        response = (
+            f"📊 **Command Metrics** (uptime "
+            f"{Utilities.parse_duration_to_human_readable(uptime)})\n"
+            f"🧠 Result cache: `{cache_stats['hits']}` hits, `{cache_stats['misses']}` misses, "
+            f"`{cache_stats['coalesced']}` coalesced\n\n"
+        )
+        for row in rows:
+            running = f", `{row['in_flight']}` running" if row["in_flight"] else ""
+            entry = (
+                f"`{row['command']}`: `{row['calls']}` calls, `{row['errors']}` errors"
+                f"{running}\n"
+                f"   ⏱️ p50 `{format_seconds(row['p50'])}`, p95 `{format_seconds(row['p95'])}`, "
+                f"🗄️ `{row['db_queries']:.1f}` queries\n"
+            )
+            if row["backends"]:
+                entry += (
+                    "   "
+                    + ", ".join(
+                        f"{backend} `{format_seconds(seconds)}`"
+                        for backend, seconds in row["backends"].items()
+                    )
+                    + "\n"
+                )
+            if len(response) + len(entry) > MESSAGE_LIMIT:
+                break
+            response += entry
+        await event.respond(response)
+
+    # /idle command
+    @Auth.authorized_user
+    async def idle_report(self, event):
+        """
+        A handler for the /idle command.
+        Lists the idle rentals and how much capacity suspending them reclaimed.
+        :param event: Event object.
+        :return: None
+        """
+
+        rentals = storage.join(
+            "Rental", ["User"], {"is_active": 1, "is_expired": 0, "is_idle": 1}
+        )
+        if not rentals:
+            await event.respond("😴 No idle rentals.")
+            return
+
+        now = int(time.time())
+        suspended = [rental for rental in rentals if rental.is_suspended]
+        held_memory = sum(rental.suspended_memory or 0 for rental in suspended)
+        reclaimed_memory = sum(rental.reclaimed_memory or 0 for rental in suspended)
+
+        response = (
+            f"😴 **Idle Rentals:** `{len(rentals)}` (`{len(suspended)}` suspended)\n"
+            f"💾 **Memory held by suspended rentals:** `{Utilities.format_bytes(held_memory)}`\n"
+            f"♻️ **Memory reclaimed:** `{Utilities.format_bytes(reclaimed_memory)}`\n\n"
+        )
+        for rental in sorted(rentals, key=lambda r: r.idle_since or now):
+            state = "🧊 suspended" if rental.is_suspended else "💤 idle"
+            response += (
+                f"👤 `{rental.user.linux_username}` {state} for "
+                f"{Utilities.parse_duration_to_human_readable(now - (rental.idle_since or now))}"
+            )
+            if rental.is_suspended:
+                response += f", holding `{Utilities.format_bytes(rental.suspended_memory or 0)}`"
+            response += "\n"
+
+        await event.respond(response)
+
+    @staticmethod
+    def __load_status(tg_user_id):
+        """
+        Read what /status shows to a Telegram account.
+        :param tg_user_id: The Telegram ID of the account.
+        :return: The Linux username, Telegram first name and plan end time (dict), the end time
+         being None if there's no plan. None if the account isn't linked to a user.
+        """
+
+        user = storage.query_object("TelegramUser", tg_user_id=tg_user_id)
+        if not user:
+            return None
+
+        rental = storage.query_object("Rental", telegram_user=user.id, is_zombie=0)
+        if not rental:
+            return {"end_time": None}
+
+        return {
+            "linux_username": rental.user.linux_username,
+            "tg_first_name": rental.tguser.tg_first_name,
+            "end_time": rental.end_time,
+        }
+
     @classmethod
     async def user_status(cls, event):
         tg_user_id = event.sender_id
-        user = storage.query_object("TelegramUser", tg_user_id=tg_user_id)
-        if not user:
+        # Every tenant's most frequent request, served from the lookup cache
+        status = await lookup_cache.get(
+            f"status:{tg_user_id}",
+            lambda: cls.__load_status(tg_user_id),
+            cls.STATUS_FIELDS,
+        )
+        if not status:
             await event.respond("❌ User not found.")
             return
 
-        rental = storage.query_object("Rental", telegram_user=user.id, is_zombie=0)
-        if not rental:
+        if status["end_time"] is None:
             # Plan is either expired or not found
             await event.respond("❌ Plan expired or not found.")
             return
 
-        remaining_time = rental.end_time - int(time.time())
+        remaining_time = status["end_time"] - int(time.time())
         days, remainder = divmod(remaining_time, 86400)
         hours, minutes = divmod(remainder, 3600)
         minutes //= 60
 
-        linux_username = rental.user.linux_username
-        tg_first_name = rental.tguser.tg_first_name
+        linux_username = status["linux_username"]
+        tg_first_name = status["tg_first_name"]
 
         message = "🖥️🐝 **ServerHive Server Rentals**\n\n"
         message += "📋 **Plan Details**\n\n"
@@ -363,7 +884,7 @@ class SystemRoutes:
             f"👤 **User:** {linux_username}\n"
             f"📱 **Telegram User:** {tg_first_name}\n"
             f"🟢 **Plan Status:** Active\n"
-            f"📅 **Expiry Date:** {Utilities.get_date_str(rental.end_time)}\n"
+            f"📅 **Expiry Date:** {Utilities.get_date_str(status['end_time'])}\n"
             f"⏳ **Remaining Time:** {days} days, {hours} hours, {minutes} minutes"
         )
 
@@ -378,9 +899,23 @@ class JobManager:
     redis_conn = None
     scheduler = None
     DEDUCTION_HOUR = 6
+    MONITORED_USERS_TTL = 60
+    # Checksum each range of users was last reconciled with the ledger at, by range
+    LEDGER_CHECKSUMS_KEY = "ledger:checksums"
+    # Sorted set of the IDs of users with an active paid plan, by when their balance runs out
+    RUNWAY_KEY = "runway"
+    # Fields of the change feed's models the runway forecast depends on
+    RUNWAY_FIELDS = {
+        "User": {"balance_minor", "deleted"},
+        "Rental": {"end_time", "is_active", "is_expired", "price_rate_minor"},
+    }
 
     def __init__(self):
         self.scheduler: AsyncIOScheduler = AsyncIOScheduler()
+        self.abuse_detector = AbuseDetector()
+        self.idle_detector = IdleDetector()
+        self.__monitored_users = {}
+        self.__monitored_users_at = 0
 
     async def save_job_to_redis(
         self, job_id, func_name, trigger_type, trigger_args, args, name
@@ -489,13 +1024,10 @@ class JobManager:
             user = rental.user
             telegram_id = rental.tguser.tg_user_id if rental.tguser else None
 
-            if telegram_id:
-                tg_user = await client.get_entity(telegram_id)
-            else:
-                tg_user = None
+            tg_user = entity_cache.get_cached(rental.tguser) if telegram_id else None
 
             message = (
-                f"Hey {tg_user.first_name}!\n\n"
+                f"Hey {tg_user.first_name if tg_user else user.linux_username}!\n\n"
                 f"❌ Your plan for the user: `{user.linux_username}` has been expired."
                 f"\n\nThanks for using our service. 🙏"
                 f"\nFeel free to contact the admin for any queries. 📞"
@@ -506,11 +1038,21 @@ class JobManager:
             status, removal_str = await SystemUserManager.remove_ssh_auth_keys(
                 user.linux_username
             )
+            if rental.is_suspended:
+                # Frozen processes can't act on SIGTERM
+                await SystemUserManager.freeze_user_processes(
+                    user.linux_username, frozen=False
+                )
+            reaped = await SystemUserManager.terminate_user_processes(
+                user.linux_username
+            )
+            rental.record_reaped_usage(reaped)
+            await CgroupManager.release_slice(user.linux_username)
 
             if telegram_id:
-                await client.send_message(telegram_id, message)
+                await outbox.send(telegram_id, message)
 
-            await client.send_message(
+            await outbox.send(
                 ADMIN_ID,
                 f"⚠️ Plan for user `{user.linux_username}` has expired. Please take necessary action.",
                 buttons=[
@@ -522,11 +1064,20 @@ class JobManager:
                     ],
                 ],
             )
-            await client.send_message(
+            await outbox.send(
                 ADMIN_ID,
                 f"🔑 New password for user `{user.linux_username}`: `{new_password}`",
+                coalesce=True,
+            )
+            await outbox.send(ADMIN_ID, f"🔑 {removal_str}", coalesce=True)
+            await outbox.send(
+                ADMIN_ID,
+                f"🧹 Terminated `{reaped['processes']}` process(es) of `{user.linux_username}` "
+                f"(`{reaped['killed']}` force-killed).\n"
+                f"💾 **Memory reclaimed:** `{Utilities.format_bytes(reaped['memory_bytes'])}`\n"
+                f"⚙️ **CPU time consumed:** `{reaped['cpu_seconds']:.2f}s`",
+                coalesce=True,
             )
-            await client.send_message(ADMIN_ID, f"🔑 {removal_str}")
 
             rental.is_expired = 1
 
@@ -571,7 +1122,7 @@ class JobManager:
 
                     # Log the successful deduction
                     logger.info(
-                        f"Deducted {total_deduction} {rental.currency} from {user.linux_username}'s balance. New balance: {user.balance}."
+                        f"Deducted {total_deduction} from {user.linux_username}'s balance. New balance: {user.balance}."
                     )
                 else:
                     # Insufficient balance case
@@ -582,6 +1133,239 @@ class JobManager:
             # General error handling
             logger.exception(e.message)
 
+    async def enforce_resource_limits(self):
+        """
+        Move the processes of every active rental into the rental's cgroup.
+        Login sessions are moved at login by `models/engine/cgroup_attach.py` through pam_exec,
+        this periodically catches the processes started otherwise (e.g. by cron) or before
+        the hook was installed.
+        :return: None
+        """
+
+        if not CgroupManager.is_available():
+            return
+
+        rentals = storage.join("Rental", ["User"], {"is_active": 1, "is_expired": 0})
+        for rental in rentals if rentals else []:
+            if rental.is_suspended:
+                # Moving a fresh login into a frozen cgroup would freeze it,
+                # suspended rentals are left alone until they're thawed.
+                continue
+            username = rental.user.linux_username
+            uid = SystemUserManager.get_uid(username)
+            if uid is None:
+                continue
+            moved = await CgroupManager.attach_user_processes(username, uid)
+            if moved:
+                logger.info(f"Moved {moved} process(es) of {username} into its cgroup.")
+
+    def get_monitored_users(self):
+        """
+        Get the system users of all active rentals, keyed by UID.
+        The mapping is cached for `MONITORED_USERS_TTL` seconds so that
+        frequent monitoring jobs don't hit the database on every run.
+        :return: A dictionary mapping UID to username.
+        """
+
+        if time.monotonic() - self.__monitored_users_at > self.MONITORED_USERS_TTL:
+            rentals = storage.join(
+                "Rental", ["User"], {"is_active": 1, "is_expired": 0}
+            )
+            self.__monitored_users = SystemUserManager.get_uids(
+                [rental.user.linux_username for rental in rentals or []]
+            )
+            self.__monitored_users_at = time.monotonic()
+        return self.__monitored_users
+
+    async def detect_abusive_processes(self):
+        """
+        Sample the CPU usage of all tenants and alert the admin about sustained outliers.
+        Depending on `ABUSE_AUTO_ACTION`, the offending user is also reniced, frozen or throttled right away.
+        :return: None
+        """
+
+        users = self.get_monitored_users()
+        if not users:
+            return
+
+        flagged = await asyncio.to_thread(self.abuse_detector.sample, users)
+        for report in flagged:
+            username = report["username"]
+            logger.warning(f"Abusive CPU usage detected for {username}: {report}")
+
+            action_str = ""
+            if ABUSE_AUTO_ACTION == "renice":
+                await SystemUserManager.renice_user(username)
+                action_str = "\n🤖 Processes were reniced automatically."
+            elif ABUSE_AUTO_ACTION == "freeze":
+                await SystemUserManager.freeze_user_processes(username)
+                action_str = "\n🤖 Processes were frozen automatically."
+            elif ABUSE_AUTO_ACTION == "throttle":
+                await CgroupManager.throttle_cpu(username, ABUSE_THROTTLE_CPU)
+                action_str = (
+                    f"\n🤖 CPU was throttled to `{ABUSE_THROTTLE_CPU}%` automatically."
+                )
+
+            await outbox.send(
+                ADMIN_ID,
+                f"🚨 Sustained abnormal CPU usage by `{username}`\n\n"
+                f"⚙️ **Current:** `{report['usage']:.2f}` cores\n"
+                f"📊 **Baseline:** `{report['mean']:.2f}` cores "
+                f"(p{ABUSE_PERCENTILE:g}: `{report['percentile']:.2f}`)"
+                f"{action_str}",
+                buttons=[
+                    [
+                        Button.inline("Throttle", data=f"abuse throttle {username}"),
+                        Button.inline("Kill", data=f"abuse kill {username}"),
+                        Button.inline("Ignore", data=f"abuse ignore {username}"),
+                    ]
+                ],
+            )
+
+    async def reconcile_ledger(self):
+        """
+        Verify the balances of users against the ledger. Only the ranges of users whose
+        checksum changed since they were last verified are checked again, and mismatches
+        are reported to the admin once per change.
+        :return: None
+        """
+
+        verified = await self.redis_conn.hgetall(self.LEDGER_CHECKSUMS_KEY)
+        results, mismatches, stale = await metrics.to_thread(
+            "db", Ledger.reconcile, verified
+        )
+        if results:
+            await self.redis_conn.hset(self.LEDGER_CHECKSUMS_KEY, mapping=results)
+        if stale:
+            await self.redis_conn.hdel(self.LEDGER_CHECKSUMS_KEY, *stale)
+
+        lines = []
+        for prefix, users in mismatches.items():
+            if verified.get(prefix) == results[prefix]:
+                # Already reported, and nothing changed since
+                continue
+            for username, balance, ledger_balance in users:
+                logger.warning(
+                    f"Balance of {username} doesn't match the ledger: "
+                    f"{balance} != {ledger_balance}"
+                )
+                lines.append(
+                    f"👤 `{username}`: `{balance:.2f}` (ledger: `{ledger_balance:.2f}`)"
+                )
+        if lines:
+            await outbox.send(
+                ADMIN_ID,
+                "⚠️ Balances that don't match the ledger:\n\n" + "\n".join(lines),
+                coalesce=True,
+            )
+
+    async def refresh_entity_cache(self):
+        """
+        Refresh the Telegram profiles that are missing from the entity cache or have expired,
+        and store changed names on the `TelegramUser` rows the cache falls back to.
+        :return: None
+        """
+
+        if not client.is_connected():
+            return
+
+        profiles = await entity_cache.refresh()
+        if not profiles:
+            return
+
+        telegram_users = {
+            telegram_user.tg_user_id: telegram_user
+            for telegram_user in storage.all("TelegramUser").values()
+        }
+        changed = False
+        for profile in profiles:
+            telegram_user = telegram_users.get(profile.id)
+            if telegram_user and (
+                telegram_user.tg_username,
+                telegram_user.tg_first_name,
+                telegram_user.tg_last_name,
+            ) != (profile.username, profile.first_name, profile.last_name):
+                telegram_user.tg_username = profile.username
+                telegram_user.tg_first_name = profile.first_name
+                telegram_user.tg_last_name = profile.last_name
+                changed = True
+        if changed:
+            storage.save()
+
+    async def detect_idle_rentals(self):
+        """
+        Mark rentals without any activity for `IDLE_PERIOD` seconds as idle and resume them on activity.
+        Activity is a login, tty input or CPU usage above `IDLE_CPU_THRESHOLD`.
+        With `IDLE_AUTO_SUSPEND`, the processes of idle rentals without open sessions are frozen
+        and thawed again on the tenant's next SSH login.
+        :return: None
+        """
+
+        rentals = storage.join("Rental", ["User"], {"is_active": 1, "is_expired": 0})
+        if not rentals:
+            return
+
+        uids = SystemUserManager.get_uids(
+            [rental.user.linux_username for rental in rentals]
+        )
+        activity = await asyncio.to_thread(self.idle_detector.sample, uids)
+        usernames = {username: uid for uid, username in uids.items()}
+        now = int(time.time())
+        changed = False
+
+        for rental in rentals:
+            username = rental.user.linux_username
+            info = activity.get(username)
+            if info is None:
+                continue
+
+            activity_time = info["activity_time"]
+            if info["cpu"] >= IDLE_CPU_THRESHOLD:
+                activity_time = now
+
+            if rental.is_idle:
+                if activity_time and activity_time > rental.idle_since:
+                    if rental.is_suspended:
+                        await SystemUserManager.freeze_user_processes(
+                            username, frozen=False
+                        )
+                    rental.mark_active(activity_time)
+                    changed = True
+                    logger.info(f"Rental of {username} resumed from idle.")
+                continue
+
+            last_active = max(
+                activity_time or 0, rental.last_active_at or rental.start_time
+            )
+            if now - last_active < IDLE_PERIOD:
+                # Only persist activity that moves the stored timestamp noticeably,
+                # otherwise every sample would end up in a commit.
+                if last_active - (rental.last_active_at or 0) > IDLE_PERIOD // 100:
+                    rental.last_active_at = last_active
+                    changed = True
+                continue
+
+            # A frozen shell can't register tty input, so rentals with
+            # open sessions are only marked idle, never suspended.
+            suspend = IDLE_AUTO_SUSPEND and not info["sessions"]
+            memory = reclaimed = 0
+            if suspend:
+                pids = await asyncio.to_thread(
+                    ProcessInspector.get_user_pids, usernames[username]
+                )
+                _, memory = await asyncio.to_thread(ProcessInspector.get_usage, pids)
+                if await SystemUserManager.freeze_user_processes(username):
+                    reclaimed = await CgroupManager.reclaim_memory(username)
+            rental.mark_idle(suspend, memory, reclaimed)
+            changed = True
+            logger.info(
+                f"Rental of {username} marked idle"
+                f"{', processes suspended' if suspend else ''}."
+            )
+
+        if changed:
+            storage.save()
+
     def schedule_rental_expiration(self, rental):
         """
         Schedule the expiration job for a rental plan.
@@ -682,20 +1466,15 @@ class JobManager:
             tg_user = rental.tguser
             remaining_time = datetime.fromtimestamp(rental.end_time) - datetime.now()
 
-            admin, telegram_user = await asyncio.gather(
-                client.get_entity(PeerUser(ADMIN_ID)),
-                client.get_entity(
-                    PeerUser(tg_user.tg_user_id) if tg_user else None,
-                ),
-                return_exceptions=True,
-            )
+            admin = await entity_cache.get(ADMIN_ID)
+            telegram_user = entity_cache.get_cached(tg_user) if tg_user else None
             remaining_time_str = (
                 f"{remaining_time.days} days, "
                 f"{remaining_time.seconds // 3600} hours, "
                 f"{(remaining_time.seconds // 60) % 60} minutes"
             )
             message = (
-                f"⏰ {telegram_user.first_name}, Your plan for user `{user.linux_username}` "
+                f"⏰ {telegram_user.first_name if telegram_user else user.linux_username}, Your plan for user `{user.linux_username}` "
                 f"will expire in {remaining_time_str}."
                 "\n\nPlease contact the admin if you want to extend the plan. 🔄"
                 "\nYour data will be deleted after the expiry time. 🗑️"
@@ -704,11 +1483,8 @@ class JobManager:
             # Parse an Extend my Plan button
             contact_url = f"https://t.me/{admin.username}"
 
-            # Get current bot details
-            current_bot_id = os.environ["TG_BOT_ID"]
-
             # Get the bot username
-            bot_entity = await client.get_entity(int(current_bot_id))
+            bot_entity = await entity_cache.get_me()
 
             extension_request_msg = f"📢 Hello {admin.username}, \nI would like to extend my current rental plan."
             extension_request_msg += f"\n\n👤 User: {user.linux_username}"
@@ -719,7 +1495,7 @@ class JobManager:
 
             contact_url += "?text=" + urllib.parse.quote(extension_request_msg)
 
-            await client.send_message(
+            await outbox.send(
                 tg_user.tg_user_id if tg_user else ADMIN_ID,
                 message,
                 buttons=[
@@ -759,6 +1535,141 @@ class JobManager:
         )
         logger.info(f"Scheduled daily deduction job at {self.DEDUCTION_HOUR}:00")
 
+    async def schedule_runway(self, user):
+        """
+        Forecast when the balance of a user drops to each number of days of runway and
+        schedule the warnings at those times, replacing the ones scheduled before.
+        Called from the change feed whenever the user's balance or plans change, the daily
+        charges don't change the forecast. If the change itself brought the runway down past warnings
+        that were still scheduled, the lowest of them is sent right away.
+        :param user: The user.
+        :return: None
+        """
+
+        rentals = storage.all("Rental", {"user_id": user.id}).values()
+        forecast = Runway.forecast(user, rentals)
+        now = int(time.time())
+        crossed = []
+        for days in Runway.WARNING_DAYS:
+            job_id = f"runway_{days}_{user.id}"
+            warning_time = forecast["warnings"].get(days) if forecast else None
+            if warning_time is not None and warning_time > now:
+                self.add_job(
+                    self.notify_runway,
+                    trigger=DateTrigger(run_date=datetime.fromtimestamp(warning_time)),
+                    job_id=job_id,
+                    args=[user.id, days],
+                    replace_existing=True,
+                    name="runway",
+                )
+                continue
+
+            job = self.scheduler.get_job(job_id)
+            if job:
+                job.remove()
+                await self.remove_job_from_redis(job_id)
+                if warning_time is not None:
+                    crossed.append(days)
+        if crossed:
+            await self.notify_runway(user.id, min(crossed))
+
+        if forecast:
+            await self.redis_conn.zadd(
+                self.RUNWAY_KEY, {user.id: forecast["runs_out_at"]}
+            )
+        else:
+            await self.redis_conn.zrem(self.RUNWAY_KEY, user.id)
+
+    async def handle_changes(self, changes):
+        """
+        Reschedule the runway warnings of the users whose balance or plans changed, as
+        the change feed reports it. The daily charges are skipped, they don't change the forecast.
+        :param changes: The changes, from the change feed.
+        :return: None
+        """
+
+        user_ids = set()
+        for change in changes:
+            fields = self.RUNWAY_FIELDS.get(change["model"])
+            if fields is None or not change["user_id"]:
+                continue
+            if change["op"] == "update" and (
+                "last_deduction_time" in change["fields"]
+                or not fields.intersection(change["fields"])
+            ):
+                continue
+            user_ids.add(change["user_id"])
+
+        for user_id in user_ids:
+            user = storage.query_object("User", id=user_id)
+            if user:
+                await self.schedule_runway(user)
+
+    async def schedule_all_runways(self):
+        """
+        Schedule the runway warnings of all users with an active rental.
+        This method will be called when the system starts without any runway forecasts, or
+        when the change feed moved on without the job engine, afterward they're kept up to
+        date as balances and plans change.
+        :return: None
+        """
+
+        rentals = storage.join("Rental", ["User"], {"is_active": 1, "is_expired": 0})
+        users = {rental.user.id: rental.user for rental in rentals or []}
+        for user in users.values():
+            await self.schedule_runway(user)
+        logger.info(f"Scheduled runway warnings for {len(users)} users")
+
+    async def notify_runway(self, user_id, days):
+        """
+        Warn the tenant and the admin that the balance of a user is running out.
+        This method will be called by the scheduler when the runway of the user drops to
+        the given number of days. The runway is forecast again, in case it has changed since.
+        :param user_id: The ID of the user.
+        :param days: The number of days of runway the warning was scheduled for.
+        :return: None
+        """
+
+        user = storage.query_object("User", id=user_id, deleted=0)
+        if not user:
+            return
+        rentals = [
+            rental
+            for rental in storage.all("Rental", {"user_id": user_id}).values()
+            if rental.is_active and not rental.is_expired
+        ]
+        forecast = Runway.forecast(user, rentals)
+        if not forecast or forecast["days"] > days:
+            return
+
+        runs_out_str = Utilities.get_date_str(forecast["runs_out_at"])
+        if forecast["days"]:
+            runway_str = (
+                f"covers `{forecast['days']}` more day(s) of your plan for user "
+                f"`{user.linux_username}` (`{forecast['daily_rate']}` per day)"
+            )
+        else:
+            runway_str = (
+                f"no longer covers the daily charge of `{forecast['daily_rate']}` "
+                f"for user `{user.linux_username}`"
+            )
+
+        tg_user = next((rental.tguser for rental in rentals if rental.tguser), None)
+        if tg_user:
+            telegram_user = entity_cache.get_cached(tg_user)
+            await outbox.send(
+                tg_user.tg_user_id,
+                f"💸 {telegram_user.first_name if telegram_user else user.linux_username}, "
+                f"your balance of `{user.balance}` {runway_str}."
+                f"\n\nPlease contact the admin to top up before {runs_out_str}. 🔄",
+            )
+        await outbox.send(
+            ADMIN_ID,
+            f"💸 The balance of `{user.linux_username}` (`{user.balance}`) "
+            f"runs out on {runs_out_str}, `{forecast['days']}` day(s) of runway left.",
+            coalesce=True,
+        )
+
     def job_listener(self, event):
         """
         A listener to handle job execution events.
@@ -819,8 +1730,9 @@ class JobManager:
         """
         if trigger_args is None:
             trigger_args = {}
+        # Each run is a unit of work of its own
         self.scheduler.add_job(
-            func,
+            storage.in_unit_of_work(func),
             trigger,
             id=job_id,
             replace_existing=replace_existing,
@@ -850,6 +1762,44 @@ class JobManager:
         await self.init_redis()
         self.scheduler.start()
         logger.info("Scheduler started.")
+        change_feed.subscribe(
+            "jobs",
+            storage.in_unit_of_work(self.handle_changes),
+            storage.in_unit_of_work(self.schedule_all_runways),
+        )
+
+        # Recurring maintenance jobs are registered on every start,
+        # so they are not persisted to Redis. Each run is a unit of work of its own.
+        self.scheduler.add_job(
+            storage.in_unit_of_work(self.enforce_resource_limits),
+            IntervalTrigger(seconds=CGROUP_SWEEP_INTERVAL),
+            id="enforce_resource_limits",
+            replace_existing=True,
+        )
+        self.scheduler.add_job(
+            storage.in_unit_of_work(self.detect_abusive_processes),
+            IntervalTrigger(seconds=ABUSE_SAMPLE_INTERVAL),
+            id="detect_abusive_processes",
+            replace_existing=True,
+        )
+        self.scheduler.add_job(
+            storage.in_unit_of_work(self.detect_idle_rentals),
+            IntervalTrigger(seconds=IDLE_CHECK_INTERVAL),
+            id="detect_idle_rentals",
+            replace_existing=True,
+        )
+        self.scheduler.add_job(
+            storage.in_unit_of_work(self.refresh_entity_cache),
+            IntervalTrigger(seconds=ENTITY_REFRESH_INTERVAL),
+            id="refresh_entity_cache",
+            replace_existing=True,
+        )
+        self.scheduler.add_job(
+            storage.in_unit_of_work(self.reconcile_ledger),
+            IntervalTrigger(seconds=LEDGER_RECONCILE_INTERVAL),
+            id="reconcile_ledger",
+            replace_existing=True,
+        )
 
         job_data = await self.redis_conn.hgetall("jobs")
         if job_data:
@@ -860,6 +1810,8 @@ class JobManager:
             # Schedule expiration jobs for all current rentals
             await self.schedule_all_rentals()
             await self.schedule_deduction()
+        if not await self.redis_conn.exists(self.RUNWAY_KEY):
+            await self.schedule_all_runways()
 
         current_time = datetime.now()
         if (
@@ -880,3 +1832,4 @@ class JobManager:
         self.redis_conn = redis.Redis(
             host="localhost", port=6379, db=0, decode_responses=True
         )
+        metrics.instrument_redis(self.redis_conn)
@@ -1,21 +1,33 @@
+import asyncio
 import html
+import os
 import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 
 import pytz
+from sqlalchemy import and_, func, or_
 from telethon import Button
-from telethon.tl.types import PeerUser
+from telethon.errors import MessageNotModifiedError
 
-from models import client, storage
+from models import entity_cache, logger, outbox, storage
+from models.archive import HomeArchiver
+from models.messaging import Outbox
 from models.misc import Auth, SystemUserManager, Utilities
+from models.money import Money
 from models.payments import Payment
 from models.rentals import Rental
 from models.telegram_users import TelegramUser
 from models.users import User
 from resources.constants import (
     ADMIN_ID,
+    ARCHIVE_ON_DELETE,
     BE_NOTED_TEXT,
+    LIST_USERS_CACHE_SIZE,
+    LIST_USERS_PAGE_SIZE,
+    LOW_BALANCE_THRESHOLD,
+    MESSAGE_LIMIT,
     SSH_HOSTNAME,
     SSH_PORT,
     TIME_ZONE,
@@ -27,6 +39,11 @@ class UserRoutes:
     Routes for managing users.
     """
 
+    # Keeps references to running background tasks so they aren't garbage collected
+    _background_tasks = set()
+    # Rendered /list_users pages, least recently used first
+    _page_cache = OrderedDict()
+
     async def create_user(self, event):
         """
         A handler for /create_user command.
@@ -38,7 +55,8 @@ class UserRoutes:
         args = event.message.text.split()
         if len(args) < 4:
             await event.respond(
-                "❓ Usage: /create_user <username> <plan_duration> <amount> <currency (INR/USD)> \nFor example: `/create_user john 7d 500 INR`"
+                "❓ Usage: /create_user <username> <plan_duration> <amount> <currency (INR/USD)> [plan_tier]\n"
+                "For example: `/create_user john 7d 500 INR standard`"
             )
             return
 
@@ -48,6 +66,13 @@ class UserRoutes:
         plan_duration_seconds = Utilities.parse_duration(args[2])
         amount = args[3]
         currency = args[4].upper()
+        plan_tier = args[5] if len(args) > 5 else None
+
+        try:
+            limits = Rental.get_tier_limits(plan_tier)
+        except ValueError as e:
+            await event.respond(f"❌ {e}")
+            return
 
         user = storage.query_object("User", linux_username=username)
         if user:
@@ -61,14 +86,10 @@ class UserRoutes:
 
         # Handle UNIQUE constraint OperationalError for users.linux_username
         # What if username already exists in the db?
-        if user and user.deleted:
-            # That means it's a zombie entry, we shall update this
-            # instead of creating a new `User` instance.
-            user.linux_password = password
-            user.uuid = user_uuid
-            user.balance = 0
-            user.deleted = 0  # Since now the user is starting over again
-        else:
+        # If so, it's a zombie entry (deleted), we shall update it
+        # instead of creating a new `User` instance.
+        zombie = user is not None
+        if not zombie:
             user = User(
                 linux_username=username,
                 linux_password=password,
@@ -79,14 +100,28 @@ class UserRoutes:
             payment = await Payment.create(
                 user_id=user.id, amount=amount, currency=currency
             )
-            await user.update_balance(payment.amount, "credit")
-            await SystemUserManager.create_user(username, password)
-            user.save()
-            payment.save()
+            await SystemUserManager.create_user(username, password, limits)
         except Exception as e:
             await event.respond(f"❌ Error creating user `{username}`: {e}")
             return
 
+        # Only once the system user exists, so that a failure leaves neither the credit
+        # nor the balance reset in the ledger (the command's unit of work commits anyway)
+        if zombie:
+            user.linux_password = password
+            user.uuid = user_uuid
+            if user.balance:
+                await user.update_balance(
+                    -user.balance,
+                    "debit",
+                    kind="adjustment",
+                    note="Balance reset on recreation",
+                )
+            user.deleted = 0  # Since now the user is starting over again
+        await user.update_balance(payment.amount, "credit", payment_id=payment.id)
+        user.save()
+        payment.save()
+
         expiry_date_str = Utilities.get_date_str(expiry_time)
         ssh_command = f"ssh {username}@{SSH_HOSTNAME} -p {SSH_PORT}"
 
@@ -105,7 +140,7 @@ class UserRoutes:
             message_str += f"**ℹ️ Notes:**\n{BE_NOTED_TEXT}\n"
 
         password_url = (
-            f"https://t.me/{(await client.get_me()).username}?start={user_uuid}"
+            f"https://t.me/{(await entity_cache.get_me()).username}?start={user_uuid}"
         )
 
         rental = Rental(
@@ -117,11 +152,13 @@ class UserRoutes:
             currency=currency,
             price_rate=36.0,  # TO DO: Use current price per day
         )
+        rental.apply_plan_tier(plan_tier)
         storage.new(rental)
         storage.save()
-        await client.send_message(
+        await outbox.send(
             event.chat_id,
             message_str,
+            priority=Outbox.INTERACTIVE,
             buttons=[[Button.url("Get Password", password_url)]],
         )
         from models import job_manager
@@ -135,7 +172,7 @@ class UserRoutes:
             f"💰 **Amount:** `{payment.amount:.2f} INR`\n"
             f"📅 **Payment Date:** {Utilities.get_date_str(payment.payment_date)}\n"
         )
-        await client.send_message(ADMIN_ID, message_str)
+        await outbox.send(ADMIN_ID, message_str, priority=Outbox.INTERACTIVE)
 
     # /delete_user command
     @Auth.authorized_user
@@ -178,106 +215,417 @@ class UserRoutes:
             )
             return
 
-        rental = storage.query_object("Rental", user_id=user_in_db.id, is_zombie=0)
-        # If user exists in both the database and the system, proceed with deletion
-        if await SystemUserManager.delete_system_user(username):
-            rental.is_active = 0
-            rental.is_expired = 1
-            rental.is_zombie = 1  # Locks the row, making it immutable virtually
-            user_in_db.deleted = 1
-            storage.save()
-            from models import job_manager
-
-            await job_manager.remove_job_from_redis(f"expire_rental_{rental.id}")
-            await job_manager.remove_notification_jobs(rental.id)
+        if ARCHIVE_ON_DELETE:
+            await event.respond(
+                f"📦 Archiving the home directory of `{username}` before deleting it.\n"
+                f"You'll be notified once it's done."
+            )
+            # Archiving a large home directory takes a while, so it runs in the background
+            task = asyncio.create_task(
+                self.archive_and_delete_user(username, event.chat_id)
+            )
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            return
+
+        if await self.delete_user(username):
             await event.respond(f"🗑️ User `{username}` deleted successfully.")
         else:
             await event.respond(f"❌ Error deleting user `{username}`.")
 
+    async def delete_user(self, username):
+        """
+        Delete a user from the system and mark its rental and database entry as deleted.
+        :param username: The username of the user.
+        :return: True if the user was deleted, False otherwise.
+        """
+
+        if not await SystemUserManager.delete_system_user(username):
+            return False
+
+        user_in_db = storage.query_object("User", linux_username=username, deleted=0)
+        rental = storage.query_object("Rental", user_id=user_in_db.id, is_zombie=0)
+        rental.is_active = 0
+        rental.is_expired = 1
+        rental.is_zombie = 1  # Locks the row, making it immutable virtually
+        user_in_db.deleted = 1
+        storage.save()
+        from models import job_manager
+
+        await job_manager.remove_job_from_redis(f"expire_rental_{rental.id}")
+        await job_manager.remove_notification_jobs(rental.id)
+        return True
+
+    async def archive_and_delete_user(self, username, chat_id):
+        """
+        Archive the home directory of a user and delete the user once the archive is verified.
+        The user is left untouched if archiving fails.
+        :param username: The username of the user.
+        :param chat_id: The chat to report the result to.
+        :return: None
+        """
+
+        try:
+            archive = await HomeArchiver.archive(username)
+            if not archive:
+                await outbox.send(
+                    chat_id,
+                    f"❌ Archiving the home directory of `{username}` failed, "
+                    f"the user was not deleted.",
+                    priority=Outbox.INTERACTIVE,
+                )
+                return
+
+            if not await self.delete_user(username):
+                await outbox.send(
+                    chat_id,
+                    f"❌ Error deleting user `{username}`.\n"
+                    f"📦 The home directory was archived to `{archive['path']}`.",
+                    priority=Outbox.INTERACTIVE,
+                )
+                return
+
+            throughput = archive["size"] / max(archive["seconds"], 0.001)
+            await outbox.send(
+                chat_id,
+                f"🗑️ User `{username}` deleted successfully.\n\n"
+                f"📦 **Archive:** `{os.path.basename(archive['path'])}`\n"
+                f"💾 **Size:** `{Utilities.format_bytes(archive['size'])}` "
+                f"(`{archive['entries']}` entries)\n"
+                f"⏱️ **Took:** `{archive['seconds']:.1f}s` "
+                f"(`{Utilities.format_bytes(throughput)}/s` compressed)\n\n"
+                f"Use `/restore_user {username}` to restore it.",
+                priority=Outbox.INTERACTIVE,
+            )
+        except Exception as e:
+            logger.exception(e)
+            await outbox.send(
+                chat_id,
+                f"❌ Error deleting user `{username}`: {e}",
+                priority=Outbox.INTERACTIVE,
+            )
+
+    # /restore_user command
+    @Auth.authorized_user
+    async def restore_user(self, event):
+        """
+        A handler for /restore_user command to restore a user's home directory from its archive.
+        The system user has to exist, e.g. recreated with /create_user.
+        :param event: Event object.
+        :return: None
+        """
+
+        args = event.message.text.split()
+        if len(args) < 2:
+            await event.respond("❓ Usage: /restore_user <username> [archive]")
+            return
+
+        username = args[1]
+        if not SystemUserManager.is_user_exists(username):
+            await event.respond(
+                f"❌ User `{username}` doesn't exist on the system.\n"
+                f"Create it with /create_user first."
+            )
+            return
+
+        path = HomeArchiver.find_archive(username, args[2] if len(args) > 2 else None)
+        if not path:
+            await event.respond(f"❌ No archive found for user `{username}`.")
+            return
+
+        await event.respond(
+            f"📦 Restoring `{username}` from `{os.path.basename(path)}`..."
+        )
+        if await HomeArchiver.restore(username, path):
+            await event.respond(f"✅ Home directory of `{username}` restored.")
+        else:
+            await event.respond(
+                f"❌ Error restoring the home directory of `{username}`."
+            )
+
     # /list_users command
     @Auth.authorized_user
     async def list_users(self, event):
-        """List all users with their rental and status details.
-        All users with their rental details are listed along with their status with no exceptions or filters.
+        """List users with an active rental, one page at a time.
+        Usage: /list_users [all|expired|expiring <hours>|low_balance] [expiry|name|balance]
         :param event: Event object.
         """
 
-        users = storage.join(
-            "User",
-            ["Rental", "TelegramUser"],
-            filters={"deleted": 0},
-            outer=True,
-        )
-        active_users = [
-            user
-            for user in users
-            if user.rentals and 1 in [rental.is_active for rental in user.rentals]
-        ]
-        if not active_users:
-            await event.respond("🔍 No users found.")
+        try:
+            list_filter, sort = self.__parse_list_args(event.message.text.split()[1:])
+        except (ValueError, IndexError):
+            await event.respond(
+                "❓ Usage: /list_users [all|expired|expiring <hours>|low_balance] "
+                "[expiry|name|balance]"
+            )
             return
 
-        ist = pytz.timezone(TIME_ZONE)
-        response = f"👥 Total Users: {len(active_users)}\n\n"
-
-        for user in active_users:
-            rental = user.rentals[-1] if user.rentals else None
-            telegram_user = user.telegram_user[0] if user.telegram_user else None
-
-            if rental:
-                expiry_date_ist = datetime.fromtimestamp(rental.end_time, ist)
-                expiry_date_str = Utilities.get_date_str(rental.end_time)
-                now = datetime.now(pytz.utc).astimezone(ist)
-                tg_user = (
-                    await client.get_entity(PeerUser(user_id=telegram_user.tg_user_id))
-                    if telegram_user
-                    else None
+        response, buttons = self.render_users_page(list_filter, sort)
+        await event.respond(
+            response, parse_mode="html", link_preview=False, buttons=buttons
+        )
+
+    @Auth.authorized_user
+    async def list_users_page(self, event):
+        """
+        Callback query handler for the Prev/Next buttons of /list_users.
+        The callback data is `list_users <filter> <sort> <direction> <rental_id>`.
+        :param event: Event object.
+        :return: None
+        """
+
+        _, list_filter, sort, direction, cursor = event.data.decode().split()
+        response, buttons = self.render_users_page(list_filter, sort, direction, cursor)
+        try:
+            await event.edit(
+                response, parse_mode="html", link_preview=False, buttons=buttons
+            )
+        except MessageNotModifiedError:
+            await event.answer()
+
+    @staticmethod
+    def __parse_list_args(args):
+        """
+        Parse the arguments of /list_users into the filter and sort keys used in callback data.
+        :param args: The command arguments.
+        :return: A tuple of the filter key and the sort key.
+        :raises ValueError: If an argument is not recognized.
+        """
+
+        list_filter, sort = "all", "e"
+        args = [arg.lower() for arg in args]
+        while args:
+            arg = args.pop(0)
+            if arg == "all":
+                list_filter = "all"
+            elif arg == "expired":
+                list_filter = "exp"
+            elif arg == "low_balance":
+                list_filter = "low"
+            elif arg == "expiring":
+                hours = int(args.pop(0)) if args and args[0].isdigit() else 24
+                list_filter = f"soon{hours}"
+            elif arg in ("expiry", "name", "balance"):
+                sort = arg[0]
+            else:
+                raise ValueError(f"Unknown argument: {arg}")
+        return list_filter, sort
+
+    @classmethod
+    def render_users_page(cls, list_filter, sort, direction=None, cursor=None):
+        """
+        Render a page of /list_users. Pages are cached until the database changes,
+        and for a minute at most since they show the remaining time.
+        :param list_filter: The filter key (`all`, `exp`, `low` or `soon<hours>`).
+        :param sort: The sort key (`e`xpiry, `n`ame or `b`alance).
+        :param direction: `n` for the page after the cursor, `p` for the page before it.
+        :param cursor: The ID of the rental the page starts after (or ends before).
+        :return: A tuple of the HTML text and the navigation buttons.
+        """
+
+        key = (
+            list_filter,
+            sort,
+            direction,
+            cursor,
+            storage.version,
+            int(time.time() // 60),
+        )
+        page = cls._page_cache.get(key)
+        if page:
+            cls._page_cache.move_to_end(key)
+            return page
+
+        rows, has_more = cls.__query_users_page(list_filter, sort, direction, cursor)
+        if not rows and cursor:
+            # The cursor rental changed or went away, start over
+            return cls.render_users_page(list_filter, sort)
+        if not rows:
+            return "🔍 No users found.", None
+
+        total = rows[0][3]
+        sort_name = {"e": "expiry", "n": "name", "b": "balance"}[sort]
+        if list_filter == "exp":
+            filter_name = "expired"
+        elif list_filter == "low":
+            filter_name = f"balance below {LOW_BALANCE_THRESHOLD}"
+        elif list_filter.startswith("soon"):
+            filter_name = f"expiring within {list_filter[4:]} hours"
+        else:
+            filter_name = "all"
+
+        header = f"👥 Total Users: {total} ({filter_name}, by {sort_name})\n\n"
+        entries = [
+            cls.__render_user_entry(user, rental, telegram_user)
+            for rental, user, telegram_user, _ in rows
+        ]
+        has_prev = bool(cursor) and (direction == "n" or has_more)
+        has_next = direction == "p" or has_more
+
+        # Long names can push a page past Telegram's limit, leave the overflow to the next page
+        while len(entries) > 1 and len(header) + sum(map(len, entries)) > MESSAGE_LIMIT:
+            if direction == "p":
+                entries.pop(0)
+                rows.pop(0)
+                has_prev = True
+            else:
+                entries.pop()
+                rows.pop()
+                has_next = True
+        response = header + "".join(entries)
+        navigation = []
+        if has_prev:
+            navigation.append(
+                Button.inline(
+                    "⬅️ Prev", data=f"list_users {list_filter} {sort} p {rows[0][0].id}"
                 )
-                if tg_user and tg_user.username:
-                    tg_url = f"https://t.me/{tg_user.username}"
-                elif telegram_user:
-                    tg_url = f"tg://user?id={telegram_user.tg_user_id}"
-                else:
-                    tg_url = ""
-
-                tg_tag = (
-                    f'<a href="{tg_url}">{html.escape(tg_user.first_name)}</a>'
-                    if telegram_user
-                    else "Not set"
+            )
+        if has_next:
+            navigation.append(
+                Button.inline(
+                    "Next ➡️",
+                    data=f"list_users {list_filter} {sort} n {rows[-1][0].id}",
                 )
+            )
 
-                if rental.is_expired or not rental.is_active:
-                    elapsed_time = now - expiry_date_ist
-                    elapsed_time_str = f"{elapsed_time.days} days, {elapsed_time.seconds // 3600} hours, {(elapsed_time.seconds // 60) % 60} minutes"
+        page = (response, [navigation] if navigation else None)
+        cls._page_cache[key] = page
+        while len(cls._page_cache) > LIST_USERS_CACHE_SIZE:
+            cls._page_cache.popitem(last=False)
+        return page
 
-                    response += (
-                        f"<p>❌ <strong>Username:</strong> <code>{html.escape(user.linux_username)}</code><br>\n"
-                        f"   <strong>Telegram:</strong> {tg_tag}<br>\n"
-                        f"   <strong>Expiry Date:</strong> <code>{html.escape(expiry_date_str)}</code><br>\n"
-                        f"   <strong>Elapsed Time:</strong> <code>{html.escape(elapsed_time_str)}</code><br>\n\n"
-                    )
-                else:
-                    remaining_time = expiry_date_ist - now
-                    remaining_time_str = (
-                        f"{remaining_time.days} days, {remaining_time.seconds // 3600} hours, "
-                        f"{(remaining_time.seconds // 60) % 60} minutes"
-                    )
+    @staticmethod
+    def __query_users_page(list_filter, sort, direction=None, cursor=None):
+        """
+        Fetch a page of active rentals with their user and Telegram account, plus the total
+        number of matching rentals, in a single keyset-paginated query.
+        :param list_filter: The filter key.
+        :param sort: The sort key.
+        :param direction: `n` for the page after the cursor, `p` for the page before it.
+        :param cursor: The ID of the rental the page is relative to.
+        :return: A tuple of the rows (rental, user, telegram user, total) in display order,
+            and whether there are more rows in the requested direction.
+        """
+
+        sort_column = {
+            "e": Rental.end_time,
+            "n": User.linux_username,
+            "b": User.balance_minor,
+        }[sort]
+        conditions = [Rental.is_active == 1, User.deleted == 0]
+        if list_filter == "exp":
+            conditions.append(Rental.is_expired == 1)
+        elif list_filter == "low":
+            conditions.append(
+                User.balance_minor < Money.from_major(LOW_BALANCE_THRESHOLD).minor
+            )
+        elif list_filter.startswith("soon"):
+            conditions.append(Rental.is_expired == 0)
+            conditions.append(
+                Rental.end_time <= int(time.time()) + int(list_filter[4:]) * 3600
+            )
+
+        total = (
+            storage.query(func.count(Rental.id))
+            .join(User, Rental.user_id == User.id)
+            .filter(*conditions)
+            .scalar_subquery()
+        )
+        query = (
+            storage.query(Rental, User, TelegramUser, total)
+            .join(User, Rental.user_id == User.id)
+            .outerjoin(TelegramUser, TelegramUser.user_id == User.id)
+            .filter(*conditions)
+        )
 
-                    response += (
-                        f"<p>✨ <strong>Username:</strong> <code>{html.escape(user.linux_username)}</code>\n"
-                        f"   <strong>Telegram:</strong> {tg_tag}\n"
-                        f"   <strong>Plan:</strong> {html.escape(Utilities.parse_duration_to_human_readable(rental.plan_duration))}\n"
-                        f"   <strong>Expiry Date:</strong> <code>{html.escape(expiry_date_str)}</code>\n"
-                        f"   <strong>Remaining Time:</strong> <code>{html.escape(remaining_time_str)}</code>\n"
-                        f"   <strong>Balance:</strong> <code>{user.balance:.2f}</code><br></p>\n\n"
+        backwards = direction == "p"
+        if cursor:
+            cursor_value = (
+                storage.query(sort_column)
+                .select_from(Rental)
+                .join(User, Rental.user_id == User.id)
+                .filter(Rental.id == cursor)
+                .scalar_subquery()
+            )
+            if backwards:
+                query = query.filter(
+                    or_(
+                        sort_column < cursor_value,
+                        and_(sort_column == cursor_value, Rental.id < cursor),
                     )
+                )
             else:
-                response += (
-                    f"<p>❌ <strong>Username: </strong> "
-                    f"<code>{html.escape(user.linux_username)}</code>"
-                    f"(No rental information available)</p>\n\n"
+                query = query.filter(
+                    or_(
+                        sort_column > cursor_value,
+                        and_(sort_column == cursor_value, Rental.id > cursor),
+                    )
                 )
-        await event.respond(response, parse_mode="html", link_preview=False)
+
+        order = (
+            (sort_column.desc(), Rental.id.desc())
+            if backwards
+            else (sort_column, Rental.id)
+        )
+        rows = query.order_by(*order).limit(LIST_USERS_PAGE_SIZE + 1).all()
+        has_more = len(rows) > LIST_USERS_PAGE_SIZE
+        rows = rows[:LIST_USERS_PAGE_SIZE]
+        if backwards:
+            rows.reverse()
+        return rows, has_more
+
+    @staticmethod
+    def __render_user_entry(user, rental, telegram_user):
+        """
+        Render a single user of /list_users.
+        :param user: The user.
+        :param rental: The user's rental.
+        :param telegram_user: The linked Telegram account, if any.
+        :return: The HTML of the entry.
+        """
+
+        ist = pytz.timezone(TIME_ZONE)
+        expiry_date_ist = datetime.fromtimestamp(rental.end_time, ist)
+        expiry_date_str = Utilities.get_date_str(rental.end_time)
+        now = datetime.now(pytz.utc).astimezone(ist)
+        tg_user = entity_cache.get_cached(telegram_user) if telegram_user else None
+        if tg_user and tg_user.username:
+            tg_url = f"https://t.me/{tg_user.username}"
+        elif telegram_user:
+            tg_url = f"tg://user?id={telegram_user.tg_user_id}"
+        else:
+            tg_url = ""
+
+        tg_tag = (
+            f'<a href="{tg_url}">{html.escape(tg_user.first_name)}</a>'
+            if telegram_user
+            else "Not set"
+        )
+
+        if rental.is_expired or not rental.is_active:
+            elapsed_time = now - expiry_date_ist
+            elapsed_time_str = f"{elapsed_time.days} days, {elapsed_time.seconds // 3600} hours, {(elapsed_time.seconds // 60) % 60} minutes"
+
+            return (
+                f"<p>❌ <strong>Username:</strong> <code>{html.escape(user.linux_username)}</code><br>\n"
+                f"   <strong>Telegram:</strong> {tg_tag}<br>\n"
+                f"   <strong>Expiry Date:</strong> <code>{html.escape(expiry_date_str)}</code><br>\n"
+                f"   <strong>Elapsed Time:</strong> <code>{html.escape(elapsed_time_str)}</code><br>\n\n"
+            )
+
+        remaining_time = expiry_date_ist - now
+        remaining_time_str = (
+            f"{remaining_time.days} days, {remaining_time.seconds // 3600} hours, "
+            f"{(remaining_time.seconds // 60) % 60} minutes"
+        )
+        return (
+            f"<p>✨ <strong>Username:</strong> <code>{html.escape(user.linux_username)}</code>\n"
+            f"   <strong>Telegram:</strong> {tg_tag}\n"
+            f"   <strong>Plan:</strong> {html.escape(Utilities.parse_duration_to_human_readable(rental.plan_duration))}\n"
+            f"   <strong>Expiry Date:</strong> <code>{html.escape(expiry_date_str)}</code>\n"
+            f"   <strong>Remaining Time:</strong> <code>{html.escape(remaining_time_str)}</code>\n"
+            f"   <strong>Balance:</strong> <code>{user.balance:.2f}</code><br></p>\n\n"
+        )
 
     # /clear_user command
     @Auth.authorized_user
@@ -325,7 +673,7 @@ class UserRoutes:
             await event.respond("❓ Usage: /link_user <username>")
             return
 
-        bot_username = await client.get_me()
+        bot_username = await entity_cache.get_me()
 
         username = event.message.text.split()[1]
         user = storage.query_object(User, linux_username=username, deleted=0)
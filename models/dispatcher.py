@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+
+from models import logger, metrics, storage
+from models.messaging import TokenBucket
+from models.misc import Auth
+from resources.constants import (
+    COMMAND_ADMIN_WORKERS,
+    COMMAND_BURST,
+    COMMAND_PENDING_PER_SENDER,
+    COMMAND_QUEUE_SIZE,
+    COMMAND_RATE,
+    COMMAND_TENANT_WORKERS,
+    HEAVY_COMMAND_CONCURRENCY,
+    HEAVY_COMMANDS,
+)
+
+
+class CommandDispatcher:
+    """
+    Runs command handlers on bounded worker pools instead of inline in the Telethon handler.
+
+    Admin and tenant commands wait in separate bounded queues, so tenants can't delay the
+    admin and the other way round. Admin commands in `HEAVY_COMMANDS` get a queue of their
+    own with `HEAVY_COMMAND_CONCURRENCY` workers, so a slow report never holds up a quick
+    command. Tenants are rate limited by a token bucket per sender, and may each only have
+    `COMMAND_PENDING_PER_SENDER` commands queued or running. A command that can't start
+    right away is answered with its position in the queue.
+    """
+
+    ADMIN = "admin"
+    HEAVY = "heavy"
+    TENANT = "tenant"
+
+    # Senders whose token bucket is kept, least recently seen first out
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self.__workers = {
+            self.ADMIN: COMMAND_ADMIN_WORKERS,
+            self.HEAVY: HEAVY_COMMAND_CONCURRENCY,
+            self.TENANT: COMMAND_TENANT_WORKERS,
+        }
+        self.__queues = {}
+        self.__idle = dict.fromkeys(self.__workers, 0)
+        self.__pending = defaultdict(int)
+        self.__buckets = OrderedDict()
+        self.__throttled = set()
+        self.__tasks = []
+        self.stats = dict.fromkeys(("queued", "rejected", "throttled"), 0)
+
+    def start(self):
+        """
+        Start the workers. Must be called from the running event loop.
+        """
+        for lane, workers in self.__workers.items():
+            self.__queues[lane] = asyncio.Queue(maxsize=COMMAND_QUEUE_SIZE)
+            for _ in range(workers):
+                self.__tasks.append(asyncio.create_task(self.__worker(lane)))
+
+    def lane(self, command, sender_id):
+        """
+        Get the queue a command is run from.
+
+        Args:
+            command (str): The command, e.g. `/status`.
+            sender_id (int): The Telegram ID of the sender.
+
+        Returns:
+            str: `ADMIN`, `HEAVY` or `TENANT`.
+        """
+        if not Auth.is_authorized_user(sender_id):
+            return self.TENANT
+        return self.HEAVY if command in HEAVY_COMMANDS else self.ADMIN
+
+    def allow(self, sender_id):
+        """
+        Take a token from the bucket of a tenant. The admin is never rate limited.
+
+        Args:
+            sender_id (int): The Telegram ID of the sender.
+
+        Returns:
+            bool: True if the sender may send a command now.
+        """
+        if Auth.is_authorized_user(sender_id):
+            return True
+
+        bucket = self.__buckets.get(sender_id)
+        if not bucket:
+            bucket = self.__buckets[sender_id] = TokenBucket(
+                COMMAND_RATE, COMMAND_BURST
+            )
+            while len(self.__buckets) > self.MAX_BUCKETS:
+                self.__buckets.popitem(last=False)
+        self.__buckets.move_to_end(sender_id)
+        return bucket.try_acquire()
+
+    async def dispatch(self, event, command, handler):
+        """
+        Queue a command for a worker, or reject it if the sender or the queue is over its limit.
+
+        Args:
+            event: The event containing the command.
+            command (str): The command, e.g. `/status`.
+            handler (callable): The route handling the command.
+        """
+        sender_id = event.sender_id
+        if not self.allow(sender_id):
+            self.stats["throttled"] += 1
+            # Only tell the sender once, not for every message they keep sending
+            if sender_id not in self.__throttled:
+                self.__throttled.add(sender_id)
+                await event.respond(
+                    "🐢 You're sending commands too fast, please slow down."
+                )
+            return
+        self.__throttled.discard(sender_id)
+
+        if (
+            not Auth.is_authorized_user(sender_id)
+            and self.__pending[sender_id] >= COMMAND_PENDING_PER_SENDER
+        ):
+            self.stats["rejected"] += 1
+            await event.respond(
+                f"⏳ You already have {self.__pending[sender_id]} commands in progress, "
+                f"please wait for them to finish."
+            )
+            return
+
+        lane = self.lane(command, sender_id)
+        queue = self.__queues[lane]
+        try:
+            queue.put_nowait((event, command, handler, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            await event.respond(
+                "🚦 The bot is too busy right now, please try again in a minute."
+            )
+            return
+
+        self.stats["queued"] += 1
+        self.__pending[sender_id] += 1
+        # Idle workers take the first queued commands, the rest wait their turn
+        position = queue.qsize() - self.__idle[lane]
+        if position > 0:
+            await event.respond(f"⏳ Busy, queued at position {position}.")
+
+    async def __worker(self, lane):
+        """
+        Run the commands of a queue one at a time, forever.
+
+        Args:
+            lane (str): The queue to take commands from.
+        """
+        queue = self.__queues[lane]
+        while True:
+            self.__idle[lane] += 1
+            event, command, handler, queued_at = await queue.get()
+            self.__idle[lane] -= 1
+            try:
+                async with metrics.track(command), storage.unit_of_work():
+                    metrics.record("queue", time.perf_counter() - queued_at)
+                    await handler(event)
+            except Exception:
+                logger.exception(f"Error handling {command} from {event.sender_id}")
+            finally:
+                self.__pending[event.sender_id] -= 1
+                if not self.__pending[event.sender_id]:
+                    del self.__pending[event.sender_id]
+                queue.task_done()
@@ -0,0 +1,73 @@
+"""
+Moves a login session into the cgroup of the rental it belongs to, as soon as it opens.
+
+Without it, tenant processes run unconfined until the periodic sweep
+(`JobManager.enforce_resource_limits`) moves them. Run by pam_exec, as root, when a session
+opens, e.g. in /etc/pam.d/sshd (and any other service tenants log in through):
+
+    session optional pam_exec.so /usr/bin/python3 /path/to/models/engine/cgroup_attach.py
+
+The process opening the session (the per-connection sshd process for SSH logins) is moved, so
+the processes of the session, which it forks afterwards, start in the rental's cgroup.
+Users without a rental cgroup, and suspended (frozen) rentals, are left alone. Failures
+are reported on stderr but never prevent the login.
+
+This module only depends on the standard library so it runs without the bot's environment:
+
+    python3 models/engine/cgroup_attach.py [--root /sys/fs/cgroup] [--parent rentals] [--user <username> --pid <pid>]
+"""
+
+import argparse
+import os
+import sys
+
+
+def attach(root, parent, username, pid):
+    """
+    Move a process into the cgroup of a rental.
+    :param root: The root of the cgroup v2 hierarchy (`CGROUP_ROOT`).
+    :param parent: The cgroup holding all rental cgroups (`CGROUP_PARENT`).
+    :param username: The username of the rental's system user.
+    :param pid: The ID of the process.
+    :return: True if the process was moved, False if the user has no (thawed) rental cgroup.
+    """
+    if not username or os.sep in username or username.startswith("."):
+        return False
+    path = os.path.join(root, parent, username)
+    if not os.path.isdir(path):
+        return False
+    try:
+        with open(os.path.join(path, "cgroup.freeze")) as f:
+            if f.read().strip() == "1":
+                # Moving the session into a frozen cgroup would freeze it
+                return False
+    except FileNotFoundError:
+        pass
+    with open(os.path.join(path, "cgroup.procs"), "w") as f:
+        f.write(str(pid))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--root", default=os.getenv("CGROUP_ROOT", "/sys/fs/cgroup"))
+    parser.add_argument("--parent", default=os.getenv("CGROUP_PARENT", "rentals"))
+    parser.add_argument("--user", default=os.getenv("PAM_USER"))
+    parser.add_argument("--pid", type=int, default=os.getppid())
+    args = parser.parse_args()
+
+    # pam_exec runs the module for every session phase it's configured for
+    if os.getenv("PAM_TYPE", "open_session") != "open_session":
+        return 0
+    try:
+        attach(args.root, args.parent, args.user, args.pid)
+    except OSError as e:
+        print(
+            f"Failed to move {args.user}'s session into its cgroup: {e}",
+            file=sys.stderr,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,110 @@
-from sqlalchemy import create_engine
+import functools
+import threading
+from contextvars import ContextVar
+
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from models.baseModel import Base
+from models.engine.migrations import run_migrations
+from models.ledger import LedgerEntry, LedgerSnapshot
 from models.payments import Payment
 from models.rentals import Rental
 from models.telegram_users import TelegramUser
 from models.users import User
 from resources.constants import DB_STRING
-from models import logger
+from models import logger, metrics
 
 classes = {
     "Rental": Rental,
     "Payment": Payment,
     "User": User,
     "TelegramUser": TelegramUser,
+    "LedgerEntry": LedgerEntry,
+    "LedgerSnapshot": LedgerSnapshot,
 }
 
+# The unit of work of the running command or job, if any
+_unit_of_work = ContextVar("unit_of_work", default=None)
+
+
+def _running_unit():
+    """
+    :return: The unit of work the caller runs in, or None. Threads the work of a unit is
+     handed to (e.g. with `asyncio.to_thread`) inherit its context, but not its session.
+    """
+
+    unit = _unit_of_work.get()
+    if unit is not None and unit.active and unit.thread == threading.get_ident():
+        return unit
+    return None
+
+
+class UnitOfWork:
+    """
+    A short-lived session for a single command or job, entered with `with` or `async with`
+    (see `DBStorage.unit_of_work`).
+
+    While it's entered, the storage uses the session of the unit instead of the thread's,
+    in the code it runs and the coroutines it awaits. Nothing is written before the unit
+    exits: the session doesn't autoflush and saving is deferred, so queries of the unit don't
+    see its own pending changes. The writes are then flushed and committed at once, or
+    discarded if the unit exits with an exception, and the session is closed, releasing the
+    objects it loaded. Units entered within a unit join it, unless they're separate.
+
+    Since a unit only writes while committing, which doesn't yield to the event loop, units
+    interleaving on the loop never wait on each other's locks, and each commits or rolls
+    back as a whole.
+    """
+
+    def __init__(self, begin, end, separate=False):
+        """
+        :param begin: The function binding a session to the unit, called with the unit.
+        :param end: The function committing or rolling back the unit and closing its
+         session, called with the unit and whether to commit.
+        :param separate: Use a session of its own even within another unit, which is
+         resumed once this one exits.
+        """
+        self.separate = separate
+        self.__begin = begin
+        self.__end = end
+        self.__token = None
+        self.thread = None
+        self.active = False
+        self.session = None
+
+    def __enter__(self):
+        if _running_unit() is not None and not self.separate:
+            return self
+        self.thread = threading.get_ident()
+        self.active = True
+        self.__token = _unit_of_work.set(self)
+        try:
+            self.__begin(self)
+        except BaseException:
+            self.active = False
+            _unit_of_work.reset(self.__token)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.__token is None:
+            return False
+        try:
+            self.__end(self, exc_type is None)
+        finally:
+            # Tasks the unit started and left running fall back to the thread's session
+            self.active = False
+            _unit_of_work.reset(self.__token)
+            self.__token = None
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
 
 class DBStorage:
     """
@@ -25,9 +114,29 @@ class DBStorage:
 
     __engine = None
     __session = None
+    # Incremented on every commit, so cached data derived from the database can be invalidated
+    # (and published with the commit's changes to the change feed)
+    version = 0
 
-    def __init__(self):
-        self.__engine = create_engine(DB_STRING, pool_pre_ping=True)
+    def __init__(self, change_feed=None):
+        """
+        :param change_feed: The `ChangeFeed` the changes of every commit are published to, if any.
+        """
+        # Units of work keep a connection from their first query until they exit, and
+        # interleave on the event loop: waiting for a free connection would block the loop
+        self.__engine = create_engine(DB_STRING, pool_pre_ping=True, max_overflow=-1)
+        metrics.instrument_engine(self.__engine)
+        self.change_feed = change_feed
+        self.stats = dict.fromkeys(("units", "commits", "rollbacks"), 0)
+
+    @property
+    def dialect(self):
+        """
+        The name of the database's SQL dialect, for queries tuned to it (e.g. `sqlite`).
+        :return: The name of the dialect.
+        """
+
+        return self.__engine.dialect.name
 
     def all(self, cls=None, filters=None):
         """
@@ -71,11 +180,197 @@ class DBStorage:
 
         try:
             Base.metadata.create_all(self.__engine)
+            self.__add_missing_columns()
+            self.__add_missing_indexes()
+            run_migrations(self.__engine)
         except Exception as e:
-            logger.exception(e.message)
+            logger.exception(e)
 
         ses_factory = sessionmaker(bind=self.__engine, expire_on_commit=False)
-        self.__session = scoped_session(ses_factory)
+        event.listen(ses_factory, "after_flush", self.__collect_changes)
+        event.listen(ses_factory, "after_commit", self.__publish_changes)
+        event.listen(ses_factory, "after_transaction_end", self.__discard_changes)
+        # Sessions are per unit of work, or else per thread
+        self.__session = scoped_session(
+            ses_factory, scopefunc=lambda: _running_unit() or threading.get_ident()
+        )
+
+    def unit_of_work(self, separate=False):
+        """
+        Run a command or job in a session of its own, with all its writes committed at once.
+        Usage: `async with storage.unit_of_work(): ...`, or `with` in synchronous code.
+        :param separate: Commit or roll back independently of the unit the caller runs in,
+         if any, e.g. for an operation that must be all or nothing whatever the command does.
+        :return: The `UnitOfWork`.
+        """
+
+        return UnitOfWork(self.__begin_unit, self.__end_unit, separate)
+
+    def in_unit_of_work(self, func):
+        """
+        Wrap a coroutine function to run in a unit of work, e.g. a scheduled job.
+        :param func: The coroutine function.
+        :return: The wrapper.
+        """
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with self.unit_of_work():
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    def __begin_unit(self, unit):
+        """
+        Bind a new session to a unit of work, which is the scope of the session from now on.
+        :param unit: The unit.
+        :return: None
+        """
+
+        unit.session = self.__session()
+        unit.session.autoflush = False
+        self.stats["units"] += 1
+
+    def __end_unit(self, unit, commit):
+        """
+        Commit the writes of a unit of work, or roll them back, and close its session.
+        :param unit: The unit.
+        :param commit: Whether to commit, otherwise roll back.
+        :return: None
+        """
+
+        session = unit.session
+        writes = bool(session.new or session.dirty or session.deleted)
+        try:
+            if writes and commit:
+                session.commit()
+                self.stats["commits"] += 1
+            elif writes:
+                session.rollback()
+                self.stats["rollbacks"] += 1
+        finally:
+            self.__session.remove()
+            unit.session = None
+
+    def __add_missing_columns(self):
+        """
+        Add columns that were introduced after a table was created.
+        `create_all` only creates missing tables, so new (nullable) columns on
+        existing tables are added here with their scalar default, if any.
+        :return: None
+        """
+
+        inspector = inspect(self.__engine)
+        with self.__engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing = {col["name"] for col in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    col_type = column.type.compile(dialect=self.__engine.dialect)
+                    ddl = (
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                    )
+                    default = column.default
+                    if default is not None and default.is_scalar:
+                        value = default.arg
+                        if isinstance(value, bool):
+                            value = int(value)
+                        ddl += (
+                            f" DEFAULT '{value}'"
+                            if isinstance(value, str)
+                            else f" DEFAULT {value}"
+                        )
+                    conn.execute(text(ddl))
+                    logger.info(f"Added column {table.name}.{column.name}")
+
+    def __add_missing_indexes(self):
+        """
+        Create indexes that were introduced after a table was created.
+        :return: None
+        """
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.__engine, checkfirst=True)
+
+    def __collect_changes(self, session, flush_context):
+        """
+        Record the changes a flush wrote to the models of the change feed, merged per row
+        until the transaction ends. The session still holds the pre-flush state here.
+        :param session: The session that was flushed.
+        :param flush_context: Unused.
+        :return: None
+        """
+
+        if self.change_feed is None:
+            return
+
+        changes = session.info.setdefault("changes", {})
+        for op, objs in (
+            ("insert", session.new),
+            ("update", session.dirty),
+            ("delete", session.deleted),
+        ):
+            for obj in objs:
+                model = type(obj).__name__
+                if model not in self.change_feed.MODELS:
+                    continue
+
+                fields = set()
+                if op == "update":
+                    state = inspect(obj)
+                    fields = {
+                        attr.key
+                        for attr in state.mapper.column_attrs
+                        if state.attrs[attr.key].history.has_changes()
+                    }
+                    if not fields:
+                        continue
+
+                key = (model, obj.id)
+                if key not in changes:
+                    user_id = (
+                        obj.id if model == "User" else getattr(obj, "user_id", None)
+                    )
+                    changes[key] = [op, fields, user_id]
+                elif op == "delete":
+                    changes[key][0] = op
+                else:
+                    # Inserted rows stay inserts, updated rows add up their fields
+                    changes[key][1] |= fields
+
+    def __publish_changes(self, session):
+        """
+        Bump the data version and publish the changes of the commit to the change feed.
+        :param session: The session that committed.
+        :return: None
+        """
+
+        self.version += 1
+        changes = session.info.pop("changes", None)
+        if changes:
+            self.change_feed.publish(
+                self.version,
+                [
+                    [model, id, op, sorted(fields) if op == "update" else [], user_id]
+                    for (model, id), (op, fields, user_id) in changes.items()
+                ],
+            )
+
+    @staticmethod
+    def __discard_changes(session, transaction):
+        """
+        Drop the changes of a transaction that ended without being committed.
+        :param session: The session of the transaction.
+        :param transaction: The transaction that ended.
+        :return: None
+        """
+
+        if transaction.parent is None:
+            session.info.pop("changes", None)
 
     def close(self):
         """
@@ -95,11 +390,21 @@ class DBStorage:
 
     def save(self):
         """
-        Commit all changes of the current database session.
+        Commit all changes of the current database session. In a unit of work, the changes
+        are committed with the rest of its writes when it exits instead.
         :return: None
         """
 
-        self.__session.commit()
+        if _running_unit() is None:
+            self.__session.commit()
+
+    def rollback(self):
+        """
+        Discard all uncommitted changes of the current database session.
+        :return: None
+        """
+
+        self.__session.rollback()
 
     def delete(self, obj=None):
         """
@@ -124,12 +429,30 @@ class DBStorage:
         if cls not in classes.values():
             return None
 
-        all_cls = self.all(cls)
-        for value in all_cls.values():
-            if value.id == id:
-                return value
+        # By primary key, from the session's identity map if the object is already loaded
+        return self.__session.get(cls, id)
+
+    def query(self, *entities):
+        """
+        Start a query on the current session, for queries the other helpers can't express
+        (e.g. keyset pagination).
+        :param entities: The classes, columns or expressions to select.
+        :return: The query object.
+        """
+
+        return self.__session.query(*entities)
+
+    def execute(self, statement, params=None):
+        """
+        Execute a Core statement on the current session. Selected rows come back as plain
+        tuples, without the cost of the ORM loading them (e.g. for bulk exports).
+        :param statement: The statement, e.g. `select(User.id, User.linux_username)`.
+        :param params: The parameters of the statement, or a list of them to execute it
+         once per item (e.g. for bulk inserts).
+        :return: The result.
+        """
 
-        return None
+        return self.__session.execute(statement, params)
 
     def count(self, cls=None):
         """
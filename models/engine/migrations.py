@@ -0,0 +1,196 @@
+"""
+Data migrations, run by `DBStorage.reload` once the tables and columns exist.
+
+Each migration runs once. Rows are converted in batches of `MIGRATION_BATCH_SIZE`,
+each batch committed together with a record of its progress, so an interrupted migration
+resumes where it stopped instead of converting rows twice.
+"""
+
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    String,
+    Table,
+    cast,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
+
+from models import logger
+from models.baseModel import Base
+from models.money import MINOR_UNITS
+from resources.constants import MIGRATION_BATCH_SIZE
+
+schema_migrations = Table(
+    "schema_migrations",
+    Base.metadata,
+    Column("name", String(64), primary_key=True),
+    # ID of the last row migrated
+    Column("cursor", String(36), default=None),
+    Column("done", Boolean, default=False),
+)
+
+# Money columns that held major units (rupees) before amounts were stored in minor units
+MONEY_COLUMNS = {
+    "payments": ("amount",),
+    "rentals": ("amount", "price_rate"),
+    "users": ("balance",),
+}
+
+
+def scale_columns(engine, name, table, columns, factor):
+    """
+    Multiply columns of every row of a table by a factor, rounded to an integer.
+
+    Args:
+        engine: The SQLAlchemy engine.
+        name (str): The name the migration is recorded as.
+        table (Table): The table.
+        columns (iterable[str]): The names of the columns.
+        factor (int): The factor.
+    """
+    with engine.begin() as conn:
+        state = conn.execute(
+            select(schema_migrations).where(schema_migrations.c.name == name)
+        ).first()
+        if state and state.done:
+            return
+        if not state:
+            conn.execute(insert(schema_migrations).values(name=name, done=False))
+    cursor = state.cursor if state else None
+
+    migrated = 0
+    values = {
+        column: cast(func.round(table.c[column] * factor), BigInteger)
+        for column in columns
+    }
+    while True:
+        with engine.begin() as conn:
+            query = select(table.c.id).order_by(table.c.id).limit(MIGRATION_BATCH_SIZE)
+            if cursor is not None:
+                query = query.where(table.c.id > cursor)
+            ids = conn.execute(query).scalars().all()
+            if ids:
+                conn.execute(update(table).where(table.c.id.in_(ids)).values(values))
+                cursor = ids[-1]
+                migrated += len(ids)
+            conn.execute(
+                update(schema_migrations)
+                .where(schema_migrations.c.name == name)
+                .values(cursor=cursor, done=not ids)
+            )
+        if not ids:
+            break
+    logger.info(f"Migration {name}: {migrated} rows of {table.name} migrated.")
+
+
+def migrate_money_to_minor_units(engine):
+    """
+    Convert the amounts, balances and price rates stored in major units to minor units.
+
+    Args:
+        engine: The SQLAlchemy engine.
+    """
+    # All supported currencies have the same number of minor units
+    factor = MINOR_UNITS["INR"]
+    for table_name, columns in MONEY_COLUMNS.items():
+        scale_columns(
+            engine,
+            f"money_minor_units:{table_name}",
+            Base.metadata.tables[table_name],
+            columns,
+            factor,
+        )
+
+
+def open_ledger_balances(engine):
+    """
+    Record the balances users had before the ledger existed as opening adjustments,
+    so the ledger accounts for the whole balance of every user.
+
+    Args:
+        engine: The SQLAlchemy engine.
+    """
+    name = "ledger_opening_balances"
+    with engine.begin() as conn:
+        state = conn.execute(
+            select(schema_migrations).where(schema_migrations.c.name == name)
+        ).first()
+        if state and state.done:
+            return
+        if not state:
+            conn.execute(insert(schema_migrations).values(name=name, done=False))
+
+    users = Base.metadata.tables["users"]
+    entries = Base.metadata.tables["ledger_entries"]
+    opened = 0
+    while True:
+        # Users without ledger transactions yet, so an interrupted run resumes by itself
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(users.c.id, users.c.balance)
+                .where(
+                    or_(users.c.ledger_seq.is_(None), users.c.ledger_seq == 0),
+                    users.c.balance != 0,
+                )
+                .limit(MIGRATION_BATCH_SIZE)
+            ).all()
+            if not rows:
+                conn.execute(
+                    update(schema_migrations)
+                    .where(schema_migrations.c.name == name)
+                    .values(done=True)
+                )
+                break
+
+            now = datetime.utcnow()
+            posted_at = int(time.time())
+            values = []
+            for user_id, balance in rows:
+                transaction_id = str(uuid.uuid4())
+                for account, amount in (("tenant", balance), ("adjustments", -balance)):
+                    values.append(
+                        {
+                            "id": str(uuid.uuid4()),
+                            "created_at": now,
+                            "updated_at": now,
+                            "transaction_id": transaction_id,
+                            "user_id": user_id,
+                            "account": account,
+                            "kind": "adjustment",
+                            "amount": int(amount),
+                            "seq": 1,
+                            "posted_at": posted_at,
+                            "note": "Opening balance",
+                        }
+                    )
+            conn.execute(insert(entries), values)
+            conn.execute(
+                update(users)
+                .where(users.c.id.in_([user_id for user_id, _ in rows]))
+                .values(ledger_seq=1)
+            )
+            opened += len(rows)
+    logger.info(f"Migration {name}: {opened} opening balances recorded.")
+
+
+MIGRATIONS = (migrate_money_to_minor_units, open_ledger_balances)
+
+
+def run_migrations(engine):
+    """
+    Run the data migrations that haven't completed yet.
+
+    Args:
+        engine: The SQLAlchemy engine.
+    """
+    for migration in MIGRATIONS:
+        migration(engine)
@@ -0,0 +1,40 @@
+"""
+Renders the user payments report to a PDF with WeasyPrint.
+
+This module only depends on Jinja2 and WeasyPrint, so it runs in a fresh interpreter of its own
+without loading the bot (its Telegram client, database connections or threads). It reads the
+rows of the report as JSON on stdin and writes the PDF to stdout:
+
+    python3 models/engine/report_render.py < rows.json > report.pdf
+"""
+
+import json
+import os
+import sys
+
+from jinja2 import Environment, FileSystemLoader
+from weasyprint import HTML
+
+RESOURCES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "resources",
+)
+
+
+def render(rows):
+    """
+    :param rows: The rows of the report, as passed to the template.
+    :return: The PDF document (bytes).
+    """
+    template = Environment(loader=FileSystemLoader(RESOURCES_DIR)).get_template(
+        "report_template.html"
+    )
+    return HTML(string=template.render(rows=rows)).write_pdf()
+
+
+def main():
+    sys.stdout.buffer.write(render(json.load(sys.stdin)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
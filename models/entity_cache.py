@@ -0,0 +1,191 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from models import logger
+from resources.constants import (
+    ENTITY_CACHE_SIZE,
+    ENTITY_CACHE_TTL,
+    ENTITY_REFRESH_BATCH,
+)
+
+# The subset of a Telegram user the bot renders, with the same attribute names as Telethon's User
+Profile = namedtuple("Profile", ("id", "username", "first_name", "last_name"))
+
+
+class EntityCache:
+    """
+    Cache of Telegram user profiles, so rendering a message never waits on the Telegram API.
+
+    Profiles are kept for `ENTITY_CACHE_TTL` seconds, up to `ENTITY_CACHE_SIZE` of them
+    (least recently used first out). Render paths use `get_cached`, which falls back to the
+    names stored on the `TelegramUser` row and queues missing or expired profiles, while
+    `refresh` fetches the queued profiles in batches in the background.
+    """
+
+    def __init__(self, client):
+        self.__client = client
+        self.__entries = OrderedDict()
+        self.__stale = set()
+        self.__me = None
+        self.stats = dict.fromkeys(("hits", "misses", "fetches"), 0)
+
+    @staticmethod
+    def to_profile(entity):
+        """
+        Reduce a Telethon entity to a profile.
+
+        Args:
+            entity: The Telethon user entity.
+
+        Returns:
+            Profile: The profile.
+        """
+        return Profile(
+            entity.id,
+            getattr(entity, "username", None),
+            getattr(entity, "first_name", None) or "",
+            getattr(entity, "last_name", None),
+        )
+
+    @staticmethod
+    def from_telegram_user(telegram_user):
+        """
+        Build a profile from the names stored on a `TelegramUser` row.
+
+        Args:
+            telegram_user (TelegramUser): The stored Telegram account.
+
+        Returns:
+            Profile: The profile.
+        """
+        return Profile(
+            telegram_user.tg_user_id,
+            telegram_user.tg_username,
+            telegram_user.tg_first_name or str(telegram_user.tg_user_id),
+            telegram_user.tg_last_name,
+        )
+
+    def put(self, profile):
+        """
+        Add or replace a profile in the cache.
+
+        Args:
+            profile (Profile): The profile.
+        """
+        self.__entries[profile.id] = (profile, time.monotonic())
+        self.__entries.move_to_end(profile.id)
+        self.__stale.discard(profile.id)
+        while len(self.__entries) > ENTITY_CACHE_SIZE:
+            self.__entries.popitem(last=False)
+
+    def __lookup(self, user_id):
+        """
+        Returns:
+            tuple: The cached profile (or None) and whether it's still fresh.
+        """
+        entry = self.__entries.get(user_id)
+        if not entry:
+            return None, False
+        self.__entries.move_to_end(user_id)
+        return entry[0], time.monotonic() - entry[1] < ENTITY_CACHE_TTL
+
+    def get_cached(self, telegram_user):
+        """
+        Get the profile of a stored Telegram account without any network round trip.
+        Missing or expired profiles are answered from the row and queued for the next refresh.
+
+        Args:
+            telegram_user (TelegramUser): The stored Telegram account.
+
+        Returns:
+            Profile: The profile.
+        """
+        profile, fresh = self.__lookup(telegram_user.tg_user_id)
+        if fresh:
+            self.stats["hits"] += 1
+            return profile
+
+        self.stats["misses"] += 1
+        self.__stale.add(telegram_user.tg_user_id)
+        return profile or self.from_telegram_user(telegram_user)
+
+    async def get(self, user_id):
+        """
+        Get the profile of a Telegram user, fetching it if it's not cached or has expired.
+        If fetching fails, an expired profile is returned rather than nothing.
+
+        Args:
+            user_id (int): The Telegram ID of the user.
+
+        Returns:
+            Profile: The profile.
+
+        Raises:
+            ValueError: If the user isn't cached and can't be fetched.
+        """
+        profile, fresh = self.__lookup(user_id)
+        if fresh:
+            self.stats["hits"] += 1
+            return profile
+
+        self.stats["misses"] += 1
+        try:
+            self.stats["fetches"] += 1
+            profile = self.to_profile(await self.__client.get_entity(user_id))
+        except Exception as e:
+            if profile:
+                logger.warning(f"Error fetching Telegram user {user_id}: {e}")
+                return profile
+            raise
+        self.put(profile)
+        return profile
+
+    async def get_me(self):
+        """
+        Get the bot's own profile. It never changes while the bot runs, so it's fetched once.
+
+        Returns:
+            Profile: The bot's profile.
+        """
+        if not self.__me:
+            self.stats["fetches"] += 1
+            self.__me = self.to_profile(await self.__client.get_me())
+        return self.__me
+
+    async def refresh(self):
+        """
+        Fetch the profiles queued by `get_cached` and the expired ones, `ENTITY_REFRESH_BATCH`
+        at a time, so each batch costs a single API call.
+
+        Returns:
+            list[Profile]: The refreshed profiles.
+        """
+        now = time.monotonic()
+        expired = [
+            user_id
+            for user_id, (_, fetched_at) in self.__entries.items()
+            if now - fetched_at >= ENTITY_CACHE_TTL
+        ]
+        pending = list(self.__stale.union(expired))
+
+        refreshed = []
+        for start in range(0, len(pending), ENTITY_REFRESH_BATCH):
+            batch = pending[start : start + ENTITY_REFRESH_BATCH]
+            self.stats["fetches"] += 1
+            try:
+                entities = await self.__client.get_entity(batch)
+            except ValueError:
+                # One unknown user fails the whole batch, resolve them one by one instead
+                entities = []
+                for user_id in batch:
+                    try:
+                        entities.append(await self.__client.get_entity(user_id))
+                    except ValueError as e:
+                        logger.warning(f"Error fetching Telegram user {user_id}: {e}")
+                        self.__stale.discard(user_id)
+
+            for entity in entities:
+                profile = self.to_profile(entity)
+                self.put(profile)
+                refreshed.append(profile)
+        return refreshed
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from models import logger
+from resources.constants import (
+    EXCHANGE_API_ID,
+    EXCHANGE_API_TIMEOUT,
+    EXCHANGE_API_URL,
+    EXCHANGE_RATE_TTL,
+    EXCHANGE_RETRY_INTERVAL,
+)
+
+
+class ExchangeRateService:
+    """
+    Exchange rates from exchangerate-api, fetched over one pooled HTTP session.
+
+    The whole `conversion_rates` table of a base currency is cached in memory and in
+    Redis for `EXCHANGE_RATE_TTL` seconds, and concurrent lookups of an expired table
+    share one request. The Redis copy is kept past its TTL as the last known good table,
+    used when the API can't be reached, so payments can still be recorded offline.
+    """
+
+    # JSON with the rates of a base currency and when they were fetched
+    REDIS_KEY = "exchange_rates:{}"
+
+    def __init__(self, api_id=EXCHANGE_API_ID, api_url=EXCHANGE_API_URL):
+        """
+        Args:
+            api_id (str): The exchangerate-api key.
+            api_url (str): The API's base URL, e.g. a local stub server's in tests.
+        """
+        self.api_id = api_id
+        self.api_url = api_url.rstrip("/")
+        self.redis_conn = None
+        self.__session = None
+        # base currency -> (rates, fetch time)
+        self.__tables = {}
+        self.__in_flight = {}
+        self.stats = dict.fromkeys(("hits", "fetches", "errors", "fallbacks"), 0)
+
+    async def start(self, redis_conn):
+        """
+        Start caching rates in Redis.
+
+        Args:
+            redis_conn: The Redis connection.
+        """
+        self.redis_conn = redis_conn
+
+    async def close(self):
+        """
+        Close the HTTP session.
+        """
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
+
+    def __get_session(self):
+        """
+        Returns:
+            aiohttp.ClientSession: The shared session, created on first use.
+        """
+        if not self.__session or self.__session.closed:
+            self.__session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=EXCHANGE_API_TIMEOUT)
+            )
+        return self.__session
+
+    async def get_rate(self, from_currency, to_currency):
+        """
+        Get the exchange rate between two currencies.
+
+        Args:
+            from_currency (str): The source currency code.
+            to_currency (str): The target currency code.
+
+        Returns:
+            float: The exchange rate.
+
+        Raises:
+            ValueError: If there's neither a fresh nor a last known good rate.
+        """
+        if from_currency == to_currency:
+            return 1.0
+
+        rates = await self.get_rates(from_currency)
+        if to_currency not in rates:
+            raise ValueError(f"No exchange rate from {from_currency} to {to_currency}.")
+        return float(rates[to_currency])
+
+    async def get_rates(self, base):
+        """
+        Get the conversion rates of a base currency.
+
+        Args:
+            base (str): The base currency code.
+
+        Returns:
+            dict: The rate of every currency, by currency code.
+
+        Raises:
+            ValueError: If there's neither a fresh nor a last known good table.
+        """
+        table = self.__tables.get(base)
+        if table and time.time() - table[1] < EXCHANGE_RATE_TTL:
+            self.stats["hits"] += 1
+            return table[0]
+
+        # Concurrent lookups share the one refresh
+        future = self.__in_flight.get(base)
+        if not future:
+            future = asyncio.ensure_future(self.__refresh(base))
+            self.__in_flight[base] = future
+            future.add_done_callback(lambda _: self.__in_flight.pop(base, None))
+        return await asyncio.shield(future)
+
+    async def __refresh(self, base):
+        """
+        Load the table of a base currency from Redis if it's fresh there, fetch it otherwise,
+        falling back to the last known good table if that fails.
+
+        Args:
+            base (str): The base currency code.
+
+        Returns:
+            dict: The rates.
+        """
+        stored = await self.__load(base)
+        if stored and time.time() - stored[1] < EXCHANGE_RATE_TTL:
+            self.__tables[base] = stored
+            return stored[0]
+
+        try:
+            rates = await self.fetch(base)
+        except Exception as e:
+            self.stats["errors"] += 1
+            stored = stored or self.__tables.get(base)
+            if not stored:
+                raise ValueError(f"Couldn't fetch the {base} exchange rates: {e}")
+            logger.warning(
+                f"Couldn't fetch the {base} exchange rates, using the ones from "
+                f"{time.ctime(stored[1])}: {e}"
+            )
+            self.stats["fallbacks"] += 1
+            # Don't retry the API on every lookup while it's down
+            self.__tables[base] = (
+                stored[0],
+                time.time() - EXCHANGE_RATE_TTL + EXCHANGE_RETRY_INTERVAL,
+            )
+            return stored[0]
+
+        table = (rates, time.time())
+        self.__tables[base] = table
+        await self.__store(base, table)
+        return rates
+
+    async def fetch(self, base):
+        """
+        Fetch the conversion rates of a base currency from the API.
+
+        Args:
+            base (str): The base currency code.
+
+        Returns:
+            dict: The rates.
+
+        Raises:
+            ValueError: If the API ID isn't set or the API returned an error.
+        """
+        if not self.api_id:
+            raise ValueError("Exchange API ID not set.")
+
+        self.stats["fetches"] += 1
+        url = f"{self.api_url}/{self.api_id}/latest/{base}"
+        async with self.__get_session().get(url) as response:
+            data = await response.json(content_type=None)
+        if data.get("result") != "success":
+            raise ValueError(
+                f"Exchange API error: {data.get('error-type', response.status)}"
+            )
+        return data["conversion_rates"]
+
+    async def __load(self, base):
+        """
+        Returns:
+            tuple: The rates stored in Redis and when they were fetched, None if there are none.
+        """
+        if not self.redis_conn:
+            return None
+        try:
+            stored = await self.redis_conn.get(self.REDIS_KEY.format(base))
+        except Exception as e:
+            logger.warning(f"Error loading the {base} exchange rates: {e}")
+            return None
+        if not stored:
+            return None
+        stored = json.loads(stored)
+        return stored["rates"], stored["fetched_at"]
+
+    async def __store(self, base, table):
+        """
+        Store a table in Redis, without expiry, so it outlives its TTL as the last known good one.
+        """
+        if not self.redis_conn:
+            return
+        try:
+            await self.redis_conn.set(
+                self.REDIS_KEY.format(base),
+                json.dumps({"rates": table[0], "fetched_at": table[1]}),
+            )
+        except Exception as e:
+            logger.warning(f"Error storing the {base} exchange rates: {e}")
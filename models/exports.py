@@ -0,0 +1,242 @@
+import datetime
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import DateTime, String, func, literal_column, select, type_coerce
+
+from models import storage
+from models.ledger import LedgerEntry
+from models.payments import Payment
+from models.rentals import Rental
+from models.users import User
+from resources.constants import EXPORT_BATCH_SIZE, EXPORT_COMPRESSION_LEVEL
+
+
+class Exporter:
+    """
+    Exports a table to a compressed CSV or JSONL file, or to an XLSX workbook.
+
+    Rows are read in keyset batches of `EXPORT_BATCH_SIZE` as plain column tuples,
+    never as ORM objects, and written out as they arrive, so memory use doesn't grow
+    with the size of the table. Fields follow the conventions of `BaseModel.to_dict`,
+    and are named after the model's attributes: amounts of money are exported in
+    minor units, as e.g. `amount_minor`.
+    """
+
+    FORMATS = ("csv", "jsonl", "xlsx")
+    TABLES = {
+        "users": User,
+        "rentals": Rental,
+        "payments": Payment,
+        "ledger": LedgerEntry,
+    }
+    # The column a date range applies to, per table
+    DATE_COLUMNS = {
+        "users": User.created_at,
+        "rentals": Rental.start_time,
+        "payments": Payment.payment_date,
+        "ledger": LedgerEntry.posted_at,
+    }
+
+    def __init__(self, table, file_format="csv", start=None, end=None, secrets=False):
+        """
+        Args:
+            table (str): One of `TABLES`.
+            file_format (str): One of `FORMATS`.
+            start (int): Only export rows dated from this epoch timestamp on.
+            end (int): Only export rows dated before this epoch timestamp.
+            secrets (bool): Export the Linux passwords of users too.
+
+        Raises:
+            ValueError: If the table or format isn't supported.
+        """
+        if table not in self.TABLES:
+            raise ValueError(f"Unknown table `{table}`.")
+        if file_format not in self.FORMATS:
+            raise ValueError(f"Unknown format `{file_format}`.")
+
+        self.table = table
+        self.cls = self.TABLES[table]
+        self.format = file_format
+        self.start = start
+        self.end = end
+        self.columns = [
+            column
+            for column in self.cls.__table__.columns
+            if secrets or column.name != "linux_password"
+        ]
+        # The attributes the columns are mapped to, e.g. `amount_minor` for `amount`
+        self.names = [
+            self.cls.__mapper__.get_property_by_column(column).key
+            for column in self.columns
+        ]
+        self.rows = 0
+
+    @property
+    def file_name(self):
+        """
+        Returns:
+            str: The name the export is uploaded as, e.g. `payments-2025-01-31.csv.gz`.
+        """
+        suffix = ".xlsx" if self.format == "xlsx" else f".{self.format}.gz"
+        return f"{self.table}-{datetime.date.today().isoformat()}{suffix}"
+
+    def __date_filter(self):
+        """
+        Returns:
+            list: The conditions selecting the rows in the date range.
+        """
+        column = self.DATE_COLUMNS[self.table]
+        conditions = []
+        for bound, compare in ((self.start, column.__ge__), (self.end, column.__lt__)):
+            if bound is None:
+                continue
+            if isinstance(column.type, DateTime):
+                # Stored as naive UTC datetimes
+                bound = datetime.datetime.utcfromtimestamp(bound)
+            conditions.append(compare(bound))
+        return conditions
+
+    def batches(self):
+        """
+        Read the rows of the table in keyset batches.
+
+        On SQLite, the batches follow the rowid, which reads the table in storage order
+        rather than through the index of the (UUID) IDs, and datetimes are read as the text
+        they are stored as instead of being parsed and formatted again.
+
+        Yields:
+            list[tuple]: The values of the rows of a batch, in the order of `columns`,
+                with datetimes formatted like `BaseModel.to_dict`.
+        """
+        sqlite = storage.dialect == "sqlite"
+        key = literal_column("rowid") if sqlite else self.cls.id
+        selected = []
+        datetime_indexes = []
+        for index, column in enumerate(self.columns):
+            if not isinstance(column.type, DateTime):
+                selected.append(column)
+            elif sqlite:
+                # Stored as `YYYY-MM-DD HH:MM:SS.ffffff`
+                selected.append(
+                    func.replace(type_coerce(column, String), " ", "T").label(
+                        column.name
+                    )
+                )
+            else:
+                selected.append(column)
+                datetime_indexes.append(index)
+        conditions = self.__date_filter()
+        last_key = None
+        while True:
+            # The key is selected last, to continue from the last row of the batch
+            query = select(*selected, key).where(*conditions)
+            if last_key is not None:
+                query = query.where(key > last_key)
+            batch = storage.execute(query.order_by(key).limit(EXPORT_BATCH_SIZE)).all()
+            if not batch:
+                return
+
+            last_key = batch[-1][-1]
+            self.rows += len(batch)
+            rows = [values[:-1] for values in batch]
+            if datetime_indexes:
+                rows = [list(values) for values in rows]
+                for values in rows:
+                    for index in datetime_indexes:
+                        if values[index] is not None:
+                            # Same as `BaseModel.to_dict`'s format, much faster than strftime
+                            values[index] = values[index].isoformat(
+                                timespec="microseconds"
+                            )
+            yield rows
+
+    @staticmethod
+    def __csv_field(value):
+        """
+        Format a value like `csv.writer` does, quoting it only if needed. Much faster than
+        `csv.writer` for long strings (such as IDs), which it scans one character at a time.
+
+        Args:
+            value: The value.
+
+        Returns:
+            str: The CSV field.
+        """
+        if value is None:
+            return ""
+        if type(value) is not str:
+            return str(value)
+        if '"' in value or "," in value or "\n" in value or "\r" in value:
+            return '"' + value.replace('"', '""') + '"'
+        return value
+
+    def __lines(self, rows):
+        """
+        Format the rows of a batch as lines of the export.
+
+        Args:
+            rows (list[tuple]): The values of the rows.
+
+        Returns:
+            str: The lines.
+        """
+        if self.format == "csv":
+            field = self.__csv_field
+            return "".join(",".join(map(field, row)) + "\r\n" for row in rows)
+
+        return "".join(
+            json.dumps({**dict(zip(self.names, row)), "__class__": self.cls.__name__})
+            + "\n"
+            for row in rows
+        )
+
+    def write(self, path):
+        """
+        Export the table to a file. Blocking, meant to be run in a worker thread,
+        with a database session of its own that is closed once done.
+
+        Args:
+            path (str): The path of the file to write.
+        """
+        try:
+            if self.format == "xlsx":
+                self.__write_xlsx(path)
+                return
+
+            with gzip.open(
+                path, "wb", compresslevel=EXPORT_COMPRESSION_LEVEL
+            ) as file, ThreadPoolExecutor(1) as compressor:
+                # zlib releases the GIL: each batch is compressed while the next one is read
+                pending = None
+                if self.format == "csv":
+                    file.write(self.__lines([self.names]).encode())
+                for rows in self.batches():
+                    data = self.__lines(rows).encode()
+                    if pending is not None:
+                        pending.result()
+                    pending = compressor.submit(file.write, data)
+                if pending is not None:
+                    pending.result()
+        finally:
+            # The session of the thread the export ran in
+            storage.close()
+
+    def __write_xlsx(self, path):
+        """
+        Export the table to an XLSX workbook, streamed row by row.
+
+        Args:
+            path (str): The path of the file to write.
+        """
+        # Only needed for XLSX exports
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.table)
+        sheet.append(self.names)
+        for rows in self.batches():
+            for row in rows:
+                sheet.append(list(row))
+        workbook.save(path)
@@ -0,0 +1,394 @@
+import time
+import uuid
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    and_,
+    func,
+    select,
+)
+from sqlalchemy.orm import relationship
+
+import models
+from models.baseModel import Base, BaseModel
+from models.money import BASE_CURRENCY, Money
+from resources.constants import LEDGER_RECONCILE_RANGES, LEDGER_SNAPSHOT_INTERVAL
+
+
+class LedgerEntry(BaseModel, Base):
+    """
+    One leg of a double-entry ledger transaction. Every change of a user's balance is
+    recorded as two entries of the same transaction that sum to zero: one on the user's
+    `tenant` account, one on the account the money came from or went to.
+
+    Attributes:
+        transaction_id (str): The ID shared by the two legs of the transaction.
+        user_id (str): The ID of the user the transaction belongs to.
+        account (str): "tenant" (the user's balance), "cash", "revenue" or "adjustments".
+        kind (str): "credit", "refund", "charge" or "adjustment".
+        amount (Money): The amount the account changed by, in `BASE_CURRENCY`,
+            stored in minor units (`amount_minor`).
+        seq (int): The number of the transaction among the user's transactions, from 1.
+        posted_at (int): Unix timestamp of when the transaction was recorded.
+        payment_id (str): The ID of the payment the transaction records, if any.
+        note (str): A free-form note, e.g. why an adjustment was made.
+        user (relationship): Relationship to the User table.
+        payment (relationship): Relationship to the Payment table.
+    """
+
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        # Balance reconstruction sums the tail of a user's tenant entries after a snapshot
+        Index("ix_ledger_entries_user_account_seq", "user_id", "account", "seq"),
+    )
+
+    transaction_id = Column(String(36), nullable=False, index=True)
+    user_id = Column(
+        String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    account = Column(String(16), nullable=False)
+    kind = Column(String(16), nullable=False)
+    amount_minor = Column("amount", BigInteger, nullable=False)
+    seq = Column(Integer, nullable=False)
+    posted_at = Column(Integer, nullable=False)
+    payment_id = Column(
+        String(36), ForeignKey("payments.id", ondelete="SET NULL"), default=None
+    )
+    note = Column(String(255), default=None)
+
+    # Relationships, so the user and the payment are inserted before their entries
+    user = relationship("User")
+    payment = relationship("Payment")
+
+    @property
+    def amount(self):
+        """
+        Returns:
+            Money: The amount.
+        """
+        return Money(self.amount_minor, BASE_CURRENCY)
+
+
+class LedgerSnapshot(BaseModel, Base):
+    """
+    A user's balance after a transaction, taken every `LEDGER_SNAPSHOT_INTERVAL` transactions
+    so a past balance is reconstructed from the nearest snapshot and the entries after it.
+
+    Attributes:
+        user_id (str): The ID of the user.
+        seq (int): The number of the user's transaction the snapshot was taken after.
+        balance (Money): The balance after that transaction, stored in minor units (`balance_minor`).
+        taken_at (int): Unix timestamp of when the snapshot was taken.
+        user (relationship): Relationship to the User table.
+    """
+
+    __tablename__ = "ledger_snapshots"
+    __table_args__ = (Index("ix_ledger_snapshots_user_seq", "user_id", "seq"),)
+
+    user_id = Column(
+        String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    seq = Column(Integer, nullable=False)
+    balance_minor = Column("balance", BigInteger, nullable=False)
+    taken_at = Column(Integer, nullable=False)
+
+    # Relationships, so the user is inserted before its snapshots
+    user = relationship("User")
+
+    @property
+    def balance(self):
+        """
+        Returns:
+            Money: The balance.
+        """
+        return Money(self.balance_minor, BASE_CURRENCY)
+
+
+class Ledger:
+    """
+    Records balance changes in the ledger, reconstructs past balances and reconciles
+    `User.balance` with the ledger.
+    """
+
+    TENANT = "tenant"
+    # The account on the other side of each kind of transaction
+    COUNTER_ACCOUNTS = {
+        "credit": "cash",
+        "refund": "cash",
+        "charge": "revenue",
+        "adjustment": "adjustments",
+    }
+    # Users are reconciled in ranges of IDs sharing their first two (hex) characters
+    RANGES = [f"{prefix:02x}" for prefix in range(256)]
+    stats = dict.fromkeys(("verified", "skipped", "mismatched"), 0)
+
+    @classmethod
+    def post(cls, user, amount, kind, payment_id=None, note=None):
+        """
+        Record a change of a user's balance that was just applied to the user. The entries
+        are added to the current session, to be committed together with the balance.
+
+        Args:
+            user (User): The user, with the new balance.
+            amount (Money): The amount the balance changed by, negative for debits.
+            kind (str): One of `COUNTER_ACCOUNTS`.
+            payment_id (str): The ID of the payment the change records, if any.
+            note (str): A note stored with the entries.
+
+        Returns:
+            str: The ID of the transaction.
+
+        Raises:
+            ValueError: If the kind of transaction isn't supported.
+        """
+        if kind not in cls.COUNTER_ACCOUNTS:
+            raise ValueError(f"Invalid ledger transaction kind '{kind}'.")
+
+        user.ledger_seq = (user.ledger_seq or 0) + 1
+        transaction_id = str(uuid.uuid4())
+        posted_at = int(time.time())
+        for account, minor in (
+            (cls.TENANT, amount.minor),
+            (cls.COUNTER_ACCOUNTS[kind], -amount.minor),
+        ):
+            models.storage.new(
+                LedgerEntry(
+                    transaction_id=transaction_id,
+                    user_id=user.id,
+                    account=account,
+                    kind=kind,
+                    amount_minor=minor,
+                    seq=user.ledger_seq,
+                    posted_at=posted_at,
+                    payment_id=payment_id,
+                    note=note,
+                )
+            )
+
+        if user.ledger_seq % LEDGER_SNAPSHOT_INTERVAL == 0:
+            models.storage.new(
+                LedgerSnapshot(
+                    user_id=user.id,
+                    seq=user.ledger_seq,
+                    balance_minor=user.balance_minor,
+                    taken_at=posted_at,
+                )
+            )
+        return transaction_id
+
+    @classmethod
+    def balance_at(cls, user_id, timestamp=None):
+        """
+        Reconstruct a user's balance from the nearest snapshot and the entries after it.
+
+        Args:
+            user_id (str): The ID of the user.
+            timestamp (int): The Unix timestamp to get the balance at, now if None.
+
+        Returns:
+            Money: The balance.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        snapshot = models.storage.execute(
+            select(LedgerSnapshot.seq, LedgerSnapshot.balance_minor)
+            .where(
+                LedgerSnapshot.user_id == user_id,
+                LedgerSnapshot.taken_at <= timestamp,
+            )
+            .order_by(LedgerSnapshot.seq.desc())
+            .limit(1)
+        ).first()
+        seq, balance = snapshot if snapshot else (0, 0)
+
+        tail = models.storage.execute(
+            select(func.sum(LedgerEntry.amount_minor)).where(
+                LedgerEntry.user_id == user_id,
+                LedgerEntry.account == cls.TENANT,
+                LedgerEntry.seq > seq,
+                LedgerEntry.posted_at <= timestamp,
+            )
+        ).scalar()
+        return Money(balance + (tail or 0), BASE_CURRENCY)
+
+    @classmethod
+    def current_balances(cls, conditions):
+        """
+        Reconstruct the current balances of users from their latest snapshots and the
+        entries after them.
+
+        Args:
+            conditions (list): The conditions on `LedgerEntry.user_id` and
+                `LedgerSnapshot.user_id` selecting the users, as functions of the column.
+
+        Returns:
+            dict: The balances in minor units, by user ID, for users with entries.
+        """
+        latest = (
+            select(LedgerSnapshot.user_id, func.max(LedgerSnapshot.seq).label("seq"))
+            .where(*(condition(LedgerSnapshot.user_id) for condition in conditions))
+            .group_by(LedgerSnapshot.user_id)
+            .subquery()
+        )
+        snapshots = models.storage.execute(
+            select(LedgerSnapshot.user_id, LedgerSnapshot.balance_minor).join(
+                latest,
+                and_(
+                    LedgerSnapshot.user_id == latest.c.user_id,
+                    LedgerSnapshot.seq == latest.c.seq,
+                ),
+            )
+        ).all()
+        balances = dict(snapshots)
+
+        tails = models.storage.execute(
+            select(LedgerEntry.user_id, func.sum(LedgerEntry.amount_minor))
+            .outerjoin(latest, LedgerEntry.user_id == latest.c.user_id)
+            .where(
+                *(condition(LedgerEntry.user_id) for condition in conditions),
+                LedgerEntry.account == cls.TENANT,
+                LedgerEntry.seq > func.coalesce(latest.c.seq, 0),
+            )
+            .group_by(LedgerEntry.user_id)
+        ).all()
+        for user_id, tail in tails:
+            balances[user_id] = balances.get(user_id, 0) + tail
+        return balances
+
+    @classmethod
+    def __range_conditions(cls, prefix):
+        """
+        Returns:
+            list: The conditions selecting the IDs that start with a range's prefix,
+                as functions of the ID column.
+        """
+        index = cls.RANGES.index(prefix)
+        conditions = [lambda column: column >= prefix]
+        if index + 1 < len(cls.RANGES):
+            conditions.append(lambda column: column < cls.RANGES[index + 1])
+        return conditions
+
+    @classmethod
+    def checksums(cls):
+        """
+        Compute a checksum of the balances of each range of users, from the count, the
+        balances and the transaction counts of its users, and the count and the sum of the
+        tenant entries of its users in the ledger. Any balance change, through the ledger
+        or not, and any change of the ledger entries themselves, changes the checksum of
+        the user's range.
+
+        Returns:
+            dict: The checksums, by range prefix.
+        """
+        from models.users import User
+
+        prefix = func.substr(User.id, 1, 2)
+        users = models.storage.execute(
+            select(
+                prefix,
+                func.count(),
+                func.coalesce(func.sum(User.balance_minor), 0),
+                func.coalesce(func.sum(User.ledger_seq), 0),
+            ).group_by(prefix)
+        ).all()
+        prefix = func.substr(LedgerEntry.user_id, 1, 2)
+        entries = models.storage.execute(
+            select(
+                prefix,
+                func.count(),
+                func.coalesce(func.sum(LedgerEntry.amount_minor), 0),
+            )
+            .where(LedgerEntry.account == cls.TENANT)
+            .group_by(prefix)
+        ).all()
+
+        aggregates = {
+            prefix: (count, int(balance), int(seq), 0, 0)
+            for prefix, count, balance, seq in users
+        }
+        for prefix, count, total in entries:
+            aggregates[prefix] = aggregates.get(prefix, (0, 0, 0))[:3] + (
+                count,
+                int(total),
+            )
+        return {
+            prefix: ":".join(map(str, aggregate))
+            for prefix, aggregate in aggregates.items()
+        }
+
+    @classmethod
+    def verify_range(cls, prefix):
+        """
+        Compare the balances of a range of users with the balances reconstructed from the ledger.
+
+        Args:
+            prefix (str): The range, one of `RANGES`.
+
+        Returns:
+            list[tuple]: The username, balance and ledger balance (Money) of each user
+                whose balance doesn't match the ledger.
+        """
+        from models.users import User
+
+        conditions = cls.__range_conditions(prefix)
+        users = models.storage.execute(
+            select(User.id, User.linux_username, User.balance_minor).where(
+                *(condition(User.id) for condition in conditions)
+            )
+        ).all()
+        ledger = cls.current_balances(conditions)
+        return [
+            (
+                username,
+                Money(balance, BASE_CURRENCY),
+                Money(ledger.get(user_id, 0), BASE_CURRENCY),
+            )
+            for user_id, username, balance in users
+            if int(balance or 0) != ledger.get(user_id, 0)
+        ]
+
+    @classmethod
+    def reconcile(cls, verified):
+        """
+        Verify the ranges of users whose checksum changed since they were last verified,
+        at most `LEDGER_RECONCILE_RANGES` of them. Blocking, meant to be run in a worker
+        thread, with a database session of its own that is closed once done.
+
+        Args:
+            verified (dict): The checksum each range was last verified at, by range prefix.
+                Ranges found mismatched are prefixed with "!", so they're reported once.
+
+        Returns:
+            tuple: The new checksums of the verified ranges (dict), the mismatched users of
+                the ranges found mismatched (dict), and the ranges that have no users anymore (list).
+        """
+        try:
+            checksums = cls.checksums()
+            changed = [
+                prefix
+                for prefix, checksum in checksums.items()
+                if verified.get(prefix, "").lstrip("!") != checksum
+            ]
+            cls.stats["skipped"] += len(checksums) - len(changed)
+
+            results, mismatches = {}, {}
+            for prefix in changed[:LEDGER_RECONCILE_RANGES]:
+                mismatched = cls.verify_range(prefix)
+                if mismatched:
+                    cls.stats["mismatched"] += 1
+                    results[prefix] = f"!{checksums[prefix]}"
+                    mismatches[prefix] = mismatched
+                else:
+                    cls.stats["verified"] += 1
+                    results[prefix] = checksums[prefix]
+            stale = [prefix for prefix in verified if prefix not in checksums]
+            return results, mismatches, stale
+        finally:
+            # The session of the thread the reconciliation ran in
+            models.storage.close()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+from models import logger, storage
+from resources.constants import LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL
+
+
+class LookupCache:
+    """
+    Read-through cache for the lookups run on every tenant request, e.g. finding the
+    rental of the Telegram account sending /status.
+
+    Lookups return small JSON serializable projections of the rows they read, kept in an
+    in-process LRU of `LOOKUP_CACHE_SIZE` entries and in Redis for `LOOKUP_CACHE_TTL`
+    seconds. Concurrent misses of the same lookup share one database query.
+
+    Each model has a generation, bumped as soon as this process commits a change to one of
+    the fields lookups of the model read (through `ChangeFeed.listen`). Cached projections
+    are stored under the generations of the models they read, so a commit makes them
+    unreachable at once, in memory and in Redis, where they're left to expire. Redis keys
+    also carry an epoch taken at start, so projections cached before a restart are never read.
+    """
+
+    # Incremented on every start, the epoch of the Redis keys
+    EPOCH_KEY = "lookup:epoch"
+
+    def __init__(self):
+        self.redis_conn = None
+        self.__epoch = None
+        self.__generations = {}
+        # Fields read by the lookups, by model
+        self.__fields = {}
+        # key -> projection
+        self.__entries = OrderedDict()
+        # key -> future of the lookup in progress
+        self.__in_flight = {}
+        self.stats = dict.fromkeys(
+            ("hits", "redis_hits", "misses", "coalesced", "invalidations", "errors"), 0
+        )
+
+    async def start(self, redis_conn):
+        """
+        Start caching projections in Redis.
+
+        Args:
+            redis_conn: The Redis connection.
+        """
+        self.__epoch = await redis_conn.incr(self.EPOCH_KEY)
+        self.redis_conn = redis_conn
+
+    def invalidate(self, events):
+        """
+        Bump the generations of the models whose changes affect cached lookups.
+        Registered with `ChangeFeed.listen`, called from whichever thread committed.
+
+        Args:
+            events (list): The events of a commit, each a list of the model, the ID,
+                the operation, the changed fields and the user ID.
+        """
+        for model, _, op, fields, _ in events:
+            read = self.__fields.get(model)
+            if read is None:
+                continue
+            if op == "update" and read.isdisjoint(fields):
+                continue
+            self.__generations[model] = self.__generations.get(model, 0) + 1
+            self.stats["invalidations"] += 1
+
+    async def get(self, key, load, depends):
+        """
+        Get the projection of a lookup, from the cache if possible.
+
+        Args:
+            key (str): Identifies the lookup and its arguments.
+            load (callable): The function reading the projection from the database, called
+                without arguments. It returns a JSON serializable value, None if not found.
+            depends (dict): The fields the lookup reads, filters included, by model name.
+
+        Returns:
+            The projection.
+        """
+        for model, fields in depends.items():
+            self.__fields.setdefault(model, set()).update(fields)
+        generations = ".".join(
+            str(self.__generations.get(model, 0)) for model in sorted(depends)
+        )
+        key = f"{generations}:{key}"
+
+        if key in self.__entries:
+            self.__entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.__entries[key]
+
+        future = self.__in_flight.get(key)
+        if future:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__in_flight[key] = future
+        try:
+            value = await self.__read_through(key, load)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.__entries[key] = value
+            while len(self.__entries) > LOOKUP_CACHE_SIZE:
+                self.__entries.popitem(last=False)
+            future.set_result(value)
+            return value
+        finally:
+            del self.__in_flight[key]
+
+    async def __read_through(self, key, load):
+        """
+        Returns:
+            The projection of a lookup from Redis, or else from the database, caching it in Redis.
+        """
+        redis_key = f"lookup:{self.__epoch}:{key}"
+        if self.redis_conn:
+            try:
+                cached = await self.redis_conn.get(redis_key)
+                if cached is not None:
+                    self.stats["redis_hits"] += 1
+                    return json.loads(cached)
+            except Exception as e:
+                logger.warning(f"Failed to read lookup {key} from Redis: {e}")
+                self.stats["errors"] += 1
+
+        self.stats["misses"] += 1
+        value = load()
+        if self.redis_conn:
+            try:
+                await self.redis_conn.set(
+                    redis_key, json.dumps(value), ex=LOOKUP_CACHE_TTL
+                )
+            except Exception as e:
+                logger.warning(f"Failed to cache lookup {key} in Redis: {e}")
+                self.stats["errors"] += 1
+        return value
+
+    async def find(self, cls, **filters):
+        """
+        Find the first object matching filters, like `DBStorage.query_object`, resolving its
+        ID through the cache and loading it by primary key, from the session if it's there.
+
+        Args:
+            cls (str): The name of the model, e.g. "User".
+            **filters: The values of the columns to match, e.g. uuid=...
+
+        Returns:
+            The object, or None if not found.
+        """
+
+        def load():
+            obj = storage.query_object(cls, **filters)
+            return obj.id if obj else None
+
+        key = f"find:{cls}:{json.dumps(filters, sort_keys=True, default=str)}"
+        object_id = await self.get(key, load, {cls: set(filters) | {"id"}})
+        return storage.get(cls, object_id) if object_id else None
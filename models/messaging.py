@@ -0,0 +1,654 @@
+import asyncio
+import itertools
+import json
+import time
+import uuid
+
+from telethon import Button
+
+from telethon.errors import (
+    FloodWaitError,
+    InputUserDeactivatedError,
+    PeerIdInvalidError,
+    RPCError,
+    UserIsBlockedError,
+)
+from telethon.tl.types import KeyboardButtonCallback, KeyboardButtonUrl
+
+from models import logger
+from resources.constants import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_RATE,
+    BROADCAST_RETRIES,
+    BROADCAST_STATE_TTL,
+    MESSAGE_LIMIT,
+    OUTBOX_CHAT_BURST,
+    OUTBOX_CHAT_RATE,
+    OUTBOX_DIGEST_WINDOW,
+    OUTBOX_RATE,
+    OUTBOX_RETRIES,
+    OUTBOX_WORKERS,
+)
+
+# Errors retrying won't fix
+PERMANENT_ERRORS = (
+    UserIsBlockedError,
+    InputUserDeactivatedError,
+    PeerIdInvalidError,
+    ValueError,
+)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by concurrent senders.
+    Allows bursts of up to `capacity` operations and `rate` operations per second on average.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (float): The maximum number of tokens, defaults to `rate`.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.__lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it.
+        """
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self):
+        """
+        Take a token if one is available, without waiting.
+
+        Returns:
+            bool: True if a token was taken.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for a while, e.g. when Telegram asks us to back off.
+
+        Args:
+            seconds (float): The number of seconds to pause for.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Refill from the end of the pause, so it isn't followed by a full burst
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+class Broadcast:
+    """
+    A broadcast of a message to many Telegram users.
+
+    The delivery state of every recipient is kept in Redis, so a broadcast interrupted
+    by a restart can be resumed without messaging anyone twice. Messages are delivered
+    through the outbox at the lowest priority by `BROADCAST_CONCURRENCY` workers sharing
+    a token bucket limited to `BROADCAST_RATE` messages per second. A recipient is marked
+    as failed once the outbox gives up after `BROADCAST_RETRIES` retries.
+    """
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    # Unfinished broadcast IDs
+    ACTIVE_KEY = "broadcasts"
+    # Hash with the message and creation time of a broadcast
+    META_KEY = "broadcast:{}"
+    # Hash of recipient Telegram ID to delivery status
+    RECIPIENTS_KEY = "broadcast:{}:recipients"
+    # Hash of recipient Telegram ID to the last error, for failed deliveries
+    ERRORS_KEY = "broadcast:{}:errors"
+
+    def __init__(self, redis_conn, broadcast_id, message):
+        self.redis_conn = redis_conn
+        self.id = broadcast_id
+        self.message = message
+
+    @classmethod
+    async def create(cls, redis_conn, message, recipients):
+        """
+        Create a broadcast and store its recipients as pending.
+
+        Args:
+            redis_conn: The Redis connection.
+            message (str): The message to broadcast.
+            recipients (iterable[int]): The Telegram IDs of the recipients.
+
+        Returns:
+            Broadcast: The new broadcast.
+        """
+        broadcast = cls(redis_conn, uuid.uuid4().hex[:8], message)
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                cls.META_KEY.format(broadcast.id),
+                mapping={"message": message, "created_at": int(time.time())},
+            )
+            if recipients:
+                pipe.hset(
+                    cls.RECIPIENTS_KEY.format(broadcast.id),
+                    mapping=dict.fromkeys(map(str, recipients), cls.PENDING),
+                )
+            pipe.sadd(cls.ACTIVE_KEY, broadcast.id)
+            await pipe.execute()
+        return broadcast
+
+    @classmethod
+    async def load(cls, redis_conn, broadcast_id):
+        """
+        Load a stored broadcast.
+
+        Args:
+            redis_conn: The Redis connection.
+            broadcast_id (str): The ID of the broadcast.
+
+        Returns:
+            Broadcast: The broadcast, or None if it doesn't exist anymore.
+        """
+        message = await redis_conn.hget(cls.META_KEY.format(broadcast_id), "message")
+        if message is None:
+            return None
+        return cls(redis_conn, broadcast_id, message)
+
+    @classmethod
+    async def get_unfinished(cls, redis_conn):
+        """
+        Get the broadcasts that were interrupted before every recipient was handled.
+
+        Args:
+            redis_conn: The Redis connection.
+
+        Returns:
+            list[Broadcast]: The unfinished broadcasts.
+        """
+        broadcasts = []
+        for broadcast_id in await redis_conn.smembers(cls.ACTIVE_KEY):
+            broadcast = await cls.load(redis_conn, broadcast_id)
+            if broadcast:
+                broadcasts.append(broadcast)
+            else:
+                await redis_conn.srem(cls.ACTIVE_KEY, broadcast_id)
+        return broadcasts
+
+    async def get_counts(self):
+        """
+        Count the recipients of the broadcast by delivery status.
+
+        Returns:
+            dict: The number of `sent`, `failed` and `pending` recipients.
+        """
+        statuses = await self.redis_conn.hvals(self.RECIPIENTS_KEY.format(self.id))
+        counts = dict.fromkeys((self.SENT, self.FAILED, self.PENDING), 0)
+        for status in statuses:
+            counts[status] += 1
+        return counts
+
+    async def run(self, outbox, on_progress=None):
+        """
+        Send the message to every recipient still pending.
+
+        Args:
+            outbox (Outbox): The outbox the messages are delivered through.
+            on_progress: Optional coroutine function called with the counts
+                every `BROADCAST_PROGRESS_INTERVAL` seconds while sending.
+
+        Returns:
+            dict: The final number of `sent`, `failed` and `pending` recipients.
+        """
+        recipients = await self.redis_conn.hgetall(self.RECIPIENTS_KEY.format(self.id))
+        queue = asyncio.Queue()
+        for recipient, status in recipients.items():
+            if status == self.PENDING:
+                queue.put_nowait(int(recipient))
+
+        bucket = TokenBucket(BROADCAST_RATE)
+        workers = [
+            asyncio.create_task(self.__worker(outbox, queue, bucket))
+            for _ in range(min(BROADCAST_CONCURRENCY, queue.qsize()))
+        ]
+
+        async def report_progress():
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                await on_progress(await self.get_counts())
+
+        reporter = asyncio.create_task(report_progress()) if on_progress else None
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            if reporter:
+                reporter.cancel()
+
+        counts = await self.get_counts()
+        if not counts[self.PENDING]:
+            await self.finish()
+        return counts
+
+    async def finish(self):
+        """
+        Mark the broadcast as finished. Its state is kept for `BROADCAST_STATE_TTL` seconds.
+        """
+        async with self.redis_conn.pipeline(transaction=True) as pipe:
+            pipe.srem(self.ACTIVE_KEY, self.id)
+            for key in (self.META_KEY, self.RECIPIENTS_KEY, self.ERRORS_KEY):
+                pipe.expire(key.format(self.id), BROADCAST_STATE_TTL)
+            await pipe.execute()
+
+    async def __worker(self, outbox, queue, bucket):
+        while True:
+            recipient = await queue.get()
+            try:
+                status, error = await self.__deliver(outbox, recipient, bucket)
+                await self.redis_conn.hset(
+                    self.RECIPIENTS_KEY.format(self.id), str(recipient), status
+                )
+                if error:
+                    await self.redis_conn.hset(
+                        self.ERRORS_KEY.format(self.id), str(recipient), error
+                    )
+            except Exception as e:
+                # Leave the recipient pending so a resumed broadcast retries it
+                logger.exception(e)
+            finally:
+                queue.task_done()
+
+    async def __deliver(self, outbox, recipient, bucket):
+        """
+        Send the message to a single recipient.
+        The outbox takes care of FloodWaits and retries, the broadcast's own bucket
+        keeps it from using up the outbox's whole rate.
+
+        Returns:
+            tuple: The delivery status and the error message if it failed.
+        """
+        await bucket.acquire()
+        try:
+            await outbox.deliver(
+                recipient,
+                self.message,
+                priority=Outbox.BROADCAST,
+                retries=BROADCAST_RETRIES,
+                persist=False,
+            )
+            return self.SENT, None
+        except (*PERMANENT_ERRORS, RPCError, ConnectionError) as e:
+            logger.warning(f"Broadcast {self.id}: failed to send to {recipient}: {e}")
+            return self.FAILED, str(e)
+
+
+class Outbox:
+    """
+    The single queue every outbound Telegram message goes through.
+
+    Messages are sent by `OUTBOX_WORKERS` workers in priority order (interactive replies,
+    then notifications, then broadcasts), limited to `OUTBOX_RATE` messages per second
+    overall and `OUTBOX_CHAT_RATE` per chat. Failed sends are retried with exponential
+    backoff and FloodWaits pause the whole outbox for the requested time.
+
+    Queued messages are kept in Redis until delivered, so they survive a restart.
+    Notifications queued with `coalesce=True` are held for `OUTBOX_DIGEST_WINDOW` seconds
+    and sent as a single digest per chat, which keeps bursts (e.g. mass expiries) from
+    turning into hundreds of API calls.
+    """
+
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    BROADCAST = 2
+
+    # Hash of message ID to the JSON encoded message, for messages not delivered yet
+    BACKLOG_KEY = "outbox"
+    DIGEST_SEPARATOR = "\n\n➖➖➖\n\n"
+
+    def __init__(self, client):
+        self.__client = client
+        self.redis_conn = None
+        self.__queue = asyncio.PriorityQueue()
+        self.__counter = itertools.count()
+        self.__messages = {}
+        self.__futures = {}
+        self.__digests = {}
+        self.__bucket = TokenBucket(OUTBOX_RATE)
+        self.__chat_buckets = {}
+        self.__workers = []
+        self.stats = dict.fromkeys(
+            ("queued", "sent", "failed", "retried", "coalesced", "api_calls"), 0
+        )
+
+    async def start(self, redis_conn):
+        """
+        Restore the backlog from Redis and start sending.
+        Messages queued before the outbox was started are persisted now.
+
+        Args:
+            redis_conn: The Redis connection.
+        """
+        self.redis_conn = redis_conn
+        backlog = await redis_conn.hgetall(self.BACKLOG_KEY)
+        for message_id, data in backlog.items():
+            if message_id not in self.__messages:
+                message = json.loads(data)
+                self.__messages[message_id] = message
+                self.__enqueue(message)
+        if backlog:
+            logger.info(f"Restored {len(backlog)} queued message(s) from Redis.")
+
+        for message in list(self.__messages.values()):
+            if message["persist"] and message["id"] not in backlog:
+                await self.__persist(message)
+
+        self.__workers = [
+            asyncio.create_task(self.__worker()) for _ in range(OUTBOX_WORKERS)
+        ]
+
+    async def send(
+        self,
+        chat_id,
+        text,
+        priority=NOTIFICATION,
+        buttons=None,
+        parse_mode=None,
+        link_preview=True,
+        coalesce=False,
+        retries=OUTBOX_RETRIES,
+        persist=True,
+    ):
+        """
+        Queue a message. Returns as soon as the message is queued, without waiting for delivery.
+
+        Args:
+            chat_id (int): The chat to send the message to.
+            text (str): The message text.
+            priority (int): `INTERACTIVE`, `NOTIFICATION` or `BROADCAST`.
+            buttons: Optional inline keyboard, made of `Button.inline` and `Button.url` buttons.
+            parse_mode (str): Optional parse mode, the client's default is used if not given.
+            link_preview (bool): Whether to show link previews.
+            coalesce (bool): Whether the message may be merged into a digest with other
+                messages to the same chat. Ignored for messages with buttons.
+            retries (int): How many times a failed send is retried.
+            persist (bool): Whether to keep the message in Redis until it's delivered.
+
+        Returns:
+            str: The ID of the queued message.
+        """
+        message = {
+            "id": uuid.uuid4().hex,
+            "chat_id": int(chat_id),
+            "text": text,
+            "priority": priority,
+            "buttons": self.serialize_buttons(buttons),
+            "parse_mode": parse_mode,
+            "link_preview": link_preview,
+            "coalesce": coalesce and not buttons,
+            "retries": retries,
+            "attempts": 0,
+            "persist": persist,
+            "parts": None,
+        }
+        self.__messages[message["id"]] = message
+        self.stats["queued"] += 1
+        if persist:
+            await self.__persist(message)
+        self.__enqueue(message)
+        return message["id"]
+
+    async def deliver(self, chat_id, text, **kwargs):
+        """
+        Queue a message and wait until it's delivered.
+        Takes the same arguments as `send`.
+
+        Returns:
+            Message: The sent message.
+
+        Raises:
+            The last error if the message couldn't be delivered.
+        """
+        future = asyncio.get_running_loop().create_future()
+        kwargs["coalesce"] = False
+        message_id = await self.send(chat_id, text, **kwargs)
+        self.__futures[message_id] = future
+        return await future
+
+    @staticmethod
+    def serialize_buttons(buttons):
+        """
+        Convert an inline keyboard into a JSON serializable list of rows.
+
+        Args:
+            buttons: A button, a row of buttons or a list of rows.
+
+        Returns:
+            list[list[dict]]: The rows, or None if there are no buttons.
+        """
+        if not buttons:
+            return None
+        if not isinstance(buttons, list):
+            buttons = [buttons]
+        if not isinstance(buttons[0], list):
+            buttons = [buttons]
+
+        rows = []
+        for row in buttons:
+            serialized = []
+            for button in row:
+                if isinstance(button, KeyboardButtonCallback):
+                    serialized.append(
+                        {"text": button.text, "data": button.data.decode()}
+                    )
+                elif isinstance(button, KeyboardButtonUrl):
+                    serialized.append({"text": button.text, "url": button.url})
+                else:
+                    raise ValueError(
+                        f"Unsupported button type: {type(button).__name__}"
+                    )
+            rows.append(serialized)
+        return rows
+
+    @staticmethod
+    def deserialize_buttons(rows):
+        """
+        Convert rows serialized with `serialize_buttons` back into an inline keyboard.
+
+        Args:
+            rows (list[list[dict]]): The serialized rows.
+
+        Returns:
+            list[list]: The inline keyboard, or None if there are no buttons.
+        """
+        if not rows:
+            return None
+        return [
+            [
+                (
+                    Button.url(button["text"], button["url"])
+                    if "url" in button
+                    else Button.inline(button["text"], data=button["data"])
+                )
+                for button in row
+            ]
+            for row in rows
+        ]
+
+    def __enqueue(self, message):
+        if not message["coalesce"]:
+            self.__queue.put_nowait(
+                (message["priority"], next(self.__counter), message["id"])
+            )
+            return
+
+        key = (message["chat_id"], message["parse_mode"], message["link_preview"])
+        digest = self.__digests.setdefault(key, [])
+        digest.append(message["id"])
+        if len(digest) == 1:
+            asyncio.get_running_loop().call_later(
+                OUTBOX_DIGEST_WINDOW, self.__flush_digest, key
+            )
+
+    def __flush_digest(self, key):
+        """
+        Merge the messages held for a chat into as few messages as fit Telegram's length limit.
+        The original messages stay in Redis until the digest is delivered.
+        """
+        message_ids = self.__digests.pop(key, [])
+        if len(message_ids) == 1:
+            message = self.__messages[message_ids[0]]
+            message["coalesce"] = False
+            self.__enqueue(message)
+            return
+
+        chunks = []
+        for message_id in message_ids:
+            message = self.__messages[message_id]
+            if chunks and (
+                len(chunks[-1]["text"])
+                + len(self.DIGEST_SEPARATOR)
+                + len(message["text"])
+                <= MESSAGE_LIMIT
+            ):
+                chunks[-1]["text"] += self.DIGEST_SEPARATOR + message["text"]
+                chunks[-1]["parts"].append(message_id)
+                chunks[-1]["priority"] = min(
+                    chunks[-1]["priority"], message["priority"]
+                )
+                continue
+            chunks.append(
+                dict(
+                    message,
+                    id=uuid.uuid4().hex,
+                    coalesce=False,
+                    persist=False,
+                    parts=[message_id],
+                )
+            )
+
+        self.stats["coalesced"] += len(message_ids) - len(chunks)
+        for chunk in chunks:
+            self.__messages[chunk["id"]] = chunk
+            self.__enqueue(chunk)
+
+    def __get_chat_bucket(self, chat_id):
+        bucket = self.__chat_buckets.get(chat_id)
+        if not bucket:
+            bucket = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+            self.__chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def __persist(self, message):
+        if self.redis_conn:
+            await self.redis_conn.hset(
+                self.BACKLOG_KEY, message["id"], json.dumps(message)
+            )
+
+    async def __worker(self):
+        while True:
+            # Wait before taking a message, so messages keep their priority order
+            while not self.__client.is_connected():
+                await asyncio.sleep(1)
+            _, _, message_id = await self.__queue.get()
+            try:
+                await self.__send(self.__messages[message_id])
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self.__queue.task_done()
+
+    async def __send(self, message):
+        # The chat's bucket first, so a busy chat waits without holding outbox-wide tokens
+        await self.__get_chat_bucket(message["chat_id"]).acquire()
+        await self.__bucket.acquire()
+
+        kwargs = {}
+        if message["parse_mode"]:
+            kwargs["parse_mode"] = message["parse_mode"]
+        try:
+            self.stats["api_calls"] += 1
+            sent = await self.__client.send_message(
+                message["chat_id"],
+                message["text"],
+                buttons=self.deserialize_buttons(message["buttons"]),
+                link_preview=message["link_preview"],
+                **kwargs,
+            )
+        except FloodWaitError as e:
+            logger.warning(f"Outbox: flood wait of {e.seconds}s, pausing.")
+            self.__bucket.pause(e.seconds)
+            self.__enqueue(message)
+            return
+        except PERMANENT_ERRORS as e:
+            logger.warning(f"Outbox: failed to send to {message['chat_id']}: {e}")
+            await self.__complete(message, error=e)
+            return
+        except (RPCError, ConnectionError) as e:
+            message["attempts"] += 1
+            if message["attempts"] > message["retries"]:
+                logger.warning(
+                    f"Outbox: giving up on a message to {message['chat_id']} "
+                    f"after {message['attempts']} attempts: {e}"
+                )
+                await self.__complete(message, error=e)
+                return
+            self.stats["retried"] += 1
+            asyncio.get_running_loop().call_later(
+                min(2 ** message["attempts"], 60), self.__enqueue, message
+            )
+            return
+        except Exception as e:
+            # Not retried, but whoever waits for the message still learns about it
+            logger.exception(e)
+            await self.__complete(message, error=e)
+            return
+
+        await self.__complete(message, result=sent)
+
+    async def __complete(self, message, result=None, error=None):
+        """
+        Forget a message once it's delivered or given up on, and notify whoever waits for it.
+        """
+        self.stats["failed" if error else "sent"] += 1
+        message_ids = message["parts"] or [message["id"]]
+        self.__messages.pop(message["id"], None)
+        for message_id in message_ids:
+            self.__messages.pop(message_id, None)
+
+        future = self.__futures.pop(message["id"], None)
+        if future and not future.done():
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        if self.redis_conn:
+            await self.redis_conn.hdel(self.BACKLOG_KEY, *message_ids)
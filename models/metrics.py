@@ -0,0 +1,355 @@
+import asyncio
+import contextvars
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+from sqlalchemy import event
+
+# Upper bounds in seconds of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# "queue" is the time a command waited for a dispatcher worker
+BACKENDS = ("queue", "telegram", "db", "redis", "subprocess")
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed buckets.
+    """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Record a value.
+
+        Args:
+            value (float): The value, in seconds.
+        """
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile (0-1).
+
+        Returns:
+            float: The estimate, or None if nothing was recorded yet.
+        """
+        if not self.count:
+            return None
+        cumulative = 0
+        for i, bound in enumerate(DURATION_BUCKETS):
+            cumulative += self.counts[i]
+            if cumulative >= q * self.count:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        """
+        Yields:
+            tuple: The bucket's upper bound as a Prometheus label and the cumulative count.
+        """
+        total = 0
+        for bound, count in zip(DURATION_BUCKETS, self.counts):
+            total += count
+            yield f"{bound:g}", total
+        yield "+Inf", self.count
+
+
+class Metrics:
+    """
+    Collects per-command latency, throughput and error metrics, and the time spent
+    in the Telegram API, the database, Redis and subprocesses.
+
+    The command being handled is tracked in a context variable, so the time and
+    queries of the calls it makes, even from tasks it spawns, are attributed to it.
+    """
+
+    def __init__(self):
+        self.commands = defaultdict(Histogram)
+        self.in_flight = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.db_queries = defaultdict(int)
+        self.backends = defaultdict(Histogram)
+        # (command, backend) -> seconds
+        self.backend_time = defaultdict(float)
+        self.started_at = time.time()
+        # Counters kept by other components, see `expose`
+        self.exposed = []
+        self.__current = contextvars.ContextVar("command", default=None)
+        self.__server = None
+
+    @asynccontextmanager
+    async def track(self, command):
+        """
+        Track the handling of a command or callback.
+
+        Args:
+            command (str): The command (e.g. `/list_users`) or callback name.
+        """
+        token = self.__current.set(command)
+        self.in_flight[command] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[command] += 1
+            raise
+        finally:
+            self.commands[command].observe(time.perf_counter() - started)
+            self.in_flight[command] -= 1
+            self.__current.reset(token)
+
+    def record(self, backend, seconds):
+        """
+        Record time spent in a backend, attributed to the current command if any.
+
+        Args:
+            backend (str): One of `BACKENDS`.
+            seconds (float): The time spent.
+        """
+        self.backends[backend].observe(seconds)
+        command = self.__current.get()
+        if command:
+            self.backend_time[(command, backend)] += seconds
+            if backend == "db":
+                self.db_queries[command] += 1
+
+    @asynccontextmanager
+    async def timed(self, backend):
+        """
+        Time a block of code as spent in a backend.
+
+        Args:
+            backend (str): One of `BACKENDS`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(backend, time.perf_counter() - started)
+
+    async def to_thread(self, backend, func, *args, **kwargs):
+        """
+        Run a blocking call in a thread, like `asyncio.to_thread`, and time it as spent in a backend.
+
+        Args:
+            backend (str): One of `BACKENDS`.
+            func: The function to call.
+
+        Returns:
+            The return value of the function.
+        """
+        async with self.timed(backend):
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    def instrument_engine(self, engine):
+        """
+        Time every statement executed through an SQLAlchemy engine.
+
+        Args:
+            engine: The SQLAlchemy engine.
+        """
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, params, context, many):
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, params, context, many):
+            self.record("db", time.perf_counter() - conn.info["query_started"].pop())
+
+    def instrument_client(self, client):
+        """
+        Time every request a Telethon client sends to Telegram.
+
+        Args:
+            client: The Telethon client.
+        """
+        call = client._call
+
+        async def timed_call(*args, **kwargs):
+            async with self.timed("telegram"):
+                return await call(*args, **kwargs)
+
+        client._call = timed_call
+
+    def instrument_redis(self, redis_conn):
+        """
+        Time every command sent through a Redis connection.
+        Pipelines are sent as a whole and aren't timed.
+
+        Args:
+            redis_conn: The `redis.asyncio` connection.
+        """
+        execute_command = redis_conn.execute_command
+
+        async def timed_execute_command(*args, **kwargs):
+            async with self.timed("redis"):
+                return await execute_command(*args, **kwargs)
+
+        redis_conn.execute_command = timed_execute_command
+
+    def expose(self, name, help_text, label, stats):
+        """
+        Serve counters another component keeps in a dict alongside the command metrics.
+
+        Args:
+            name (str): The name of the Prometheus counter.
+            help_text (str): What the counter counts.
+            label (str): The label the keys of the dict are exposed as.
+            stats (dict): The counters by key, read on every render.
+        """
+        self.exposed.append((name, help_text, label, stats))
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = [
+            "# HELP bot_command_duration_seconds Time taken to handle a command or callback.",
+            "# TYPE bot_command_duration_seconds histogram",
+        ]
+        for command, histogram in sorted(self.commands.items()):
+            label = self.__escape(command)
+            for bound, count in histogram.cumulative():
+                lines.append(
+                    f'bot_command_duration_seconds_bucket{{command="{label}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'bot_command_duration_seconds_sum{{command="{label}"}} {histogram.sum:.6f}'
+            )
+            lines.append(
+                f'bot_command_duration_seconds_count{{command="{label}"}} {histogram.count}'
+            )
+
+        for name, kind, help_text, values in (
+            (
+                "bot_commands_in_flight",
+                "gauge",
+                "Commands currently being handled.",
+                self.in_flight,
+            ),
+            (
+                "bot_command_errors_total",
+                "counter",
+                "Commands that raised an error.",
+                self.errors,
+            ),
+            (
+                "bot_command_db_queries_total",
+                "counter",
+                "Database queries executed while handling commands.",
+                self.db_queries,
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for command, value in sorted(values.items()):
+                lines.append(f'{name}{{command="{self.__escape(command)}"}} {value}')
+
+        lines.append(
+            "# HELP bot_backend_duration_seconds Time taken by calls to a backend."
+        )
+        lines.append("# TYPE bot_backend_duration_seconds histogram")
+        for backend, histogram in sorted(self.backends.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(
+                    f'bot_backend_duration_seconds_bucket{{backend="{backend}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'bot_backend_duration_seconds_sum{{backend="{backend}"}} {histogram.sum:.6f}'
+            )
+            lines.append(
+                f'bot_backend_duration_seconds_count{{backend="{backend}"}} {histogram.count}'
+            )
+
+        lines.append(
+            "# HELP bot_command_backend_seconds_total Time spent in each backend while handling commands."
+        )
+        lines.append("# TYPE bot_command_backend_seconds_total counter")
+        for (command, backend), seconds in sorted(self.backend_time.items()):
+            lines.append(
+                f'bot_command_backend_seconds_total{{command="{self.__escape(command)}",'
+                f'backend="{backend}"}} {seconds:.6f}'
+            )
+
+        for name, help_text, label, stats in self.exposed:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in stats.items():
+                lines.append(f'{name}{{{label}="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Summarize the per-command metrics, slowest commands first.
+
+        Returns:
+            list[dict]: A dict per command with its `command`, number of `calls`, `errors`,
+                `in_flight` count, estimated `p50` and `p95` latency, average `db_queries`
+                and the average seconds spent in each backend (`backends`).
+        """
+        rows = []
+        for command, histogram in self.commands.items():
+            calls = histogram.count
+            rows.append(
+                {
+                    "command": command,
+                    "calls": calls,
+                    "errors": self.errors[command],
+                    "in_flight": self.in_flight[command],
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "db_queries": self.db_queries[command] / calls,
+                    "backends": {
+                        backend: self.backend_time[(command, backend)] / calls
+                        for backend in BACKENDS
+                        if (command, backend) in self.backend_time
+                    },
+                }
+            )
+        return sorted(rows, key=lambda row: row["p95"] or 0, reverse=True)
+
+    async def start_server(self, host, port):
+        """
+        Serve the metrics in the Prometheus format on `http://<host>:<port>/metrics`.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+        """
+
+        async def handle_metrics(request):
+            return web.Response(
+                text=self.render(), content_type="text/plain", charset="utf-8"
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.__server = web.AppRunner(app, access_log=None)
+        await self.__server.setup()
+        await web.TCPSite(self.__server, host, port).start()
+
+    @staticmethod
+    def __escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -1,16 +1,33 @@
 import asyncio
 import datetime
+import os
 import random
+import signal
 import string
+import sys
 import time
 from functools import wraps
 
-import aiohttp
 import pytz
 import sh
 
-from models import storage, logger
-from resources.constants import ADJECTIVES, ADMIN_ID, EXCHANGE_API_ID, NOUNS, TIME_ZONE
+from models import metrics, storage, logger
+from models.cgroups import CgroupManager
+from models.processes import ProcessInspector
+from resources.constants import (
+    ADJECTIVES,
+    ADMIN_ID,
+    HOME_CLONE_WORKERS,
+    HOME_ROOT,
+    HOME_TEMPLATE_DIR,
+    NOUNS,
+    REAP_GRACE_PERIOD,
+    TIME_ZONE,
+)
+
+HOME_CLONE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "engine", "home_clone.py"
+)
 
 
 class Auth:
@@ -135,6 +152,24 @@ class Utilities:
         day = date.day
         return date.strftime(f"{day}{day_suffix} %B %Y, %I:%M %p IST")
 
+    @staticmethod
+    def parse_date(date_str: str, date_format: str = "%Y-%m-%d"):
+        """
+        Convert a date into the epoch timestamp of its start in IST.
+
+        Args:
+            date_str (str): The date to convert.
+            date_format (str): The `strptime` format of the date, `YYYY-MM-DD` by default.
+
+        Returns:
+            int: The epoch timestamp.
+
+        Raises:
+            ValueError: If the date isn't in the format.
+        """
+        date = datetime.datetime.strptime(date_str, date_format)
+        return int(pytz.timezone(TIME_ZONE).localize(date).timestamp())
+
     @classmethod
     def parse_duration_to_human_readable(cls, duration_seconds: int) -> str:
         """
@@ -162,10 +197,27 @@ class Utilities:
             duration_str += f"{duration_seconds} seconds"
         return duration_str
 
+    @staticmethod
+    def format_bytes(size):
+        """
+        Convert a size in bytes into a human-readable string.
+
+        Args:
+            size (int): The size in bytes.
+
+        Returns:
+            str: The formatted size (e.g., '1.50 GB').
+        """
+        for unit in ("B", "KB", "MB", "GB"):
+            if abs(size) < 1024:
+                return f"{size:.2f} {unit}"
+            size /= 1024
+        return f"{size:.2f} TB"
+
     @classmethod
     async def get_exchange_rate(cls, from_currency, to_currency):
         """
-        Fetch the exchange rate between two currencies using an external API.
+        Get the exchange rate between two currencies from the cached exchange rate service.
 
         Args:
             from_currency (str): The source currency code.
@@ -175,16 +227,11 @@ class Utilities:
             float: The exchange rate.
 
         Raises:
-            ValueError: If the API ID is not set.
+            ValueError: If there's neither a fresh nor a last known good rate.
         """
-        if not EXCHANGE_API_ID:
-            raise ValueError("Exchange API ID not set.")
+        from models import exchange_rates
 
-        url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_API_ID}/latest/{from_currency}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
-                return data["conversion_rates"][to_currency]
+        return await exchange_rates.get_rate(from_currency, to_currency)
 
     @classmethod
     async def deactivate_expired_rentals(cls):
@@ -198,6 +245,15 @@ class Utilities:
                 username=rental.user.linux_username
             )
             await SystemUserManager.remove_ssh_auth_keys(rental.user.linux_username)
+            if rental.is_suspended:
+                await SystemUserManager.freeze_user_processes(
+                    rental.user.linux_username, frozen=False
+                )
+            reaped = await SystemUserManager.terminate_user_processes(
+                rental.user.linux_username
+            )
+            rental.record_reaped_usage(reaped)
+            await CgroupManager.release_slice(rental.user.linux_username)
             rental.user.linux_password = password
             storage.save()
 
@@ -217,29 +273,94 @@ class SystemUserManager:
     """
 
     @staticmethod
-    async def create_user(username, password):
+    async def create_user(username, password, limits=None):
         """
         Create a new system user with the specified username and password.
+        If resource limits are given, the user's processes are placed into a dedicated cgroup.
+        If `HOME_TEMPLATE_DIR` is set, the home directory is cloned from the template instead of /etc/skel.
 
         Args:
             username (str): The username for the new user.
             password (str): The password for the new user.
+            limits (dict): Optional resource limits of the rental's plan tier.
 
         Raises:
             sh.ErrorReturnCode: If user creation fails.
         """
+        template = HOME_TEMPLATE_DIR
+        if template and not os.path.isdir(template):
+            logger.warning(f"Home template {template} not found, using /etc/skel.")
+            template = None
+
         try:
-            await asyncio.to_thread(
-                sh.sudo.adduser, username, "--gecos", "''", "--disabled-password"
+            if template:
+                home = os.path.join(HOME_ROOT, username)
+                await metrics.to_thread(
+                    "subprocess",
+                    sh.sudo.adduser,
+                    username,
+                    "--gecos",
+                    "''",
+                    "--disabled-password",
+                    "--home",
+                    home,
+                    "--no-create-home",
+                )
+                await SystemUserManager.clone_home_template(username, template, home)
+            else:
+                await metrics.to_thread(
+                    "subprocess",
+                    sh.sudo.adduser,
+                    username,
+                    "--gecos",
+                    "''",
+                    "--disabled-password",
+                )
+
+            await metrics.to_thread(
+                "subprocess", sh.sudo.chpasswd, _in=f"{username}:{password}"
             )
-
-            await asyncio.to_thread(sh.sudo.chpasswd, _in=f"{username}:{password}")
             logger.info(f"User {username} created successfully.")
 
+            if limits:
+                await CgroupManager.apply_limits(username, limits)
+
         except sh.ErrorReturnCode as e:
             logger.error(f"Error creating user {username}: {e.stderr.decode()}")
             raise
 
+    @staticmethod
+    async def clone_home_template(username, template, home):
+        """
+        Provision a home directory by cloning a template with the clone engine in
+        `models/engine/home_clone.py`, run as root so the tree can be chowned to the user.
+
+        Args:
+            username (str): The username of the user owning the home directory.
+            template (str): The path of the template directory.
+            home (str): The path of the home directory to create.
+
+        Raises:
+            sh.ErrorReturnCode: If cloning fails.
+        """
+        started = time.monotonic()
+        output = await metrics.to_thread(
+            "subprocess",
+            sh.sudo,
+            sys.executable,
+            HOME_CLONE_SCRIPT,
+            template,
+            home,
+            "--owner",
+            username,
+            "--workers",
+            str(HOME_CLONE_WORKERS),
+        )
+        logger.info(
+            f"Cloned home template for {username} in "
+            f"{time.monotonic() - started:.2f}s: {str(output).strip()}"
+        )
+
     @staticmethod
     async def delete_system_user(username):
         """
@@ -252,18 +373,141 @@ class SystemUserManager:
             bool: True if the user was deleted successfully, False otherwise.
         """
         try:
-            await asyncio.to_thread(
-                sh.sudo.pkill, "-9", "-u", username, _ok_code=[0, 1]
+            await metrics.to_thread(
+                "subprocess", sh.sudo.pkill, "-9", "-u", username, _ok_code=[0, 1]
             )  # Allow exit code 1 (no processes found)
 
-            await asyncio.to_thread(
-                sh.sudo.userdel, "-r", username, _ok_code=[0, 12]
+            await metrics.to_thread(
+                "subprocess", sh.sudo.userdel, "-r", username, _ok_code=[0, 12]
             )  # Allow exit code 12 (mail spool (/var/mail/[username]) not found)
+            await CgroupManager.release_slice(username)
             return True
         except sh.ErrorReturnCode as e:
             logger.error(f"Error deleting user {username}: {e.stderr.decode()}")
             return False
 
+    @staticmethod
+    async def _signal_processes(pids, sig):
+        """
+        Send a signal to a set of processes, using sudo if the bot lacks the permissions.
+
+        Args:
+            pids (list[int]): The process IDs.
+            sig (signal.Signals): The signal to send.
+        """
+        denied = []
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                continue
+            except PermissionError:
+                denied.append(str(pid))
+        if denied:
+            await metrics.to_thread(
+                "subprocess", sh.sudo.kill, f"-{sig.name[3:]}", *denied, _ok_code=[0, 1]
+            )  # Allow exit code 1 (some processes already exited)
+
+    @classmethod
+    async def terminate_user_processes(cls, username, grace_period=REAP_GRACE_PERIOD):
+        """
+        Terminate every process of a system user, e.g. leftover tmux/screen sessions and background jobs.
+        Processes get SIGTERM first and SIGKILL once the grace period is over,
+        with `pkill -u` as a final sweep for anything spawned in between.
+
+        Args:
+            username (str): The username of the user.
+            grace_period (int): Seconds to wait between SIGTERM and SIGKILL.
+
+        Returns:
+            dict: The number of processes terminated (`processes`), how many needed SIGKILL (`killed`),
+                the CPU time they had consumed (`cpu_seconds`) and the resident memory reclaimed (`memory_bytes`).
+        """
+        result = {"processes": 0, "killed": 0, "cpu_seconds": 0.0, "memory_bytes": 0}
+        uid = cls.get_uid(username)
+        if uid is None:
+            return result
+
+        pids = await asyncio.to_thread(ProcessInspector.get_user_pids, uid)
+        if not pids:
+            return result
+
+        cpu_seconds, memory_bytes = await asyncio.to_thread(
+            ProcessInspector.get_usage, pids
+        )
+        result.update(
+            processes=len(pids), cpu_seconds=cpu_seconds, memory_bytes=memory_bytes
+        )
+
+        await cls._signal_processes(pids, signal.SIGTERM)
+        deadline = time.monotonic() + grace_period
+        alive = ProcessInspector.get_alive_pids(pids)
+        while alive and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            alive = ProcessInspector.get_alive_pids(alive)
+
+        if alive:
+            result["killed"] = len(alive)
+            await cls._signal_processes(alive, signal.SIGKILL)
+
+        try:
+            await metrics.to_thread(
+                "subprocess", sh.sudo.pkill, "-9", "-u", username, _ok_code=[0, 1]
+            )  # Allow exit code 1 (no processes found)
+        except sh.ErrorReturnCode as e:
+            logger.error(f"Error killing processes of {username}: {e.stderr.decode()}")
+
+        logger.info(
+            f"Terminated {result['processes']} process(es) of {username} "
+            f"({result['killed']} killed), reclaimed {memory_bytes} bytes, "
+            f"{cpu_seconds:.2f} CPU-seconds consumed."
+        )
+        return result
+
+    @classmethod
+    async def freeze_user_processes(cls, username, frozen=True):
+        """
+        Freeze or thaw all processes of a system user.
+        The cgroup freezer of the user's rental is used when available, SIGSTOP/SIGCONT otherwise.
+
+        Args:
+            username (str): The username of the user.
+            frozen (bool): True to freeze the processes, False to thaw them.
+
+        Returns:
+            bool: True if the processes were frozen through the cgroup freezer, False if signals were used.
+        """
+        if await CgroupManager.set_frozen(username, frozen):
+            return True
+        uid = cls.get_uid(username)
+        if uid is not None:
+            pids = await asyncio.to_thread(ProcessInspector.get_user_pids, uid)
+            await cls._signal_processes(
+                pids, signal.SIGSTOP if frozen else signal.SIGCONT
+            )
+        return False
+
+    @classmethod
+    async def renice_user(cls, username, niceness=19):
+        """
+        Change the scheduling priority of all processes of a system user.
+
+        Args:
+            username (str): The username of the user.
+            niceness (int): The new niceness (-20 to 19).
+
+        Returns:
+            bool: True if successful, False otherwise.
+        """
+        try:
+            await metrics.to_thread(
+                "subprocess", sh.sudo.renice, "-n", str(niceness), "-u", username
+            )
+            return True
+        except sh.ErrorReturnCode as e:
+            logger.error(f"Error renicing user {username}: {e.stderr.decode()}")
+            return False
+
     @classmethod
     async def change_password(cls, username):
         """
@@ -279,7 +523,8 @@ class SystemUserManager:
         password = Utilities.generate_password()
 
         try:
-            await asyncio.to_thread(
+            await metrics.to_thread(
+                "subprocess",
                 sh.sudo.passwd,
                 username,
                 _in=f"{password}\n{password}\n",
@@ -303,8 +548,10 @@ class SystemUserManager:
             tuple: (bool, str) A tuple containing a success flag and a message.
         """
         try:
-            await asyncio.to_thread(
-                sh.sudo.rm, f"/home/{username}/.ssh/authorized_keys"
+            await metrics.to_thread(
+                "subprocess",
+                sh.sudo.rm,
+                os.path.join(HOME_ROOT, username, ".ssh/authorized_keys"),
             )
         except sh.ErrorReturnCode:
             return False, f"No authorized keys found for user {username}."
@@ -321,6 +568,42 @@ class SystemUserManager:
         with open("/etc/passwd", "r") as f:
             return f.readlines()
 
+    @classmethod
+    def get_uid(cls, username):
+        """
+        Get the UID of a system user.
+
+        Args:
+            username (str): The username of the user.
+
+        Returns:
+            int: The UID of the user, or None if the user doesn't exist.
+        """
+        for line in cls.get_passwd_data():
+            fields = line.split(":")
+            if fields[0] == username and len(fields) > 2:
+                return int(fields[2])
+        return None
+
+    @classmethod
+    def get_uids(cls, usernames):
+        """
+        Get the UIDs of several system users with a single read of /etc/passwd.
+
+        Args:
+            usernames (list[str]): The usernames of the users.
+
+        Returns:
+            dict: A mapping of UID to username for the users that exist.
+        """
+        wanted = set(usernames)
+        uids = {}
+        for line in cls.get_passwd_data():
+            fields = line.split(":")
+            if fields[0] in wanted and len(fields) > 2:
+                uids[int(fields[2])] = fields[0]
+        return uids
+
     @classmethod
     def is_user_exists(cls, username):
         """
@@ -361,7 +644,7 @@ class SystemUserManager:
             str: The output of the command.
         """
         try:
-            output = await asyncio.to_thread(sh.bash, "-c", command)
+            output = await metrics.to_thread("subprocess", sh.bash, "-c", command)
         except sh.ErrorReturnCode as e:
             output = e.stderr.decode()
         return output
@@ -0,0 +1,151 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import total_ordering
+
+# Minor units per major unit, e.g. 100 paise in a rupee
+MINOR_UNITS = {"INR": 100, "USD": 100}
+# The currency balances are kept in, and payments are converted to
+BASE_CURRENCY = "INR"
+
+
+@total_ordering
+class Money:
+    """
+    An exact amount of money, stored as an integer number of minor units (paise, cents)
+    with its currency. Amounts in different currencies can't be added or compared.
+
+    Formatting works like formatting the amount in major units, e.g. `f"{money:.2f}"`.
+    """
+
+    __slots__ = ("minor", "currency")
+
+    def __init__(self, minor=0, currency=BASE_CURRENCY):
+        """
+        Args:
+            minor (int): The amount in minor units.
+            currency (str): The currency code.
+
+        Raises:
+            ValueError: If the currency isn't supported.
+        """
+        if currency not in MINOR_UNITS:
+            raise ValueError(f"Unsupported currency '{currency}'.")
+        # Databases without an integer column type (e.g. SQLite's REAL) hand back floats
+        self.minor = int(minor or 0)
+        self.currency = currency
+
+    @classmethod
+    def from_major(cls, amount, currency=BASE_CURRENCY):
+        """
+        Create an amount from major units, rounding half up to the nearest minor unit.
+
+        Args:
+            amount (str | int | float | Decimal): The amount in major units, e.g. "499.99".
+            currency (str): The currency code.
+
+        Returns:
+            Money: The amount.
+
+        Raises:
+            ValueError: If the amount isn't a number or the currency isn't supported.
+        """
+        if currency not in MINOR_UNITS:
+            raise ValueError(f"Unsupported currency '{currency}'.")
+        try:
+            # Through str, so floats convert by their shortest representation (0.1 -> 10)
+            major = Decimal(str(amount))
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount '{amount}'.")
+        if not major.is_finite():
+            raise ValueError(f"Invalid amount '{amount}'.")
+        minor = (major * MINOR_UNITS[currency]).quantize(
+            Decimal(1), rounding=ROUND_HALF_UP
+        )
+        return cls(int(minor), currency)
+
+    @property
+    def major(self):
+        """
+        Returns:
+            Decimal: The amount in major units.
+        """
+        return Decimal(self.minor) / MINOR_UNITS[self.currency]
+
+    def convert(self, rate, currency):
+        """
+        Convert the amount to another currency.
+
+        Args:
+            rate (float | Decimal): Units of the target currency per unit of this one.
+            currency (str): The target currency code.
+
+        Returns:
+            Money: The converted amount, rounded half up to the nearest minor unit.
+        """
+        return Money.from_major(self.major * Decimal(str(rate)), currency)
+
+    def __check(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(
+                f"Can't combine amounts in {self.currency} and {other.currency}."
+            )
+        return other
+
+    def __add__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor + other.minor, self.currency)
+
+    def __sub__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor - other.minor, self.currency)
+
+    def __mul__(self, factor):
+        if isinstance(factor, int):
+            return Money(self.minor * factor, self.currency)
+        if isinstance(factor, (float, Decimal)):
+            minor = (Decimal(self.minor) * Decimal(str(factor))).quantize(
+                Decimal(1), rounding=ROUND_HALF_UP
+            )
+            return Money(int(minor), self.currency)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.minor, self.currency)
+
+    def __abs__(self):
+        return Money(abs(self.minor), self.currency)
+
+    def __bool__(self):
+        return self.minor != 0
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.minor == other.minor and self.currency == other.currency
+
+    def __lt__(self, other):
+        other = self.__check(other)
+        if other is NotImplemented:
+            return other
+        return self.minor < other.minor
+
+    def __hash__(self):
+        return hash((self.minor, self.currency))
+
+    def __format__(self, format_spec):
+        if not format_spec:
+            return str(self)
+        return format(self.major, format_spec)
+
+    def __str__(self):
+        return f"{self.major:,.2f} {self.currency}"
+
+    def __repr__(self):
+        return f"Money({self.minor}, {self.currency!r})"
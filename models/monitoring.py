@@ -0,0 +1,244 @@
+import math
+import time
+from collections import deque
+
+from models.processes import ProcessInspector, SessionInspector
+from resources.constants import (
+    ABUSE_EWMA_ALPHA,
+    ABUSE_HARD_CPU,
+    ABUSE_MIN_CPU,
+    ABUSE_PERCENTILE,
+    ABUSE_STDDEV_FACTOR,
+    ABUSE_SUSTAIN_SAMPLES,
+    ABUSE_WARMUP_SAMPLES,
+    ABUSE_WINDOW,
+)
+
+
+class UsageBaseline:
+    """
+    Rolling CPU usage baseline of a single user.
+    Keeps an exponentially weighted mean and variance, plus a bounded window
+    of recent samples the percentiles are computed from.
+    """
+
+    __slots__ = ("mean", "variance", "samples", "strikes", "flagged")
+
+    def __init__(self, window=ABUSE_WINDOW):
+        self.mean = 0.0
+        self.variance = 0.0
+        self.samples = deque(maxlen=window)
+        self.strikes = 0
+        self.flagged = False
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    def percentile(self, pct):
+        """
+        Get a percentile of the samples in the window.
+
+        Args:
+            pct (float): The percentile (0-100).
+
+        Returns:
+            float: The percentile, or 0 if there are no samples yet.
+        """
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+    def update(self, usage, alpha=ABUSE_EWMA_ALPHA):
+        """
+        Fold a sample into the baseline.
+
+        Args:
+            usage (float): The CPU usage in cores.
+            alpha (float): The EWMA smoothing factor.
+        """
+        if not self.samples:
+            self.mean = usage
+        else:
+            diff = usage - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.variance = (1 - alpha) * (self.variance + diff * increment)
+        self.samples.append(usage)
+
+    def is_outlier(self, usage):
+        """
+        Check if a sample is an outlier compared to the baseline.
+        Usage above `ABUSE_HARD_CPU` always is; otherwise, once the baseline is warmed up,
+        a sample is an outlier if it's above `ABUSE_MIN_CPU` and exceeds both the
+        EWMA band and the configured percentile of the window.
+
+        Args:
+            usage (float): The CPU usage in cores.
+
+        Returns:
+            bool: True if the sample is an outlier, False otherwise.
+        """
+        if usage >= ABUSE_HARD_CPU:
+            return True
+        if usage < ABUSE_MIN_CPU or len(self.samples) < ABUSE_WARMUP_SAMPLES:
+            return False
+        threshold = max(
+            self.mean + ABUSE_STDDEV_FACTOR * self.stddev,
+            self.percentile(ABUSE_PERCENTILE),
+        )
+        return usage > threshold
+
+
+class AbuseDetector:
+    """
+    Detects tenants with sustained abnormal CPU usage (crypto-miners, runaway builds, ...).
+    Each call to `sample` takes one incremental CPU sample per user and compares it
+    against the user's rolling baseline, so it's cheap enough to run every few seconds.
+    """
+
+    def __init__(self):
+        self.__baselines = {}
+        self.__last_ticks = {}
+        self.__ignored = {}
+
+    def ignore(self, username, duration):
+        """
+        Stop alerting about a user for a while.
+
+        Args:
+            username (str): The username of the user.
+            duration (int): The number of seconds to ignore the user for.
+        """
+        self.__ignored[username] = time.monotonic() + duration
+
+    def is_ignored(self, username):
+        """
+        Check if alerts about a user are currently suppressed.
+
+        Args:
+            username (str): The username of the user.
+
+        Returns:
+            bool: True if the user is ignored, False otherwise.
+        """
+        until = self.__ignored.get(username)
+        if until is None:
+            return False
+        if until < time.monotonic():
+            del self.__ignored[username]
+            return False
+        return True
+
+    def sample(self, users):
+        """
+        Take a CPU sample for every monitored user and update their baselines.
+        Outlier samples are kept out of the baseline so sustained abuse doesn't become the norm.
+
+        Args:
+            users (dict): A mapping of UID to username of the users to monitor.
+
+        Returns:
+            list[dict]: A report for every user that just crossed the sustained-outlier threshold,
+                with the `username`, `uid`, current `usage`, baseline `mean` and `percentile`.
+        """
+        now = time.monotonic()
+        ticks = ProcessInspector.get_cpu_ticks_by_uid(set(users))
+        flagged = []
+
+        for uid, total in ticks.items():
+            last = self.__last_ticks.get(uid)
+            self.__last_ticks[uid] = (total, now)
+            if last is None or now <= last[1]:
+                continue
+
+            # Exited processes take their CPU time with them, hence the clamp
+            usage = (
+                max(0, total - last[0]) / ProcessInspector.CLOCK_TICKS / (now - last[1])
+            )
+            baseline = self.__baselines.setdefault(uid, UsageBaseline())
+
+            if not baseline.is_outlier(usage):
+                baseline.strikes = 0
+                baseline.flagged = False
+                baseline.update(usage)
+                continue
+
+            baseline.strikes += 1
+            if (
+                baseline.strikes >= ABUSE_SUSTAIN_SAMPLES
+                and not baseline.flagged
+                and not self.is_ignored(users[uid])
+            ):
+                baseline.flagged = True
+                flagged.append(
+                    {
+                        "username": users[uid],
+                        "uid": uid,
+                        "usage": usage,
+                        "mean": baseline.mean,
+                        "percentile": baseline.percentile(ABUSE_PERCENTILE),
+                    }
+                )
+
+        # Forget users that are no longer monitored (expired or deleted rentals)
+        for uid in set(self.__baselines) - set(users):
+            self.__baselines.pop(uid, None)
+            self.__last_ticks.pop(uid, None)
+
+        return flagged
+
+
+class IdleDetector:
+    """
+    Tracks tenant activity by combining utmp sessions (login and last tty input),
+    the last login time from lastlog and per-UID CPU usage.
+    """
+
+    def __init__(self):
+        self.__last_ticks = {}
+
+    def sample(self, users):
+        """
+        Take an activity sample for every monitored user.
+
+        Args:
+            users (dict): A mapping of UID to username of the users to monitor.
+
+        Returns:
+            dict: A mapping of username to a dict with the number of open `sessions`,
+                the latest `activity_time` (login or tty input, None if unknown)
+                and the `cpu` usage in cores since the previous sample.
+        """
+        now = time.monotonic()
+        sessions = SessionInspector.get_sessions()
+        ticks = ProcessInspector.get_cpu_ticks_by_uid(set(users))
+
+        activity = {}
+        for uid, username in users.items():
+            user_sessions = [s for s in sessions if s["username"] == username]
+            times = [s["input_time"] for s in user_sessions]
+            last_login = SessionInspector.get_last_login(uid)
+            if last_login:
+                times.append(last_login)
+
+            cpu = 0.0
+            last = self.__last_ticks.get(uid)
+            self.__last_ticks[uid] = (ticks.get(uid, 0), now)
+            if last is not None and now > last[1]:
+                cpu = (
+                    max(0, ticks.get(uid, 0) - last[0])
+                    / ProcessInspector.CLOCK_TICKS
+                    / (now - last[1])
+                )
+
+            activity[username] = {
+                "sessions": len(user_sessions),
+                "activity_time": max(times) if times else None,
+                "cpu": cpu,
+            }
+
+        for uid in set(self.__last_ticks) - set(users):
+            del self.__last_ticks[uid]
+        return activity
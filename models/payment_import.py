@@ -0,0 +1,282 @@
+import csv
+import re
+
+from sqlalchemy import select
+
+from models import exchange_rates, storage
+from models.misc import Utilities
+from models.money import BASE_CURRENCY, MINOR_UNITS, Money
+from models.payments import Payment
+from models.users import User
+
+
+class PaymentImporter:
+    """
+    Imports the payments of a bank or UPI statement exported as CSV.
+
+    Each row is matched to a user by its username column, or else by a username found in
+    its reference (e.g. the remarks of a UPI transfer), and is rejected if its transaction
+    ID was seen before, in the file or in an earlier import. The accepted rows are then
+    credited through `Payment` and `User.update_balance`, all in a single transaction.
+    """
+
+    # Header names each field is recognized by, compared case-insensitively
+    COLUMNS = {
+        "transaction_id": (
+            "transaction_id",
+            "transaction id",
+            "txn_id",
+            "txn id",
+            "utr",
+            "rrn",
+            "reference_no",
+            "reference no",
+        ),
+        "username": ("username", "user"),
+        "reference": ("reference", "remarks", "note", "narration", "description"),
+        "amount": ("amount", "credit", "credit_amount", "credit amount"),
+        "currency": ("currency",),
+        "date": ("date", "payment_date", "transaction_date", "txn date", "value date"),
+    }
+    DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+    # Transaction IDs looked up per query
+    LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the CSV file.
+        """
+        self.path = path
+        self.header = []
+        # (line number, values, user ID, amount, currency, transaction ID, payment date)
+        # of the accepted rows
+        self.rows = []
+        # (line number, values, error) of the rejected rows
+        self.errors = []
+        self.imported = 0
+        self.total = Money(0, BASE_CURRENCY)
+        self.users = {}
+
+    def __columns(self):
+        """
+        Returns:
+            dict: The index of each field's column in the header, by field.
+
+        Raises:
+            ValueError: If the transaction ID, amount or both user columns are missing.
+        """
+        names = [name.strip().lower() for name in self.header]
+        columns = {}
+        for field, aliases in self.COLUMNS.items():
+            for alias in aliases:
+                if alias in names:
+                    columns[field] = names.index(alias)
+                    break
+        if "transaction_id" not in columns or "amount" not in columns:
+            raise ValueError("The CSV needs a transaction ID and an amount column.")
+        if "username" not in columns and "reference" not in columns:
+            raise ValueError("The CSV needs a username or a reference column.")
+        return columns
+
+    def __parse_date(self, value):
+        """
+        Returns:
+            int: The epoch timestamp of a date in one of `DATE_FORMATS`.
+
+        Raises:
+            ValueError: If the date isn't in any of them.
+        """
+        for date_format in self.DATE_FORMATS:
+            try:
+                return Utilities.parse_date(value, date_format)
+            except ValueError:
+                continue
+        raise ValueError(f"Invalid date `{value}`.")
+
+    def parse(self):
+        """
+        Read the file row by row, matching rows to users and rejecting invalid and duplicate
+        ones. Blocking, meant to be run in a worker thread, with a database session of its
+        own that is closed once done.
+
+        Raises:
+            ValueError: If the file is empty or a required column is missing.
+        """
+        try:
+            usernames = dict(
+                storage.execute(
+                    select(User.linux_username, User.id).where(User.deleted == 0)
+                ).all()
+            )
+
+            seen = set()
+            with open(self.path, newline="", encoding="utf-8-sig") as file:
+                reader = csv.reader(file)
+                self.header = next(reader, None)
+                if not self.header:
+                    raise ValueError("The CSV is empty.")
+                columns = self.__columns()
+
+                def field(values, name):
+                    index = columns.get(name)
+                    if index is None or index >= len(values):
+                        return ""
+                    return values[index].strip()
+
+                for values in reader:
+                    if not any(values):
+                        continue
+                    try:
+                        transaction_id = field(values, "transaction_id")
+                        if not transaction_id:
+                            raise ValueError("Missing transaction ID.")
+                        if transaction_id in seen:
+                            raise ValueError("Duplicate transaction ID in the file.")
+                        seen.add(transaction_id)
+
+                        currency = field(values, "currency").upper() or BASE_CURRENCY
+                        if currency not in MINOR_UNITS:
+                            raise ValueError(f"Unsupported currency `{currency}`.")
+                        # Drop thousands separators and currency symbols, e.g. "₹1,499.00"
+                        amount = re.sub(r"[^\d.\-]", "", field(values, "amount"))
+                        if Money.from_major(amount, currency).minor <= 0:
+                            raise ValueError("The amount isn't positive.")
+
+                        username = field(values, "username")
+                        if not username:
+                            tokens = set(
+                                re.findall(
+                                    r"[a-z_][a-z0-9_-]*",
+                                    field(values, "reference").lower(),
+                                )
+                            )
+                            matches = tokens & usernames.keys()
+                            if len(matches) > 1:
+                                raise ValueError(
+                                    f"The reference matches several users: "
+                                    f"{', '.join(sorted(matches))}."
+                                )
+                            username = matches.pop() if matches else ""
+                        if username not in usernames:
+                            raise ValueError(
+                                f"User `{username}` not found."
+                                if username
+                                else "No user matched."
+                            )
+
+                        date = field(values, "date")
+                        payment_date = self.__parse_date(date) if date else None
+                    except ValueError as e:
+                        self.errors.append((reader.line_num, values, str(e)))
+                        continue
+
+                    self.rows.append(
+                        (
+                            reader.line_num,
+                            values,
+                            usernames[username],
+                            amount,
+                            currency,
+                            transaction_id,
+                            payment_date,
+                        )
+                    )
+
+            self.__reject_imported()
+        finally:
+            # The session of the thread the file was parsed in
+            storage.close()
+
+    def __reject_imported(self):
+        """
+        Reject the rows whose transaction ID was already imported.
+        """
+        transaction_ids = [row[5] for row in self.rows]
+        imported = set()
+        for start in range(0, len(transaction_ids), self.LOOKUP_BATCH_SIZE):
+            imported.update(
+                storage.execute(
+                    select(Payment.transaction_id).where(
+                        Payment.transaction_id.in_(
+                            transaction_ids[start : start + self.LOOKUP_BATCH_SIZE]
+                        )
+                    )
+                ).scalars()
+            )
+        if not imported:
+            return
+
+        rows = []
+        for row in self.rows:
+            if row[5] in imported:
+                self.errors.append((row[0], row[1], "Already imported."))
+            else:
+                rows.append(row)
+        self.rows = rows
+
+    async def apply(self):
+        """
+        Credit the accepted rows to their users, converting amounts to `BASE_CURRENCY` at the
+        cached exchange rates. All payments are committed together, or none at all.
+
+        Raises:
+            ValueError: If an exchange rate isn't available.
+        """
+        # Any unavailable rate fails the import before anything changes
+        for currency in {row[4] for row in self.rows}:
+            await exchange_rates.get_rate(currency, BASE_CURRENCY)
+
+        try:
+            # In a transaction of its own, committed before the command reports the result
+            async with storage.unit_of_work(separate=True):
+                await self.__credit()
+        except Exception:
+            self.total = Money(0, BASE_CURRENCY)
+            raise
+        self.imported = len(self.rows)
+
+    async def __credit(self):
+        """
+        Add the payments of the accepted rows and credit them to their users.
+        """
+        user_ids = list({row[2] for row in self.rows})
+        for start in range(0, len(user_ids), self.LOOKUP_BATCH_SIZE):
+            for user in storage.query(User).filter(
+                User.id.in_(user_ids[start : start + self.LOOKUP_BATCH_SIZE])
+            ):
+                self.users[user.id] = user
+
+        for (
+            _,
+            _,
+            user_id,
+            amount,
+            currency,
+            transaction_id,
+            payment_date,
+        ) in self.rows:
+            payment = await Payment.create(
+                user_id, amount, currency, transaction_id=transaction_id
+            )
+            if payment_date is not None:
+                payment.payment_date = payment_date
+            # Added before its ledger entries, which refer to it
+            storage.new(payment)
+            await self.users[user_id].update_balance(
+                payment.amount, "credit", payment_id=payment.id
+            )
+            self.total += payment.amount
+
+    def write_errors(self, file):
+        """
+        Write the rejected rows as CSV, with the reason each was rejected.
+
+        Args:
+            file: The text file to write to.
+        """
+        writer = csv.writer(file)
+        writer.writerow(["line", *self.header, "error"])
+        for line, values, error in sorted(self.errors, key=lambda error: error[0]):
+            values = values + [""] * (len(self.header) - len(values))
+            writer.writerow([line, *values[: len(self.header)], error])
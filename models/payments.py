@@ -1,9 +1,20 @@
 import time
 
-from sqlalchemy import REAL, CheckConstraint, Column, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    REAL,
+    BigInteger,
+    CheckConstraint,
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+)
 from sqlalchemy.orm import relationship
 
 from models.baseModel import Base, BaseModel
+from models.money import BASE_CURRENCY, Money
 
 
 class Payment(BaseModel, Base):
@@ -12,22 +23,34 @@ class Payment(BaseModel, Base):
 
     Attributes:
         user_id (str): The ID of the user making the payment, linked to the Users table.
-        amount (float): The payment amount.
+        amount (Money): The payment amount, stored in minor units (`amount_minor`).
         currency (str): The currency of the payment, restricted to 'INR' or 'USD'.
         payment_date (int): The timestamp of when the payment was made.
+        exchange_rate (float): The rate the amount was converted to INR at.
+        transaction_id (str): The bank or UPI transaction ID of imported payments, unique.
         user (relationship): Relationship to the User table for retrieving user details.
     """
 
     __tablename__ = "payments"
+    __table_args__ = (
+        # Imported statements are checked against it for payments already imported
+        Index("ix_payments_transaction_id", "transaction_id", unique=True),
+    )
 
     user_id = Column(
-        String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        String(36),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
-    amount = Column(REAL, nullable=False)
+    amount_minor = Column("amount", BigInteger, nullable=False)
     currency = Column(
         Text, CheckConstraint("currency IN ('INR', 'USD')"), nullable=False
     )
     payment_date = Column(Integer, nullable=False)
+    # Rate the amount was converted to INR at, 1 for payments made in INR
+    exchange_rate = Column(REAL, nullable=True)
+    transaction_id = Column(String(64), default=None)
 
     # Relationships
     user = relationship("User", back_populates="payments")
@@ -44,31 +67,45 @@ class Payment(BaseModel, Base):
         """
         super().__init__(**kwargs)
         self.user_id = user_id
-        self.amount = float(amount)
         self.currency = currency
+        self.amount = Money.from_major(amount, currency)
         self.payment_date = int(time.time())
 
+    @property
+    def amount(self):
+        """
+        Returns:
+            Money: The payment amount.
+        """
+        return Money(self.amount_minor, self.currency)
+
+    @amount.setter
+    def amount(self, value):
+        if not isinstance(value, Money):
+            value = Money.from_major(value, self.currency or BASE_CURRENCY)
+        self.amount_minor = value.minor
+
     async def process_payment(self):
         """
         Converts the payment amount to INR if needed and updates the amount.
         Returns the converted amount for verification or further use.
 
         Returns:
-            float: The converted payment amount in INR.
+            Money: The converted payment amount in INR.
 
         Raises:
             ValueError: If the currency is not supported.
         """
         if self.currency == "USD":
-            from models.misc import Utilities
+            from models import exchange_rates
 
-            exchange_rate = await Utilities.get_exchange_rate("USD", "INR")
-            self.amount = self.amount * exchange_rate
+            self.exchange_rate = await exchange_rates.get_rate("USD", "INR")
+            self.amount = self.amount.convert(self.exchange_rate, "INR")
             self.currency = "INR"  # Normalize to INR
 
         elif self.currency == "INR":
             # No conversion needed
-            pass
+            self.exchange_rate = 1.0
 
         else:
             raise ValueError("Unsupported currency")
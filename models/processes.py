@@ -0,0 +1,227 @@
+import os
+import struct
+
+from resources.constants import DEV_ROOT, LASTLOG_PATH, PROC_ROOT, UTMP_PATH
+
+
+class ProcessInspector:
+    """
+    Reads process information straight from the proc filesystem.
+    The proc root is configurable (`PROC_ROOT`) so the inspector can be pointed at a fake tree.
+    """
+
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+    @classmethod
+    def iter_pids(cls):
+        """
+        Iterate over the IDs of all running processes.
+
+        Yields:
+            int: A process ID.
+        """
+        try:
+            entries = os.listdir(PROC_ROOT)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.isdigit():
+                yield int(entry)
+
+    @classmethod
+    def get_user_pids(cls, uid):
+        """
+        Get the IDs of all processes owned by a user.
+        The owner of the `/proc/<pid>` directory is the effective UID of the process,
+        which avoids parsing `/proc/<pid>/status` for every process on the host.
+
+        Args:
+            uid (int): The UID of the user.
+
+        Returns:
+            list[int]: The process IDs owned by the user.
+        """
+        pids = []
+        for pid in cls.iter_pids():
+            try:
+                if os.stat(os.path.join(PROC_ROOT, str(pid))).st_uid == uid:
+                    pids.append(pid)
+            except OSError:
+                # The process exited while we were scanning
+                continue
+        return pids
+
+    @classmethod
+    def get_process_stats(cls, pid):
+        """
+        Get the CPU time and resident memory of a process from `/proc/<pid>/stat`.
+
+        Args:
+            pid (int): The process ID.
+
+        Returns:
+            tuple: (cpu_seconds, rss_bytes), or None if the process no longer exists.
+        """
+        try:
+            with open(os.path.join(PROC_ROOT, str(pid), "stat"), "r") as f:
+                stat = f.read()
+        except OSError:
+            return None
+
+        # The command name may contain spaces and parentheses,
+        # so the remaining fields are taken after its closing parenthesis.
+        fields = stat[stat.rfind(")") + 2 :].split()
+        try:
+            utime, stime, rss = int(fields[11]), int(fields[12]), int(fields[21])
+        except (IndexError, ValueError):
+            return None
+        return (utime + stime) / cls.CLOCK_TICKS, rss * cls.PAGE_SIZE
+
+    @classmethod
+    def get_usage(cls, pids):
+        """
+        Get the combined CPU time and resident memory of a set of processes.
+
+        Args:
+            pids (list[int]): The process IDs.
+
+        Returns:
+            tuple: (cpu_seconds, rss_bytes) summed over the processes that still exist.
+        """
+        cpu_seconds, rss_bytes = 0.0, 0
+        for pid in pids:
+            stats = cls.get_process_stats(pid)
+            if stats:
+                cpu_seconds += stats[0]
+                rss_bytes += stats[1]
+        return cpu_seconds, rss_bytes
+
+    @classmethod
+    def get_alive_pids(cls, pids):
+        """
+        Filter a set of processes down to the ones that are still running.
+        Zombies are treated as gone since they no longer hold any resources.
+
+        Args:
+            pids (list[int]): The process IDs.
+
+        Returns:
+            list[int]: The process IDs that are still running.
+        """
+        alive = []
+        for pid in pids:
+            try:
+                with open(os.path.join(PROC_ROOT, str(pid), "stat"), "r") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            if stat[stat.rfind(")") + 2 :].split()[:1] != ["Z"]:
+                alive.append(pid)
+        return alive
+
+    @classmethod
+    def get_cpu_ticks_by_uid(cls, uids):
+        """
+        Get the total CPU time of the running processes of each user in a single pass over /proc.
+        Only processes owned by the given users have their stat file read, keeping a sample cheap.
+
+        Args:
+            uids (set[int]): The UIDs to sample.
+
+        Returns:
+            dict: A mapping of UID to the combined user and system CPU time in clock ticks.
+        """
+        ticks = dict.fromkeys(uids, 0)
+        for pid in cls.iter_pids():
+            path = os.path.join(PROC_ROOT, str(pid))
+            try:
+                uid = os.stat(path).st_uid
+                if uid not in ticks:
+                    continue
+                with open(os.path.join(path, "stat"), "r") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            fields = stat[stat.rfind(")") + 2 :].split()
+            try:
+                ticks[uid] += int(fields[11]) + int(fields[12])
+            except (IndexError, ValueError):
+                continue
+        return ticks
+
+
+class SessionInspector:
+    """
+    Reads login sessions from utmp and last login times from lastlog,
+    the same sources `w` and `lastlog` use. All paths are configurable.
+    """
+
+    # struct utmp on Linux (glibc, 64-bit): type, pid, line, id, user, host,
+    # exit status, session, login time (sec, usec), address, padding.
+    UTMP_STRUCT = struct.Struct("<h2xi32s4s32s256shhiii16s20s")
+    # struct lastlog: login time, line, host
+    LASTLOG_STRUCT = struct.Struct("<i32s256s")
+    USER_PROCESS = 7
+
+    @classmethod
+    def get_sessions(cls):
+        """
+        Get the login sessions of all users from utmp.
+        Entries whose session leader is gone are skipped.
+
+        Returns:
+            list[dict]: The sessions, each with `username`, `line`, `host`,
+                `login_time` and `input_time` (last tty input, like `w`'s IDLE column).
+        """
+        try:
+            with open(UTMP_PATH, "rb") as f:
+                data = f.read()
+        except OSError:
+            return []
+
+        sessions = []
+        size = cls.UTMP_STRUCT.size
+        for offset in range(0, len(data) - size + 1, size):
+            record = cls.UTMP_STRUCT.unpack_from(data, offset)
+            ut_type, pid, line, _, user, host, _, _, _, login_time = record[:10]
+            if ut_type != cls.USER_PROCESS:
+                continue
+            if not os.path.exists(os.path.join(PROC_ROOT, str(pid))):
+                continue
+            line = line.rstrip(b"\0").decode(errors="replace")
+            try:
+                input_time = int(os.stat(os.path.join(DEV_ROOT, line)).st_atime)
+            except OSError:
+                input_time = login_time
+            sessions.append(
+                {
+                    "username": user.rstrip(b"\0").decode(errors="replace"),
+                    "line": line,
+                    "host": host.rstrip(b"\0").decode(errors="replace"),
+                    "login_time": login_time,
+                    "input_time": max(input_time, login_time),
+                }
+            )
+        return sessions
+
+    @classmethod
+    def get_last_login(cls, uid):
+        """
+        Get the last login time of a user from lastlog.
+
+        Args:
+            uid (int): The UID of the user.
+
+        Returns:
+            int: The last login time as a Unix timestamp, or None if unknown.
+        """
+        try:
+            with open(LASTLOG_PATH, "rb") as f:
+                f.seek(uid * cls.LASTLOG_STRUCT.size)
+                record = f.read(cls.LASTLOG_STRUCT.size)
+        except OSError:
+            return None
+        if len(record) < cls.LASTLOG_STRUCT.size:
+            return None
+        return cls.LASTLOG_STRUCT.unpack(record)[0] or None
@@ -1,11 +1,12 @@
 import time
 
 from sqlalchemy import (
-    DECIMAL,
     REAL,
+    BigInteger,
     CheckConstraint,
     Column,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -13,6 +14,8 @@ from sqlalchemy import (
 from sqlalchemy.orm import relationship
 
 from models.baseModel import Base, BaseModel
+from models.money import BASE_CURRENCY, Money
+from resources.constants import DEFAULT_PLAN_TIER, PLAN_TIERS
 
 
 class Rental(BaseModel, Base):
@@ -29,12 +32,28 @@ class Rental(BaseModel, Base):
         start_time (int): Unix timestamp indicating the start of the rental.
         end_time (int): Unix timestamp indicating the end of the rental.
         plan_duration (int): Duration of the rental plan in seconds.
-        amount (float): Amount paid for the rental.
+        amount (Money): Amount paid for the rental, stored in minor units (`amount_minor`).
         currency (str): Currency used for payment ("INR" or "USD").
         is_expired (int): Indicates if the rental has expired (0 for no, 1 for yes).
         is_active (int): Indicates if the rental is active (0 for no, 1 for yes).
         sent_expiry_notification (int): Indicates if the expiry notification has been sent (0 for no, 1 for yes).
-        price_rate (float): Price rate applied to the rental.
+        price_rate (Money): Daily price in `BASE_CURRENCY` applied to the rental,
+            stored in minor units (`price_rate_minor`).
+        plan_tier (str): Name of the plan tier the resource limits were taken from.
+        cpu_weight (int): cgroup `cpu.weight` of the rental's slice.
+        cpu_max (int): CPU quota as a percentage of a single CPU (None for unlimited).
+        memory_max (int): Memory limit in bytes (None for unlimited).
+        io_max (int): Read/write bandwidth limit in bytes per second (None for unlimited).
+        reaped_processes (int): Number of processes terminated when the rental expired.
+        reaped_cpu_seconds (float): CPU time consumed by the processes terminated on expiry.
+        reaped_memory (int): Resident memory in bytes reclaimed on expiry.
+        last_active_at (int): Unix timestamp of the last observed tenant activity.
+        is_idle (int): Indicates if the rental is idle (0 for no, 1 for yes).
+        idle_since (int): Unix timestamp of when the rental was marked idle.
+        is_suspended (int): Indicates if the processes of the idle rental are frozen (0 for no, 1 for yes).
+        resumed_at (int): Unix timestamp of when the rental last became active again.
+        suspended_memory (int): Resident memory in bytes held by the processes when they were frozen.
+        reclaimed_memory (int): Memory in bytes the kernel reclaimed from the frozen processes.
 
     Relationships:
         user: Relationship linking to the User table.
@@ -42,6 +61,11 @@ class Rental(BaseModel, Base):
     """
 
     __tablename__ = "rentals"
+    __table_args__ = (
+        # Listing and expiry lookups filter on is_active and order by end_time
+        Index("ix_rentals_active_end_time", "is_active", "end_time", "id"),
+        Index("ix_rentals_user_id", "user_id"),
+    )
 
     user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     telegram_user = Column(
@@ -52,7 +76,7 @@ class Rental(BaseModel, Base):
     start_time = Column(Integer, nullable=False)
     end_time = Column(Integer, nullable=False)
     plan_duration = Column(Integer, nullable=False)
-    amount = Column(DECIMAL, nullable=False)
+    amount_minor = Column("amount", BigInteger, nullable=False)
     currency = Column(
         Text, CheckConstraint("currency IN ('INR', 'USD')"), nullable=False
     )
@@ -61,13 +85,156 @@ class Rental(BaseModel, Base):
     sent_expiry_notification = Column(
         Integer, CheckConstraint("sent_expiry_notification IN (0, 1)"), default=0
     )
-    price_rate = Column(REAL, nullable=False)
+    price_rate_minor = Column("price_rate", BigInteger, nullable=False)
     is_zombie = Column(Integer, CheckConstraint("is_zombie IN (0, 1)"), default=0)
+    plan_tier = Column(Text, default=DEFAULT_PLAN_TIER)
+    cpu_weight = Column(Integer, default=None)
+    cpu_max = Column(Integer, default=None)
+    memory_max = Column(BigInteger, default=None)
+    io_max = Column(BigInteger, default=None)
+    reaped_processes = Column(Integer, default=0)
+    reaped_cpu_seconds = Column(REAL, default=0)
+    reaped_memory = Column(BigInteger, default=0)
+    last_active_at = Column(Integer, default=None)
+    is_idle = Column(Integer, CheckConstraint("is_idle IN (0, 1)"), default=0)
+    idle_since = Column(Integer, default=None)
+    is_suspended = Column(Integer, CheckConstraint("is_suspended IN (0, 1)"), default=0)
+    resumed_at = Column(Integer, default=None)
+    suspended_memory = Column(BigInteger, default=0)
+    reclaimed_memory = Column(BigInteger, default=0)
 
     # Relationships
     user = relationship("User", back_populates="rentals")
     tguser = relationship("TelegramUser")
 
+    @property
+    def amount(self):
+        """
+        Returns:
+            Money: The amount paid for the rental.
+        """
+        return Money(self.amount_minor, self.currency)
+
+    @amount.setter
+    def amount(self, value):
+        if not isinstance(value, Money):
+            value = Money.from_major(value, self.currency or BASE_CURRENCY)
+        self.amount_minor = value.minor
+
+    @property
+    def price_rate(self):
+        """
+        Returns:
+            Money: The daily price of the rental.
+        """
+        return Money(self.price_rate_minor, BASE_CURRENCY)
+
+    @price_rate.setter
+    def price_rate(self, value):
+        if not isinstance(value, Money):
+            value = Money.from_major(value, BASE_CURRENCY)
+        self.price_rate_minor = value.minor
+
+    @staticmethod
+    def get_tier_limits(tier=None):
+        """
+        Get the resource limits configured for a plan tier.
+
+        Args:
+            tier (str): The name of the plan tier. Defaults to `DEFAULT_PLAN_TIER`.
+
+        Returns:
+            dict: The resource limits (`cpu_weight`, `cpu_max`, `memory_max`, `io_max`).
+
+        Raises:
+            ValueError: If the plan tier is unknown.
+        """
+        tier = (tier or DEFAULT_PLAN_TIER).lower()
+        if tier not in PLAN_TIERS:
+            raise ValueError(
+                f"Unknown plan tier '{tier}'. Available tiers: {', '.join(PLAN_TIERS)}"
+            )
+        return dict(PLAN_TIERS[tier])
+
+    def apply_plan_tier(self, tier=None):
+        """
+        Store the plan tier and its resource limits on the rental.
+        The changes are not committed, the caller is responsible for saving them.
+
+        Args:
+            tier (str): The name of the plan tier. Defaults to `DEFAULT_PLAN_TIER`.
+
+        Raises:
+            ValueError: If the plan tier is unknown.
+        """
+        limits = self.get_tier_limits(tier)
+        self.plan_tier = (tier or DEFAULT_PLAN_TIER).lower()
+        for key, value in limits.items():
+            setattr(self, key, value)
+
+    @property
+    def resource_limits(self):
+        """
+        The resource limits stored on the rental.
+        Rentals created before plan tiers existed fall back to their tier's defaults.
+
+        Returns:
+            dict: The resource limits (`cpu_weight`, `cpu_max`, `memory_max`, `io_max`).
+        """
+        if self.cpu_weight is None:
+            return self.get_tier_limits(self.plan_tier)
+        return {
+            "cpu_weight": self.cpu_weight,
+            "cpu_max": self.cpu_max,
+            "memory_max": self.memory_max,
+            "io_max": self.io_max,
+        }
+
+    def record_reaped_usage(self, reaped):
+        """
+        Record the resources reclaimed by terminating the rental's processes.
+        The changes are not committed, the caller is responsible for saving them.
+
+        Args:
+            reaped (dict): The result of `SystemUserManager.terminate_user_processes`.
+        """
+        self.reaped_processes = (self.reaped_processes or 0) + reaped["processes"]
+        self.reaped_cpu_seconds = (self.reaped_cpu_seconds or 0) + reaped["cpu_seconds"]
+        self.reaped_memory = (self.reaped_memory or 0) + reaped["memory_bytes"]
+
+    def mark_idle(self, suspended=False, memory=0, reclaimed=0):
+        """
+        Record that the rental became idle.
+        The changes are not committed, the caller is responsible for saving them.
+
+        Args:
+            suspended (bool): Whether the rental's processes were frozen.
+            memory (int): Resident memory in bytes held by the processes.
+            reclaimed (int): Memory in bytes the kernel reclaimed after freezing.
+        """
+        self.is_idle = 1
+        self.idle_since = int(time.time())
+        self.is_suspended = int(suspended)
+        self.suspended_memory = memory if suspended else 0
+        self.reclaimed_memory = reclaimed if suspended else 0
+
+    def mark_active(self, activity_time=None):
+        """
+        Record tenant activity, resuming the rental if it was idle.
+        The changes are not committed, the caller is responsible for saving them.
+
+        Args:
+            activity_time (int): Unix timestamp of the activity. Defaults to now.
+        """
+        now = int(time.time())
+        self.last_active_at = max(self.last_active_at or 0, activity_time or now)
+        if self.is_idle:
+            self.is_idle = 0
+            self.is_suspended = 0
+            self.resumed_at = now
+            self.suspended_memory = 0
+            self.reclaimed_memory = 0
+
     async def modify_plan_duration(self, duration_change_seconds, action="reduced"):
         """
         Modifies the rental plan duration by adjusting the end time.
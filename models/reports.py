@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sys
+
+from sqlalchemy import func, select
+
+from models import metrics, storage
+from models.misc import Utilities
+from models.money import Money
+from models.payments import Payment
+from models.rentals import Rental
+from models.users import User
+from resources.constants import REPORT_WORKERS
+
+RENDER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "engine", "report_render.py"
+)
+
+
+def format_rows(users):
+    """
+    Format the rows of the report for the template.
+
+    Args:
+        users (list[tuple]): The rows returned by `ReportRenderer.query_users`.
+
+    Returns:
+        list[dict]: The rows, JSON serializable.
+    """
+    return [
+        {
+            "user_id": user_id,
+            "username": username,
+            "creation_ist": Utilities.get_date_str(int(created_at.timestamp())),
+            "expiry_ist": Utilities.get_date_str(end_time),
+            "is_active": is_active,
+            "total_payment": f"{Money(total_payment, currency):.2f}",
+            "currency": currency,
+            "payment_count": payment_count,
+        }
+        for (
+            user_id,
+            username,
+            created_at,
+            end_time,
+            is_active,
+            total_payment,
+            payment_count,
+            currency,
+        ) in users
+    ]
+
+
+class ReportRenderer:
+    """
+    Renders the user payments report in worker processes, so the event loop keeps
+    handling other commands while WeasyPrint lays out the PDF.
+
+    Each PDF is rendered by `models/engine/report_render.py` in a fresh interpreter. Forking
+    the bot instead would copy its threads' locks, database pool and Telegram connection into
+    the worker, and a spawned multiprocessing worker would import `main` and the `models`
+    package again.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS):
+        """
+        Args:
+            workers (int): The number of PDFs rendered concurrently.
+        """
+        self.__workers = asyncio.Semaphore(workers)
+
+    @staticmethod
+    def query_users():
+        """
+        Fetch the columns of the report in a single query, with the payments aggregated
+        by the database instead of loading every user, rental and payment object.
+
+        Returns:
+            list[tuple]: The ID, username, creation time, first rental's end time and state,
+                total and number of payments and first payment's currency of every user
+                with a rental and a payment.
+        """
+        totals = (
+            select(
+                Payment.user_id,
+                func.sum(Payment.amount_minor).label("total"),
+                func.count(Payment.id).label("count"),
+            )
+            .group_by(Payment.user_id)
+            .subquery()
+        )
+
+        def first(column, cls):
+            return (
+                select(column)
+                .where(cls.user_id == User.id)
+                .order_by(cls.created_at)
+                .limit(1)
+                .scalar_subquery()
+            )
+
+        return (
+            storage.query(
+                User.id,
+                User.linux_username,
+                User.created_at,
+                first(Rental.end_time, Rental),
+                first(Rental.is_active, Rental),
+                totals.c.total,
+                totals.c.count,
+                first(Payment.currency, Payment),
+            )
+            .join(totals, totals.c.user_id == User.id)
+            .filter(User.rentals.any())
+            .order_by(User.created_at)
+            .all()
+        )
+
+    @classmethod
+    def __load_rows(cls):
+        """
+        Returns:
+            bytes: The rows of the report as JSON, for the renderer.
+        """
+        try:
+            return json.dumps(format_rows(cls.query_users())).encode()
+        finally:
+            storage.close()
+
+    async def render(self):
+        """
+        Render the report of all users.
+
+        Returns:
+            bytes: The PDF document.
+
+        Raises:
+            RuntimeError: If the renderer failed.
+        """
+        rows = await metrics.to_thread("db", self.__load_rows)
+        async with self.__workers:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                RENDER_SCRIPT,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            pdf, error = await process.communicate(rows)
+        if process.returncode:
+            raise RuntimeError(
+                f"Rendering the report failed: {error.decode(errors='replace').strip()}"
+            )
+        return pdf
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+
+class ResultCache:
+    """
+    Single-flight cache for the results of expensive computations, e.g. rendering a report
+    or walking the home directories.
+
+    Concurrent callers asking for the same key share one computation instead of each
+    running their own. A result is reused until its TTL runs out or, for results derived
+    from the database, until the data version it was computed at (`storage.version`,
+    incremented on every commit) changes.
+    """
+
+    def __init__(self):
+        # key -> (version, expiry time, result)
+        self.__results = {}
+        # key -> future of the computation in progress
+        self.__in_flight = {}
+        self.stats = dict.fromkeys(("hits", "misses", "coalesced"), 0)
+
+    async def get(self, key, compute, ttl, version=None):
+        """
+        Get the result of a computation, from the cache if possible.
+
+        Args:
+            key (str): Identifies the computation and its arguments.
+            compute (callable): The coroutine function computing the result, called without arguments.
+            ttl (float): The number of seconds the result can be reused for.
+            version (int): The data version the result depends on, None if it doesn't depend on the database.
+
+        Returns:
+            The result of the computation.
+
+        Raises:
+            Exception: Whatever the computation raised. Errors aren't cached, but are
+                shared with the callers that waited on the same computation.
+        """
+        cached = self.__results.get(key)
+        if cached and cached[0] == version and time.monotonic() < cached[1]:
+            self.stats["hits"] += 1
+            return cached[2]
+
+        future = self.__in_flight.get(key)
+        if future:
+            self.stats["coalesced"] += 1
+            # A caller giving up must not cancel the computation the others wait on
+            return await asyncio.shield(future)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.__in_flight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.__results[key] = (version, time.monotonic() + ttl, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self.__in_flight[key]
+
+    def invalidate(self, key=None):
+        """
+        Drop a cached result, or all of them.
+
+        Args:
+            key (str): The key of the result, all results if None.
+        """
+        if key is None:
+            self.__results.clear()
+        else:
+            self.__results.pop(key, None)
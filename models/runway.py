@@ -0,0 +1,70 @@
+import time
+
+from models.money import BASE_CURRENCY, Money
+from resources.constants import RUNWAY_WARNING_DAYS
+
+DAY = 86400
+
+
+class Runway:
+    """
+    Forecasts when a user's balance stops covering the daily charges of their rentals.
+
+    `JobManager.deduct_daily_rental` charges the daily price of the active rentals once a
+    day, the k-th next time at `last_deduction_time` + k days. Until the balance or the
+    plans change, the balance after each charge is known in advance, and so is the time
+    it drops below any number of days of runway.
+    """
+
+    # Days of runway left the tenant is warned at, 0 being when the balance no longer
+    # covers the next charge
+    WARNING_DAYS = tuple(sorted(set(RUNWAY_WARNING_DAYS) | {0}, reverse=True))
+
+    @classmethod
+    def forecast(cls, user, rentals, now=None):
+        """
+        Forecast the runway of a user.
+
+        Args:
+            user (User): The user.
+            rentals (iterable[Rental]): The user's rentals.
+            now (int): The current Unix timestamp, for testing.
+
+        Returns:
+            dict: The daily rate (Money), the number of daily charges the balance covers
+                (`days`), the time of the first charge it doesn't cover (`runs_out_at`),
+                the time the last active plan ends (`ends_at`) and, by days of runway,
+                the time the runway drops to it (`warnings`), if before the plans end.
+                None if the user has no active paid rental.
+        """
+        active = [
+            rental for rental in rentals if rental.is_active and not rental.is_expired
+        ]
+        rate = sum(int(rental.price_rate_minor or 0) for rental in active)
+        if rate <= 0:
+            return None
+
+        if now is None:
+            now = int(time.time())
+        days = max(int(user.balance_minor or 0), 0) // rate
+        last = user.last_deduction_time or now
+        ends_at = max(rental.end_time for rental in active)
+
+        def charge_time(charge):
+            # Charges missed while the bot was down are caught up on its next run
+            return max(last + charge * DAY, now)
+
+        warnings = {}
+        for warning_days in cls.WARNING_DAYS:
+            charges = days - warning_days
+            at = charge_time(charges) if charges > 0 else now
+            if at < ends_at:
+                warnings[warning_days] = at
+
+        return {
+            "daily_rate": Money(rate, BASE_CURRENCY),
+            "days": days,
+            "runs_out_at": charge_time(days + 1),
+            "ends_at": ends_at,
+            "warnings": warnings,
+        }
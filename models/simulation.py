@@ -0,0 +1,356 @@
+"""
+Revenue and capacity projections of the active rentals.
+
+Usable from the command line too, e.g. to write a year's projection to a CSV file:
+
+    python -m models.simulation --days 365 --renewal 0.7 --tier pro=0.9 --output projection.csv
+"""
+
+import argparse
+import csv
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from models import storage
+from models.money import BASE_CURRENCY, MINOR_UNITS
+from models.rentals import Rental
+from models.users import User
+from resources.constants import SIMULATION_DAYS, SIMULATION_RENEWAL_PROBABILITY
+
+HOUR = 3600
+DAY = 86400
+
+
+class Simulation:
+    """
+    Projects the expiries, daily deductions, renewals and host occupancy of the active
+    rentals over the next days, at hourly resolution.
+
+    Rentals are held in NumPy arrays and every step is vectorized over them: renewals are
+    drawn a round at a time for all the rentals expiring within the horizon, and the daily
+    deductions a day at a time for all the users. A year of 100k rentals takes about a second.
+    """
+
+    def __init__(self, end_time, duration, rate, user, balance, cpu, memory, tier):
+        """
+        Args:
+            end_time (np.ndarray): Unix timestamp the plan of each rental ends at.
+            duration (np.ndarray): Plan duration of each rental in seconds, renewals last as long.
+            rate (np.ndarray): Daily price of each rental, in minor units.
+            user (np.ndarray): Index of the user of each rental into `balance`.
+            balance (np.ndarray): Balance of each user, in minor units.
+            cpu (np.ndarray): CPU quota of each rental in cores, 0 for unlimited.
+            memory (np.ndarray): Memory limit of each rental in bytes, 0 for unlimited.
+            tier (np.ndarray): Plan tier of each rental.
+        """
+        self.end_time = end_time.astype(np.int64)
+        self.duration = duration.astype(np.int64)
+        self.rate = rate.astype(np.float64)
+        self.user = user.astype(np.int64)
+        self.balance = balance.astype(np.float64)
+        self.cpu = cpu.astype(np.float64)
+        self.memory = memory.astype(np.float64)
+        self.tier = tier
+
+    @classmethod
+    def load(cls):
+        """
+        Load the active rentals and the balances of their users. Blocking, with the database
+        session of the calling thread, which is closed once done.
+
+        Returns:
+            Simulation: The simulation of the active rentals.
+        """
+        try:
+            rows = storage.execute(
+                select(
+                    Rental.end_time,
+                    Rental.plan_duration,
+                    Rental.price_rate_minor,
+                    Rental.user_id,
+                    User.balance_minor,
+                    Rental.cpu_max,
+                    Rental.memory_max,
+                    Rental.plan_tier,
+                )
+                .join(User, Rental.user_id == User.id)
+                .where(Rental.is_active == 1, Rental.is_expired == 0)
+            ).all()
+        finally:
+            storage.close()
+
+        columns = list(zip(*rows)) if rows else [()] * 8
+        end_time, duration, rate, user_id, balance, cpu, memory, tier = (
+            np.array(column, dtype=object) for column in columns
+        )
+        user_ids, first, user = np.unique(
+            user_id.astype(str), return_index=True, return_inverse=True
+        )
+
+        def numbers(values):
+            return np.array([value or 0 for value in values], dtype=np.float64)
+
+        return cls(
+            end_time=numbers(end_time),
+            duration=numbers(duration),
+            rate=numbers(rate),
+            user=user.reshape(-1),
+            balance=numbers(balance[first]),
+            # cpu_max is a percentage of a single CPU
+            cpu=numbers(cpu) / 100,
+            memory=numbers(memory),
+            tier=tier.astype(str),
+        )
+
+    def run(
+        self,
+        days=SIMULATION_DAYS,
+        renewal_probability=SIMULATION_RENEWAL_PROBABILITY,
+        tier_probabilities=None,
+        deduction_hour=6,
+        now=None,
+        seed=None,
+    ):
+        """
+        Project the rentals over the next days.
+
+        Args:
+            days (int): The number of days to project.
+            renewal_probability (float): The probability a plan is renewed when it ends.
+            tier_probabilities (dict): Renewal probabilities of plan tiers, overriding the default.
+            deduction_hour (int): The hour of the day the daily charges are deducted at.
+            now (int): The Unix timestamp to start at, now if None.
+            seed (int): Seed of the random renewals, for reproducible projections.
+
+        Returns:
+            dict: Arrays with a value per hour: the start of the hour (`time`), the number
+                of active rentals (`tenants`), the CPU cores and memory bytes they're limited
+                to (`cpu`, `memory`), the renewal payments (`payments`), the charges deducted
+                (`charges`) and the charges that failed for lack of balance (`failed_charges`),
+                amounts in minor units.
+        """
+        rng = np.random.default_rng(seed)
+        if now is None:
+            now = int(time.time())
+        start = now - now % HOUR
+        hours = days * 24
+        horizon = start + hours * HOUR
+
+        probability = np.full(self.end_time.size, renewal_probability)
+        for tier, tier_probability in (tier_probabilities or {}).items():
+            probability[self.tier == tier] = tier_probability
+
+        # Renewals, a round at a time: each plan ending within the horizon is renewed for
+        # its duration with its probability, paid for at its daily price
+        end_time = self.end_time.copy()
+        price = self.rate * self.duration / DAY
+        payment_time, payment_amount, payment_user = [], [], []
+        pending = np.flatnonzero((end_time < horizon) & (self.duration > 0))
+        while pending.size:
+            renewed = pending[rng.random(pending.size) < probability[pending]]
+            payment_time.append(end_time[renewed])
+            payment_amount.append(price[renewed])
+            payment_user.append(self.user[renewed])
+            end_time[renewed] += self.duration[renewed]
+            pending = renewed[end_time[renewed] < horizon]
+        payment_time = np.concatenate(payment_time or [np.empty(0, np.int64)])
+        payment_amount = np.concatenate(payment_amount or [np.empty(0)])
+        payment_user = np.concatenate(payment_user or [np.empty(0, np.int64)])
+
+        # Occupancy: a rental counts from now until its last renewal ends
+        end_hour = np.clip(-((start - end_time) // HOUR), 0, hours)
+        active = end_time > start
+
+        def occupancy(weights=None):
+            ended = np.bincount(
+                end_hour[active],
+                weights=None if weights is None else weights[active],
+                minlength=hours + 1,
+            )
+            total = active.sum() if weights is None else weights[active].sum()
+            return total - np.cumsum(ended)[:hours]
+
+        payment_hour = np.clip((payment_time - start) // HOUR, 0, hours - 1)
+        payments = np.bincount(payment_hour, weights=payment_amount, minlength=hours)
+
+        # Deductions, a day at a time: the daily price of the active rentals of a user is
+        # deducted if the balance, with the renewals paid so far, covers it
+        first_deduction = datetime.fromtimestamp(start).replace(
+            hour=deduction_hour, minute=0, second=0, microsecond=0
+        )
+        if first_deduction.timestamp() < start:
+            first_deduction += timedelta(days=1)
+        order = np.argsort(payment_time, kind="stable")
+        payment_time, payment_amount, payment_user = (
+            payment_time[order],
+            payment_amount[order],
+            payment_user[order],
+        )
+        balance = self.balance.copy()
+        charges = np.zeros(hours)
+        failed_charges = np.zeros(hours, dtype=np.int64)
+        paid = 0
+        for day in range(days + 1):
+            deduction_time = int((first_deduction + timedelta(days=day)).timestamp())
+            if deduction_time >= horizon:
+                break
+            due = np.searchsorted(payment_time, deduction_time, side="right")
+            np.add.at(balance, payment_user[paid:due], payment_amount[paid:due])
+            paid = due
+
+            charged = end_time > deduction_time
+            charge = np.bincount(
+                self.user[charged],
+                weights=self.rate[charged],
+                minlength=balance.size,
+            )
+            covered = balance >= charge
+            balance -= np.where(covered, charge, 0)
+            hour = (deduction_time - start) // HOUR
+            charges[hour] = charge[covered].sum()
+            failed_charges[hour] = np.count_nonzero((charge > 0) & ~covered)
+
+        return {
+            "time": start + np.arange(hours, dtype=np.int64) * HOUR,
+            "tenants": occupancy().astype(np.int64),
+            "cpu": occupancy(self.cpu),
+            "memory": occupancy(self.memory),
+            "payments": payments,
+            "charges": charges,
+            "failed_charges": failed_charges,
+        }
+
+    @staticmethod
+    def write_csv(projection, file):
+        """
+        Write a projection as CSV, a row per hour, amounts in major units.
+
+        Args:
+            projection (dict): The projection, as returned by `run`.
+            file: The text file to write to.
+        """
+        minor_units = MINOR_UNITS[BASE_CURRENCY]
+        writer = csv.writer(file)
+        writer.writerow(
+            [
+                "time",
+                "tenants",
+                "cpu_cores",
+                "memory_gib",
+                "renewal_payments",
+                "charges",
+                "failed_charges",
+                "cumulative_payments",
+                "cumulative_charges",
+            ]
+        )
+        writer.writerows(
+            zip(
+                (
+                    datetime.fromtimestamp(timestamp).isoformat()
+                    for timestamp in projection["time"].tolist()
+                ),
+                projection["tenants"].tolist(),
+                np.round(projection["cpu"], 2).tolist(),
+                np.round(projection["memory"] / 1024**3, 2).tolist(),
+                np.round(projection["payments"] / minor_units, 2).tolist(),
+                np.round(projection["charges"] / minor_units, 2).tolist(),
+                projection["failed_charges"].tolist(),
+                np.round(np.cumsum(projection["payments"]) / minor_units, 2).tolist(),
+                np.round(np.cumsum(projection["charges"]) / minor_units, 2).tolist(),
+            )
+        )
+
+    @staticmethod
+    def sparkline(values, width=30):
+        """
+        Draw a series as a line of block characters, averaged down to at most `width` of them.
+
+        Args:
+            values (np.ndarray): The series.
+            width (int): The maximum number of characters.
+
+        Returns:
+            str: The sparkline.
+        """
+        if not values.size:
+            return ""
+        chunks = np.array_split(values.astype(np.float64), min(width, values.size))
+        means = np.array([chunk.mean() for chunk in chunks])
+        low, high = means.min(), means.max()
+        blocks = "▁▂▃▄▅▆▇█"
+        if high == low:
+            return blocks[0] * means.size
+        levels = ((means - low) / (high - low) * (len(blocks) - 1)).round().astype(int)
+        return "".join(blocks[level] for level in levels)
+
+
+def parse_tier_probabilities(options):
+    """
+    Parse renewal probabilities of plan tiers.
+
+    Args:
+        options (iterable[str]): Options of the form `tier=probability`, e.g. `pro=0.9`.
+
+    Returns:
+        dict: The probabilities, by tier.
+
+    Raises:
+        ValueError: If an option isn't of that form or a probability isn't between 0 and 1.
+    """
+    probabilities = {}
+    for option in options:
+        tier, _, probability = option.partition("=")
+        probability = float(probability)
+        if not tier or not 0 <= probability <= 1:
+            raise ValueError(f"Invalid renewal probability `{option}`.")
+        probabilities[tier] = probability
+    return probabilities
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Project the revenue and capacity of the active rentals."
+    )
+    parser.add_argument("--days", type=int, default=SIMULATION_DAYS)
+    parser.add_argument(
+        "--renewal",
+        type=float,
+        default=SIMULATION_RENEWAL_PROBABILITY,
+        help="probability a plan is renewed when it ends",
+    )
+    parser.add_argument(
+        "--tier",
+        action="append",
+        default=[],
+        metavar="TIER=PROBABILITY",
+        help="renewal probability of a plan tier",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="projection.csv")
+    args = parser.parse_args()
+
+    from models.commands.system import JobManager
+
+    started = time.perf_counter()
+    simulation = Simulation.load()
+    projection = simulation.run(
+        args.days,
+        args.renewal,
+        parse_tier_probabilities(args.tier),
+        JobManager.DEDUCTION_HOUR,
+        seed=args.seed,
+    )
+    with open(args.output, "w", newline="") as file:
+        Simulation.write_csv(projection, file)
+    print(
+        f"Projected {simulation.end_time.size} rentals over {args.days} days "
+        f"in {time.perf_counter() - started:.2f}s, written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ class TelegramUser(BaseModel, Base):
         String,
         ForeignKey("users.id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
         doc="Foreign key linking to the system user.",
     )
     tg_username = Column(
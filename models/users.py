@@ -1,9 +1,11 @@
 import time
 
-from sqlalchemy import UUID, Boolean, Column, Integer, String, Text
+from sqlalchemy import UUID, BigInteger, Boolean, Column, Integer, String, Text
 from sqlalchemy.orm import relationship
 
 from models.baseModel import Base, BaseModel
+from models.ledger import Ledger
+from models.money import BASE_CURRENCY, Money
 
 
 class User(BaseModel, Base):
@@ -14,15 +16,19 @@ class User(BaseModel, Base):
         uuid (Text): Unique identifier for the user.
         linux_username (Text): Linux system username for the user.
         linux_password (Text): Linux system password for the user.
-        balance (Integer): Current balance of the user, defaults to 0.
+        balance (Money): Current balance of the user in `BASE_CURRENCY`, defaults to 0.
+            Stored in minor units (`balance_minor`).
+        ledger_seq (int): Number of ledger transactions recorded for the user.
     """
 
     __tablename__ = "users"
 
     uuid = Column(String(36), unique=True, default=None)
-    linux_username = Column(Text, nullable=False)
+    linux_username = Column(Text, nullable=False, index=True)
     linux_password = Column(Text, nullable=False)
-    balance = Column(Integer, default=0)
+    balance_minor = Column("balance", BigInteger, default=0)
+    # Number of the user's last ledger transaction
+    ledger_seq = Column(Integer, default=0)
     last_deduction_time = Column(Integer, default=time.time())
     deleted = Column(Boolean, default=False)
 
@@ -33,13 +39,33 @@ class User(BaseModel, Base):
     rentals = relationship("Rental", back_populates="user", cascade="all, delete")
     payments = relationship("Payment", back_populates="user", cascade="all, delete")
 
-    async def update_balance(self, amount, transaction_type):
+    @property
+    def balance(self):
         """
-        Update the user's balance by recording a transaction.
+        Returns:
+            Money: The balance.
+        """
+        return Money(self.balance_minor, BASE_CURRENCY)
+
+    @balance.setter
+    def balance(self, value):
+        if not isinstance(value, Money):
+            value = Money.from_major(value, BASE_CURRENCY)
+        self.balance_minor = value.minor
+
+    async def update_balance(
+        self, amount, transaction_type, kind=None, payment_id=None, note=None
+    ):
+        """
+        Update the user's balance by recording a transaction in the ledger.
 
         Args:
-            amount (int): The amount to be credited or debited.
+            amount (Money): The amount to be credited or debited, negative for debits.
             transaction_type (str): The type of transaction ('credit' or 'debit').
+            kind (str): The kind of ledger transaction ('credit', 'refund', 'charge' or
+                'adjustment'), 'credit' for credits and 'charge' for debits by default.
+            payment_id (str): The ID of the payment the transaction records, if any.
+            note (str): A note stored with the ledger entries.
 
         Raises:
             ValueError: If an invalid transaction type is provided or if there
@@ -53,3 +79,7 @@ class User(BaseModel, Base):
             self.balance += amount
         else:
             raise ValueError("Invalid transaction type.")
+
+        if kind is None:
+            kind = "credit" if transaction_type == "credit" else "charge"
+        Ledger.post(self, amount, kind, payment_id=payment_id, note=note)
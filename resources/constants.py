@@ -47,8 +47,215 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 GROUP_ID = int(os.getenv("GROUP_ID", 0))
 EXCHANGE_API_ID = os.getenv("EXCHANGE_API_ID", "")
+EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "https://v6.exchangerate-api.com/v6")
+# Seconds the rates are reused for, and the API timeout
+EXCHANGE_RATE_TTL = int(os.getenv("EXCHANGE_RATE_TTL", 3600))
+EXCHANGE_API_TIMEOUT = float(os.getenv("EXCHANGE_API_TIMEOUT", 10))
+# Seconds between two attempts to reach the API while it's down
+EXCHANGE_RETRY_INTERVAL = int(os.getenv("EXCHANGE_RETRY_INTERVAL", 60))
 DB_STRING = os.getenv("DB_STRING")
 
+# cgroup v2 resource isolation
+# The root is configurable so the manager can be pointed at a fake directory tree.
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+CGROUP_PARENT = os.getenv("CGROUP_PARENT", "rentals")
+# Block device ("major:minor") that io.max limits apply to, e.g. "8:0". Empty disables io.max.
+CGROUP_IO_DEVICE = os.getenv("CGROUP_IO_DEVICE", "")
+# Seconds between sweeps moving tenant processes started outside their cgroup into it.
+# Logins are moved right away by the pam_exec hook in models/engine/cgroup_attach.py
+CGROUP_SWEEP_INTERVAL = int(os.getenv("CGROUP_SWEEP_INTERVAL", 60))
+PROC_ROOT = os.getenv("PROC_ROOT", "/proc")
+DEV_ROOT = os.getenv("DEV_ROOT", "/dev")
+UTMP_PATH = os.getenv("UTMP_PATH", "/var/run/utmp")
+LASTLOG_PATH = os.getenv("LASTLOG_PATH", "/var/log/lastlog")
+
+# Seconds expired tenants' processes get between SIGTERM and SIGKILL
+REAP_GRACE_PERIOD = int(os.getenv("REAP_GRACE_PERIOD", 10))
+
+# Home directory archival on user deletion
+HOME_ROOT = os.getenv("HOME_ROOT", "/home")
+ARCHIVE_ON_DELETE = os.getenv("ARCHIVE_ON_DELETE", "1") == "1"
+# Must be writable by the bot. Archives are named <username>-<timestamp>.tar.<ext>
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/var/backups/server-rentals")
+# "zstd", "pigz" or "gzip", the fastest installed one is used if empty
+ARCHIVE_COMPRESSOR = os.getenv("ARCHIVE_COMPRESSOR", "")
+# Size of the pipe buffering data between tar and the compressor
+ARCHIVE_PIPE_SIZE = int(os.getenv("ARCHIVE_PIPE_SIZE", 1024 * 1024))
+
+# Outbound message queue
+# Messages per second overall, Telegram allows bots about 30 per second in total
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", 25))
+# Messages per second (and burst size) to a single chat
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", 3))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+OUTBOX_RETRIES = int(os.getenv("OUTBOX_RETRIES", 5))
+# Seconds coalescable notifications are held before being sent as a digest
+OUTBOX_DIGEST_WINDOW = float(os.getenv("OUTBOX_DIGEST_WINDOW", 3))
+
+# Command dispatch
+# Commands waiting for a worker, per traffic class (admin and tenant)
+COMMAND_QUEUE_SIZE = int(os.getenv("COMMAND_QUEUE_SIZE", 100))
+COMMAND_ADMIN_WORKERS = int(os.getenv("COMMAND_ADMIN_WORKERS", 4))
+COMMAND_TENANT_WORKERS = int(os.getenv("COMMAND_TENANT_WORKERS", 4))
+# Commands a single tenant may have queued or running at once
+COMMAND_PENDING_PER_SENDER = int(os.getenv("COMMAND_PENDING_PER_SENDER", 3))
+# Commands per second (and burst size) a tenant may send
+COMMAND_RATE = float(os.getenv("COMMAND_RATE", 0.5))
+COMMAND_BURST = int(os.getenv("COMMAND_BURST", 5))
+# Commands that spawn processes, render files or scan whole tables, and how many may run at once
+HEAVY_COMMANDS = (
+    "/gen_report",
+    "/export",
+    "/check_disk",
+    "/run",
+    "/who",
+    "/earnings",
+    "/idle",
+    "/simulate",
+    "/import_payments",
+)
+HEAVY_COMMAND_CONCURRENCY = int(os.getenv("HEAVY_COMMAND_CONCURRENCY", 2))
+
+# Processes rendering /gen_report PDFs
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 1))
+# /simulate projections, days projected by default and at most,
+# and the probability a plan is renewed when it ends
+SIMULATION_DAYS = int(os.getenv("SIMULATION_DAYS", 90))
+SIMULATION_MAX_DAYS = int(os.getenv("SIMULATION_MAX_DAYS", 730))
+SIMULATION_RENEWAL_PROBABILITY = float(os.getenv("SIMULATION_RENEWAL_PROBABILITY", 0.7))
+# Largest statement /import_payments accepts, in bytes
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", 20 * 1024**2))
+# Rows converted per transaction by data migrations
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 1000))
+# Ledger transactions between two balance snapshots of a user
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", 50))
+# Seconds between two reconciliations of the balances with the ledger,
+# and ranges of users (of 256) verified per reconciliation
+LEDGER_RECONCILE_INTERVAL = int(os.getenv("LEDGER_RECONCILE_INTERVAL", 600))
+LEDGER_RECONCILE_RANGES = int(os.getenv("LEDGER_RECONCILE_RANGES", 16))
+# Rows read per query by /export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+# gzip level of /export files, higher is smaller but slower
+EXPORT_COMPRESSION_LEVEL = int(os.getenv("EXPORT_COMPRESSION_LEVEL", 3))
+# Seconds the results of expensive commands are reused for. Results derived from the
+# database are recomputed as soon as it changes anyway.
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", 3600))
+EARNINGS_CACHE_TTL = int(os.getenv("EARNINGS_CACHE_TTL", 3600))
+DISK_USAGE_CACHE_TTL = int(os.getenv("DISK_USAGE_CACHE_TTL", 300))
+WHO_CACHE_TTL = int(os.getenv("WHO_CACHE_TTL", 10))
+
+# Lookups cached for tenant requests (e.g. /status): entries kept in memory, and seconds
+# they're kept in Redis. Entries are dropped as soon as what they read changes anyway.
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 1024))
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL", 3600))
+
+# Change feed (Redis Stream of committed model changes). Entries it's trimmed to (about),
+# consumer groups lagging further behind resync instead
+CHANGE_FEED_MAXLEN = int(os.getenv("CHANGE_FEED_MAXLEN", 100000))
+# Entries a consumer reads at a time, and seconds it blocks waiting for new ones
+CHANGE_FEED_BATCH_SIZE = int(os.getenv("CHANGE_FEED_BATCH_SIZE", 100))
+CHANGE_FEED_BLOCK = int(os.getenv("CHANGE_FEED_BLOCK", 5))
+# Seconds between two attempts to publish or consume while Redis fails
+CHANGE_FEED_RETRY_INTERVAL = int(os.getenv("CHANGE_FEED_RETRY_INTERVAL", 5))
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics), disabled if the port is 0
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))
+
+# /list_users
+LIST_USERS_PAGE_SIZE = int(os.getenv("LIST_USERS_PAGE_SIZE", 10))
+# Number of rendered pages kept in memory
+LIST_USERS_CACHE_SIZE = int(os.getenv("LIST_USERS_CACHE_SIZE", 64))
+# Balance below which a user is listed by `/list_users low_balance`
+LOW_BALANCE_THRESHOLD = int(os.getenv("LOW_BALANCE_THRESHOLD", 100))
+
+# Days of runway (daily charges the balance covers) tenants are warned at, comma separated.
+# They're also warned once the balance no longer covers the next charge.
+RUNWAY_WARNING_DAYS = tuple(
+    int(days) for days in os.getenv("RUNWAY_WARNING_DAYS", "3,1").split(",") if days
+)
+# Users listed by /runway
+RUNWAY_LIST_SIZE = int(os.getenv("RUNWAY_LIST_SIZE", 20))
+
+# Telegram profile cache
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 5000))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 6 * 3600))
+# Seconds between two background refreshes, and profiles fetched per API call
+ENTITY_REFRESH_INTERVAL = int(os.getenv("ENTITY_REFRESH_INTERVAL", 300))
+ENTITY_REFRESH_BATCH = int(os.getenv("ENTITY_REFRESH_BATCH", 100))
+
+# /broadcast
+# Messages per second, kept below OUTBOX_RATE so broadcasts don't starve other messages
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 20))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 5))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", 3))
+# Seconds between two updates of the progress message
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 3))
+# Seconds the delivery state of a finished broadcast is kept in Redis
+BROADCAST_STATE_TTL = int(os.getenv("BROADCAST_STATE_TTL", 7 * 24 * 3600))
+
+# /run command
+# Seconds a command may run before it's killed
+RUN_TIMEOUT = int(os.getenv("RUN_TIMEOUT", 300))
+# Minimum seconds between two edits of the live output message
+RUN_EDIT_INTERVAL = float(os.getenv("RUN_EDIT_INTERVAL", 2))
+# Telegram's message length limit, longer output is sent as a compressed file
+MESSAGE_LIMIT = 4096
+
+# Prepared home directory new users get a clone of instead of /etc/skel, disabled if empty.
+# Files are reflinked on filesystems that support it (Btrfs, XFS), copied otherwise.
+HOME_TEMPLATE_DIR = os.getenv("HOME_TEMPLATE_DIR", "")
+HOME_CLONE_WORKERS = int(os.getenv("HOME_CLONE_WORKERS", 8))
+
+# Abusive process detection
+# CPU usage is measured in cores (1.0 = one fully busy CPU).
+ABUSE_SAMPLE_INTERVAL = int(os.getenv("ABUSE_SAMPLE_INTERVAL", 5))
+ABUSE_EWMA_ALPHA = float(os.getenv("ABUSE_EWMA_ALPHA", 0.05))
+ABUSE_WINDOW = int(os.getenv("ABUSE_WINDOW", 720))
+ABUSE_WARMUP_SAMPLES = int(os.getenv("ABUSE_WARMUP_SAMPLES", 60))
+ABUSE_STDDEV_FACTOR = float(os.getenv("ABUSE_STDDEV_FACTOR", 3))
+ABUSE_PERCENTILE = float(os.getenv("ABUSE_PERCENTILE", 99))
+ABUSE_MIN_CPU = float(os.getenv("ABUSE_MIN_CPU", 0.8))
+ABUSE_HARD_CPU = float(os.getenv("ABUSE_HARD_CPU", 3.5))
+ABUSE_SUSTAIN_SAMPLES = int(os.getenv("ABUSE_SUSTAIN_SAMPLES", 24))
+# Action taken automatically when a user is flagged: "", "renice", "freeze" or "throttle"
+ABUSE_AUTO_ACTION = os.getenv("ABUSE_AUTO_ACTION", "")
+ABUSE_THROTTLE_CPU = int(os.getenv("ABUSE_THROTTLE_CPU", 25))
+ABUSE_IGNORE_PERIOD = int(os.getenv("ABUSE_IGNORE_PERIOD", 6 * 3600))
+
+# Idle rental detection
+IDLE_CHECK_INTERVAL = int(os.getenv("IDLE_CHECK_INTERVAL", 15))
+IDLE_PERIOD = int(os.getenv("IDLE_PERIOD", 48 * 3600))
+IDLE_CPU_THRESHOLD = float(os.getenv("IDLE_CPU_THRESHOLD", 0.05))
+# Freeze the processes of idle rentals until the tenant logs in again
+IDLE_AUTO_SUSPEND = os.getenv("IDLE_AUTO_SUSPEND", "0") == "1"
+
+# Resource limits per plan tier.
+# cpu_max is a percentage of a single CPU (200 = two full cores),
+# memory_max and io_max are in bytes and bytes per second respectively.
+PLAN_TIERS = {
+    "basic": {
+        "cpu_weight": 50,
+        "cpu_max": 100,
+        "memory_max": 2 * 1024**3,
+        "io_max": 50 * 1024**2,
+    },
+    "standard": {
+        "cpu_weight": 100,
+        "cpu_max": 200,
+        "memory_max": 4 * 1024**3,
+        "io_max": 100 * 1024**2,
+    },
+    "pro": {
+        "cpu_weight": 200,
+        "cpu_max": 400,
+        "memory_max": 8 * 1024**3,
+        "io_max": 200 * 1024**2,
+    },
+}
+DEFAULT_PLAN_TIER = os.getenv("DEFAULT_PLAN_TIER", "standard")
+
 ADJECTIVES = [
     "crazy",
     "sunny",
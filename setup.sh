@@ -39,4 +39,8 @@ echo "deb [signed-by=/usr/share/keyrings/redis-archive-keyring.gpg] https://pack
 sudo apt-get update
 sudo apt-get install redis -y
 
+# Move tenant logins into their rental's cgroup as soon as they open
+echo "To confine SSH logins right away, add this line to /etc/pam.d/sshd:"
+echo "session optional pam_exec.so $(command -v python3) $(pwd)/models/engine/cgroup_attach.py"
+
 echo -e "\e[32mSetup complete. Run 'source venv/bin/activate' to activate the virtual environment\e[0m"
@@ -0,0 +1,36 @@
+"""
+Points the bot at a throwaway SQLite database in a temporary directory, which also becomes the
+working directory (for the Telegram session and the log file), before any test imports
+`models`. Missing Telegram and SSH settings get dummy values; nothing connects to Telegram or Redis.
+Foreign keys are enforced.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+WORK_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["DB_STRING"] = f"sqlite:///{os.path.join(WORK_DIR, 'tests.sqlite')}"
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "tests",
+    "BOT_TOKEN": "tests",
+    "ADMIN_ID": "1",
+    "SSH_PORT": "22",
+    "SSH_HOSTNAME": "localhost",
+    "GROUP_ID": "0",
+}.items():
+    os.environ.setdefault(key, value)
+os.chdir(WORK_DIR)
+
+
+@event.listens_for(Engine, "connect")
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    """
+    Enforce foreign keys like other databases do, which SQLite only does when asked to.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
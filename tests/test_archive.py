@@ -0,0 +1,66 @@
+import asyncio
+import os
+import tarfile
+
+import pytest
+
+from models import archive
+from models.archive import HomeArchiver
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    """An archive directory holding archives of `dev` and of `dev-2`."""
+    path = tmp_path / "archives"
+    path.mkdir()
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(path))
+    return path
+
+
+def make_archive(archive_dir, file_name, *tops):
+    """Write a gzipped tarball with a file in each of the given top-level directories."""
+    source = archive_dir.parent / "source"
+    with tarfile.open(archive_dir / file_name, "w:gz") as tar:
+        for top in tops:
+            (source / top).mkdir(parents=True, exist_ok=True)
+            (source / top / ".bashrc").write_text(f"# {top}\n")
+            tar.add(source / top, arcname=top)
+    return str(archive_dir / file_name)
+
+
+def test_find_archive(archive_dir):
+    older = make_archive(archive_dir, "dev-1700000000.tar.gz", "dev")
+    latest = make_archive(archive_dir, "dev-1700000050.tar.gz", "dev")
+    other = make_archive(archive_dir, "dev-2-1700000100.tar.gz", "dev-2")
+    make_archive(archive_dir, "dev-1700000200.tar.gz.partial", "dev")
+
+    assert HomeArchiver.find_archive("dev") == latest
+    assert HomeArchiver.find_archive("dev-2") == other
+    assert HomeArchiver.find_archive("de") is None
+    # Named archives must belong to the user too
+    assert HomeArchiver.find_archive("dev", os.path.basename(older)) == older
+    assert HomeArchiver.find_archive("dev", "dev-2-1700000100.tar.gz") is None
+    assert HomeArchiver.find_archive("dev", "../dev-1700000000.tar.gz") == older
+
+
+def test_find_archive_without_archives(archive_dir):
+    os.rmdir(archive_dir)
+
+    assert HomeArchiver.find_archive("dev") is None
+
+
+def test_verify_entries(archive_dir):
+    own = make_archive(archive_dir, "dev-1700000000.tar.gz", "dev")
+    mixed = make_archive(archive_dir, "dev-1700000050.tar.gz", "dev", "dev-2")
+
+    assert asyncio.run(HomeArchiver.verify(own, "dev")) == 2
+    assert asyncio.run(HomeArchiver.verify(mixed)) == 4
+    assert asyncio.run(HomeArchiver.verify(mixed, "dev")) is None
+
+
+def test_restore_refuses_foreign_entries(archive_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "HOME_ROOT", str(tmp_path / "home"))
+    path = make_archive(archive_dir, "dev-1700000000.tar.gz", "dev-2")
+
+    assert not asyncio.run(HomeArchiver.restore("dev", path))
+    assert not (tmp_path / "home").exists()
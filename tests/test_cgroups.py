@@ -0,0 +1,124 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from models import cgroups
+from models.cgroups import CgroupManager
+from models.engine import cgroup_attach
+from models.processes import ProcessInspector
+
+LIMITS = {"cpu_weight": 200, "cpu_max": 150, "memory_max": 2**30, "io_max": None}
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """A plain directory tree standing in for a cgroup v2 hierarchy."""
+    (tmp_path / "cgroup.controllers").write_text("cpu io memory pids\n")
+    (tmp_path / "cgroup.procs").write_text("")
+    monkeypatch.setattr(cgroups, "CGROUP_ROOT", str(tmp_path))
+    monkeypatch.setattr(cgroups, "CGROUP_PARENT", "rentals")
+    monkeypatch.setattr(cgroups, "CGROUP_IO_DEVICE", "8:0")
+    return tmp_path
+
+
+def test_apply_limits(root):
+    assert asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+
+    assert (root / "cgroup.subtree_control").read_text() == "+cpu +memory +io"
+    assert (root / "rentals" / "cgroup.subtree_control").read_text() == (
+        "+cpu +memory +io"
+    )
+    slice_path = root / "rentals" / "alice"
+    assert (slice_path / "cpu.weight").read_text() == "200"
+    assert (slice_path / "cpu.max").read_text() == "150000 100000"
+    assert (slice_path / "memory.max").read_text() == str(2**30)
+    assert (slice_path / "io.max").read_text() == "8:0 rbps=max wbps=max"
+
+
+def test_apply_limits_without_cgroup_v2(root):
+    (root / "cgroup.controllers").unlink()
+
+    assert not asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    assert not (root / "rentals").exists()
+
+
+def test_attach_user_processes(root, monkeypatch):
+    asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    procs = root / "rentals" / "alice" / "cgroup.procs"
+    procs.write_text("100\n")
+    monkeypatch.setattr(
+        ProcessInspector, "get_user_pids", classmethod(lambda cls, uid: [100, 101])
+    )
+
+    assert asyncio.run(CgroupManager.attach_user_processes("alice", 1001)) == 1
+    assert procs.read_text() == "101"
+    # Users without a rental cgroup are left alone
+    assert asyncio.run(CgroupManager.attach_user_processes("bob", 1002)) == 0
+
+
+def test_throttle_and_freeze(root):
+    asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    slice_path = root / "rentals" / "alice"
+    (slice_path / "cgroup.freeze").write_text("0")
+
+    assert asyncio.run(CgroupManager.throttle_cpu("alice", 20))
+    assert (slice_path / "cpu.max").read_text() == "20000 100000"
+    assert asyncio.run(CgroupManager.set_frozen("alice", True))
+    assert (slice_path / "cgroup.freeze").read_text() == "1"
+    assert not asyncio.run(CgroupManager.set_frozen("bob", True))
+
+
+def test_release_slice(root):
+    asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    (root / "rentals" / "alice" / "cgroup.procs").write_text("200\n")
+
+    assert asyncio.run(CgroupManager.release_slice("alice"))
+    assert not (root / "rentals" / "alice").exists()
+    # Processes left in the slice are handed back to the root cgroup
+    assert (root / "cgroup.procs").read_text() == "200"
+    # Releasing a missing slice succeeds
+    assert asyncio.run(CgroupManager.release_slice("alice"))
+
+
+def test_attach_at_login(root):
+    asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    procs = root / "rentals" / "alice" / "cgroup.procs"
+
+    assert cgroup_attach.attach(str(root), "rentals", "alice", 300)
+    assert procs.read_text() == "300"
+    assert not cgroup_attach.attach(str(root), "rentals", "bob", 301)
+    assert not cgroup_attach.attach(str(root), "rentals", "../rentals", 302)
+
+    (root / "rentals" / "alice" / "cgroup.freeze").write_text("1\n")
+    assert not cgroup_attach.attach(str(root), "rentals", "alice", 303)
+    assert procs.read_text() == "300"
+
+
+def test_attach_at_login_from_pam(root):
+    asyncio.run(CgroupManager.apply_limits("alice", LIMITS))
+    script = cgroup_attach.__file__
+    env = dict(os.environ, PAM_USER="alice", PAM_TYPE="open_session")
+
+    subprocess.run(
+        [sys.executable, script, "--root", str(root), "--pid", "400"],
+        env=env,
+        check=True,
+    )
+    assert (root / "rentals" / "alice" / "cgroup.procs").read_text() == "400"
+
+    # Only opening sessions are moved, and failures never fail the login
+    env["PAM_TYPE"] = "close_session"
+    subprocess.run(
+        [sys.executable, script, "--root", str(root), "--pid", "401"],
+        env=env,
+        check=True,
+    )
+    assert (root / "rentals" / "alice" / "cgroup.procs").read_text() == "400"
+    subprocess.run(
+        [sys.executable, script, "--root", str(root / "missing"), "--pid", "402"],
+        env=dict(env, PAM_TYPE="open_session"),
+        check=True,
+    )
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+from models.change_feed import ChangeFeed
+
+# The module, shadowed in `models` by the bot's feed
+SCRIPT = sys.modules[ChangeFeed.__module__].__file__
+
+
+def test_command_line_without_the_bot_environment(tmp_path):
+    # Neither the bot's settings nor a database, as for a consumer on another host
+    env = {"PATH": os.environ["PATH"]}
+
+    result = subprocess.run(
+        [sys.executable, SCRIPT, "--help"],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "--group" in result.stdout
+    assert not os.listdir(tmp_path)
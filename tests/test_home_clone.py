@@ -0,0 +1,115 @@
+import os
+import pwd
+import stat
+import subprocess
+import sys
+
+import pytest
+
+from models.engine import home_clone
+from models.engine.home_clone import HomeCloner
+
+OWNER = (4242, 4343)
+
+
+@pytest.fixture
+def template(tmp_path):
+    """A template home directory with nested files, modes and symlinks."""
+    root = tmp_path / "template"
+    (root / ".config" / "app").mkdir(parents=True)
+    (root / ".bashrc").write_text("export PS1='$ '\n")
+    (root / ".config" / "app" / "settings.json").write_text('{"theme": "dark"}')
+    script = root / "bin" / "hello"
+    script.parent.mkdir()
+    script.write_bytes(b"#!/bin/sh\necho hello\n" * 1000)
+    script.chmod(0o750)
+    (root / ".ssh").mkdir(mode=0o700)
+    (root / ".ssh").chmod(0o700)
+    (root / ".ssh" / "authorized_keys").write_text("")
+    (root / ".ssh" / "authorized_keys").chmod(0o600)
+    os.symlink(".config/app/settings.json", root / "settings.json")
+    os.symlink("/nonexistent/target", root / "dangling")
+    os.symlink("bin", root / "scripts")
+    os.utime(root / ".bashrc", (1_600_000_000, 1_600_000_000))
+    return root
+
+
+def test_clone(template, tmp_path):
+    home = tmp_path / "home" / "alice"
+
+    stats = HomeCloner(workers=4).clone(str(template), str(home))
+
+    assert stats["files"] == 4
+    assert stats["reflinked"] + stats["copied"] == 4
+    assert stats["bytes"] == sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(template)
+        for name in names
+        if not os.path.islink(os.path.join(root, name))
+    )
+    assert (home / "bin" / "hello").read_bytes() == (
+        template / "bin" / "hello"
+    ).read_bytes()
+    assert (home / ".config" / "app" / "settings.json").read_text() == (
+        '{"theme": "dark"}'
+    )
+
+    # Modes and timestamps are preserved
+    assert stat.S_IMODE((home / "bin" / "hello").stat().st_mode) == 0o750
+    assert stat.S_IMODE((home / ".ssh").stat().st_mode) == 0o700
+    assert stat.S_IMODE((home / ".ssh" / "authorized_keys").stat().st_mode) == 0o600
+    assert (home / ".bashrc").stat().st_mtime == 1_600_000_000
+
+    # Symlinks are recreated as they are, not followed
+    assert os.readlink(home / "settings.json") == ".config/app/settings.json"
+    assert os.readlink(home / "dangling") == "/nonexistent/target"
+    assert os.readlink(home / "scripts") == "bin"
+    assert not (home / "bin").is_symlink()
+
+
+def test_clone_skips_special_files(template, tmp_path):
+    os.mkfifo(template / "fifo")
+    home = tmp_path / "alice"
+
+    stats = HomeCloner().clone(str(template), str(home))
+
+    assert stats["files"] == 4
+    assert not (home / "fifo").exists()
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="changing ownership requires root")
+def test_clone_owner(template, tmp_path):
+    home = tmp_path / "alice"
+
+    HomeCloner(owner=OWNER).clone(str(template), str(home))
+
+    for root, dirs, names in os.walk(home):
+        for path in [root] + [os.path.join(root, name) for name in dirs + names]:
+            info = os.lstat(path)
+            assert (info.st_uid, info.st_gid) == OWNER, path
+    # The template is left untouched
+    assert os.lstat(template / "settings.json").st_uid == os.geteuid()
+
+
+def test_command_line(template, tmp_path):
+    home = tmp_path / "alice"
+    owner = pwd.getpwuid(os.geteuid()).pw_name
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            home_clone.__file__,
+            str(template),
+            str(home),
+            "--owner",
+            owner,
+            "--workers",
+            "2",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.startswith("files=4 ")
+    assert (home / ".bashrc").read_text() == "export PS1='$ '\n"
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select, update
+
+from models import storage
+from models.commands.user import UserRoutes
+from models.ledger import Ledger, LedgerEntry
+from models.misc import SystemUserManager
+from models.money import BASE_CURRENCY, Money
+from models.payments import Payment
+from models.users import User
+
+
+class Event:
+    """Stands in for a Telethon message event, recording the responses."""
+
+    def __init__(self, text):
+        self.message = type("Message", (), {"text": text})()
+        self.chat_id = 1
+        self.responses = []
+
+    async def respond(self, message, *args, **kwargs):
+        self.responses.append(message)
+
+
+@pytest.fixture
+def failing_adduser(monkeypatch):
+    async def create_user(username, password, limits=None):
+        raise RuntimeError("adduser failed")
+
+    monkeypatch.setattr(SystemUserManager, "create_user", staticmethod(create_user))
+
+
+def ledger_entries(user_id):
+    count = storage.execute(
+        select(func.count()).where(LedgerEntry.user_id == user_id)
+    ).scalar()
+    storage.close()
+    return count
+
+
+async def create_user(text):
+    event = Event(text)
+    async with storage.unit_of_work():
+        await UserRoutes().create_user(event)
+    return event
+
+
+def test_failed_create_user_posts_nothing(failing_adduser):
+    event = asyncio.run(create_user("/create_user alice 7d 500 INR"))
+
+    assert "Error creating user" in event.responses[-1]
+    assert storage.query_object("User", linux_username="alice") is None
+    assert storage.count(LedgerEntry) == 0
+    storage.close()
+
+
+def test_failed_recreate_keeps_zombie(failing_adduser):
+    user = User(linux_username="bob", linux_password="old", balance_minor=25000)
+    user.deleted = 1
+    storage.new(user)
+    storage.save()
+    storage.close()
+
+    event = asyncio.run(create_user("/create_user bob 7d 500 INR"))
+
+    assert "Error creating user" in event.responses[-1]
+    user = storage.query_object("User", linux_username="bob")
+    assert (user.deleted, user.linux_password, user.balance_minor) == (1, "old", 25000)
+    storage.close()
+    # Neither the balance reset nor the credit is in the ledger
+    assert ledger_entries(user.id) == 0
+
+
+def test_checksums_cover_ledger_entries():
+    user = User(linux_username="carol", linux_password="secret", balance_minor=0)
+    storage.new(user)
+    asyncio.run(user.update_balance(Money(100, BASE_CURRENCY), "credit"))
+    storage.save()
+    storage.close()
+    prefix = user.id[:2]
+    before = Ledger.checksums()[prefix]
+    assert not Ledger.verify_range(prefix)
+
+    # An entry changed behind the ledger's back, with the balances left as they were
+    storage.execute(
+        update(LedgerEntry)
+        .where(LedgerEntry.user_id == user.id, LedgerEntry.account == Ledger.TENANT)
+        .values(amount_minor=LedgerEntry.amount_minor + 1)
+    )
+    storage.save()
+    storage.close()
+
+    assert Ledger.checksums()[prefix] != before
+    assert Ledger.verify_range(prefix)
+    storage.close()
+
+
+def test_credit_new_user():
+    async def credit():
+        async with storage.unit_of_work():
+            user = User(linux_username="dave", linux_password="secret", balance=0)
+            payment = await Payment.create(
+                user_id=user.id, amount="500", currency="INR"
+            )
+            await user.update_balance(payment.amount, "credit", payment_id=payment.id)
+            user.save()
+            payment.save()
+        return user
+
+    user = asyncio.run(credit())
+
+    assert storage.get(User, user.id).balance_minor == 50000
+    assert ledger_entries(user.id) == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from models.messaging import Outbox
+
+BROKEN_CHAT = 13
+
+
+class FakeRedis:
+    """The Redis hash commands the outbox uses, in memory."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    async def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+
+class FakeClient:
+    """Sends to every chat but one, which fails with an unexpected error."""
+
+    def __init__(self):
+        self.sent = []
+
+    def is_connected(self):
+        return True
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == BROKEN_CHAT:
+            raise TypeError("Unexpected")
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_unexpected_error_completes_the_message():
+    async def run():
+        client = FakeClient()
+        redis = FakeRedis()
+        outbox = Outbox(client)
+        await outbox.start(redis)
+
+        with pytest.raises(TypeError):
+            await asyncio.wait_for(outbox.deliver(BROKEN_CHAT, "Hello"), 5)
+        # The message is forgotten, not replayed on the next start
+        assert not redis.hashes[Outbox.BACKLOG_KEY]
+        assert outbox.stats["failed"] == 1
+
+        # And the outbox keeps sending
+        assert await asyncio.wait_for(outbox.deliver(14, "Hello"), 5) == "Hello"
+        assert client.sent == [(14, "Hello")]
+
+    asyncio.run(run())
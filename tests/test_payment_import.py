@@ -0,0 +1,65 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from models import storage
+from models.ledger import Ledger, LedgerEntry
+from models.payment_import import PaymentImporter
+from models.payments import Payment
+from models.users import User
+
+USERNAMES = ("erin", "frank", "grace")
+
+
+def test_import(tmp_path):
+    for username in USERNAMES:
+        storage.new(User(linux_username=username, linux_password="secret", balance=0))
+    storage.save()
+    storage.close()
+    path = tmp_path / "statement.csv"
+    path.write_text(
+        "Transaction ID,Remarks,Amount,Date\n"
+        + "".join(
+            f'TXN{i},UPI/{USERNAMES[i % 3]}/rent,"₹1,00{i % 10}.00",2025-01-{i + 1:02d}\n'
+            for i in range(20)
+        )
+        # Rejected: a repeated transaction ID and an unknown user
+        + "TXN0,UPI/erin/rent,500,2025-01-01\n"
+        + "TXN99,UPI/mallory/rent,500,2025-01-01\n"
+    )
+
+    importer = PaymentImporter(str(path))
+    importer.parse()
+    asyncio.run(importer.apply())
+
+    assert importer.imported == 20
+    assert len(importer.errors) == 2
+    payment_ids = (
+        storage.execute(select(Payment.id).where(Payment.transaction_id.like("TXN%")))
+        .scalars()
+        .all()
+    )
+    assert len(payment_ids) == 20
+    users = {
+        user.linux_username: user
+        for user in storage.all(User).values()
+        if user.linux_username in USERNAMES
+    }
+    # TXN0, TXN3, ... TXN18 for erin: 7 payments
+    assert users["erin"].balance_minor == sum(
+        100000 + (i % 10) * 100 for i in range(0, 20, 3)
+    )
+    assert users["erin"].ledger_seq == 7
+    assert (
+        storage.execute(
+            select(func.count()).where(LedgerEntry.payment_id.in_(payment_ids))
+        ).scalar()
+        == 40
+    )
+    storage.close()
+    # The balances match the ledger
+    for user in users.values():
+        assert user.linux_username not in {
+            mismatch[0] for mismatch in Ledger.verify_range(user.id[:2])
+        }
+    storage.close()